@@ -0,0 +1,100 @@
+# Generated by Django 4.2.28 on 2026-10-18 09:30
+
+from django.db import migrations, models
+from django.db.utils import OperationalError
+import django.db.models.deletion
+
+FTS_TABLE = 'patients_fts'
+MYSQL_INDEX = 'ft_patients_search'
+SEARCH_COLUMNS = 'first_name, last_name, phone, patient_id'
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                f"{SEARCH_COLUMNS}, content='patients', content_rowid='id', prefix='2 3 4')"
+            )
+        except OperationalError:
+            # SQLite built without FTS5: fall back to the token table.
+            build_tokens(apps)
+            return
+        create_search_triggers(schema_editor)
+        schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    elif connection.vendor == 'mysql':
+        schema_editor.execute(
+            f"ALTER TABLE patients ADD FULLTEXT INDEX {MYSQL_INDEX} "
+            f"({SEARCH_COLUMNS}) WITH PARSER ngram"
+        )
+    else:
+        build_tokens(apps)
+
+
+def create_search_triggers(schema_editor):
+    schema_editor.execute(
+        f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON patients BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, {SEARCH_COLUMNS}) "
+        f"VALUES (new.id, new.first_name, new.last_name, new.phone, new.patient_id); END"
+    )
+    schema_editor.execute(
+        f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON patients BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {SEARCH_COLUMNS}) "
+        f"VALUES ('delete', old.id, old.first_name, old.last_name, old.phone, old.patient_id); END"
+    )
+    schema_editor.execute(
+        f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF {SEARCH_COLUMNS} ON patients BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {SEARCH_COLUMNS}) "
+        f"VALUES ('delete', old.id, old.first_name, old.last_name, old.phone, old.patient_id); "
+        f"INSERT INTO {FTS_TABLE}(rowid, {SEARCH_COLUMNS}) "
+        f"VALUES (new.id, new.first_name, new.last_name, new.phone, new.patient_id); END"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif connection.vendor == 'mysql':
+        schema_editor.execute(f"ALTER TABLE patients DROP INDEX {MYSQL_INDEX}")
+
+
+def build_tokens(apps):
+    import re
+    Patient = apps.get_model('patients', 'Patient')
+    PatientSearchToken = apps.get_model('patients', 'PatientSearchToken')
+    batch = []
+    fields = ('first_name', 'last_name', 'phone', 'patient_id')
+    for row in Patient.objects.values_list('pk', *fields).iterator(chunk_size=2000):
+        tokens = {t.lower()[:64] for value in row[1:] for t in re.findall(r'\w+', value or '')}
+        batch.extend(PatientSearchToken(patient_id=row[0], token=token) for token in tokens)
+        if len(batch) >= 5000:
+            PatientSearchToken.objects.bulk_create(batch)
+            batch = []
+    PatientSearchToken.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0002_patientidsequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='patients.patient')),
+            ],
+            options={
+                'db_table': 'patient_search_tokens',
+                'indexes': [models.Index(fields=['token', 'patient'], name='patient_search_token_idx')],
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.28 on 2026-10-18 10:30
+
+from datetime import datetime, time
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.utils.timezone
+
+
+def build_census(apps, schema_editor):
+    Patient = apps.get_model('patients', 'Patient')
+    PatientCensus = apps.get_model('patients', 'PatientCensus')
+    today = timezone.localdate()
+    total = Patient.objects.count()
+    admitted = Patient.objects.filter(is_admitted=True).count()
+    new_today = Patient.objects.filter(
+        created_at__gte=timezone.make_aware(datetime.combine(today, time.min))
+    ).count()
+    PatientCensus.objects.create(
+        pk=1, total=total, admitted=admitted, discharged=total - admitted,
+        new_today=new_today, census_date=today,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0004_indexversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientCensus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.IntegerField(default=0)),
+                ('admitted', models.IntegerField(default=0)),
+                ('discharged', models.IntegerField(default=0)),
+                ('new_today', models.IntegerField(default=0)),
+                ('census_date', models.DateField(default=django.utils.timezone.localdate)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'patient_census',
+            },
+        ),
+        migrations.RunPython(build_census, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.28 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0005_patientcensus'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['-created_at', 'id'], name='patients_created_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.2.28 on 2026-10-18 11:30
+
+import re
+
+from django.db import migrations, models
+
+BLOOD_PRESSURE_RE = re.compile(r'(\d{2,3})\s*/\s*(\d{2,3})')
+NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+
+
+def _number(text):
+    match = NUMBER_RE.search(text or '')
+    if not match:
+        return None
+    value = round(float(match.group()))
+    return value if 0 <= value <= 32767 else None
+
+
+def backfill_readings(apps, schema_editor):
+    PatientVitals = apps.get_model('patients', 'PatientVitals')
+    fields = ['systolic', 'diastolic', 'pulse', 'spo2']
+    last_pk = 0
+    while True:
+        chunk = list(
+            PatientVitals.objects.filter(pk__gt=last_pk).order_by('pk')
+            .only('pk', 'blood_pressure', 'pulse_rate', 'oxygen_saturation')[:2000]
+        )
+        if not chunk:
+            break
+        for vitals in chunk:
+            match = BLOOD_PRESSURE_RE.search(vitals.blood_pressure or '')
+            if match:
+                vitals.systolic, vitals.diastolic = int(match.group(1)), int(match.group(2))
+            vitals.pulse = _number(vitals.pulse_rate)
+            vitals.spo2 = _number(vitals.oxygen_saturation)
+        PatientVitals.objects.bulk_update(chunk, fields)
+        last_pk = chunk[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0006_patient_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientvitals',
+            name='systolic',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='patientvitals',
+            name='diastolic',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='patientvitals',
+            name='pulse',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='patientvitals',
+            name='spo2',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='SpO2'),
+        ),
+        migrations.AddIndex(
+            model_name='patientvitals',
+            index=models.Index(fields=['patient', 'recorded_at'], name='vitals_patient_recorded_idx'),
+        ),
+        migrations.RunPython(backfill_readings, migrations.RunPython.noop),
+    ]
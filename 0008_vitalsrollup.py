@@ -0,0 +1,89 @@
+# Generated by Django 4.2.28 on 2026-10-18 12:00
+
+from django.db import migrations, models
+from django.db.models import Count, FloatField, Max, Min, Sum
+from django.db.models.functions import Trunc
+import django.db.models.deletion
+
+READINGS = ('systolic', 'diastolic', 'pulse', 'spo2', 'temperature')
+
+
+def build_rollups(apps, schema_editor):
+    PatientVitals = apps.get_model('patients', 'PatientVitals')
+    VitalsRollup = apps.get_model('patients', 'VitalsRollup')
+    hourly = {'readings': Count('pk')}
+    daily = {'readings': Sum('readings')}
+    for name in READINGS:
+        hourly.update({
+            f'{name}_min': Min(name), f'{name}_max': Max(name),
+            f'{name}_sum': Sum(name, output_field=FloatField()), f'{name}_count': Count(name),
+        })
+        daily.update({
+            f'{name}_min': Min(f'{name}_min'), f'{name}_max': Max(f'{name}_max'),
+            f'{name}_sum': Sum(f'{name}_sum'), f'{name}_count': Sum(f'{name}_count'),
+        })
+    sources = (
+        ('hour', 'recorded_at', PatientVitals.objects.all(), hourly),
+        ('day', 'bucket_start', VitalsRollup.objects.filter(granularity='hour'), daily),
+    )
+    for granularity, field, source, aggregates in sources:
+        rows = source.annotate(bucket=Trunc(field, granularity)).values('patient_id', 'bucket').annotate(
+            **aggregates
+        ).order_by()
+        batch = []
+        for row in rows.iterator(chunk_size=2000):
+            batch.append(VitalsRollup(granularity=granularity, bucket_start=row.pop('bucket'), **row))
+            if len(batch) == 2000:
+                VitalsRollup.objects.bulk_create(batch)
+                batch = []
+        VitalsRollup.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0007_vitals_typed_readings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VitalsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('systolic_min', models.FloatField(blank=True, null=True)),
+                ('systolic_max', models.FloatField(blank=True, null=True)),
+                ('systolic_sum', models.FloatField(blank=True, null=True)),
+                ('systolic_count', models.PositiveIntegerField(default=0)),
+                ('diastolic_min', models.FloatField(blank=True, null=True)),
+                ('diastolic_max', models.FloatField(blank=True, null=True)),
+                ('diastolic_sum', models.FloatField(blank=True, null=True)),
+                ('diastolic_count', models.PositiveIntegerField(default=0)),
+                ('pulse_min', models.FloatField(blank=True, null=True)),
+                ('pulse_max', models.FloatField(blank=True, null=True)),
+                ('pulse_sum', models.FloatField(blank=True, null=True)),
+                ('pulse_count', models.PositiveIntegerField(default=0)),
+                ('spo2_min', models.FloatField(blank=True, null=True)),
+                ('spo2_max', models.FloatField(blank=True, null=True)),
+                ('spo2_sum', models.FloatField(blank=True, null=True)),
+                ('spo2_count', models.PositiveIntegerField(default=0)),
+                ('temperature_min', models.FloatField(blank=True, null=True)),
+                ('temperature_max', models.FloatField(blank=True, null=True)),
+                ('temperature_sum', models.FloatField(blank=True, null=True)),
+                ('temperature_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vitals_rollups', to='patients.patient')),
+            ],
+            options={
+                'db_table': 'patient_vitals_rollups',
+                'ordering': ['bucket_start'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='vitalsrollup',
+            constraint=models.UniqueConstraint(fields=('patient', 'granularity', 'bucket_start'), name='vitals_rollup_bucket_uniq'),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
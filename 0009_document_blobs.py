@@ -0,0 +1,79 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:40
+
+import os
+
+import apps.patients.models
+import apps.patients.storage
+from apps.patients.storage import ContentAddressedStorage
+from django.db import migrations, models, transaction
+import django.db.models.deletion
+
+
+def dedupe_documents(apps, schema_editor):
+    PatientDocument = apps.get_model('patients', 'PatientDocument')
+    DocumentBlob = apps.get_model('patients', 'DocumentBlob')
+    storage = ContentAddressedStorage()
+    blob_ids = {}
+    moved = set()
+    documents = PatientDocument.objects.filter(blob__isnull=True).exclude(file='')
+    for document in documents.iterator(chunk_size=500):
+        old = document.file.name
+        if not storage.exists(old):
+            continue
+        with storage.open(old) as fh:
+            name = storage.save(old, fh)
+        digest = storage.digest(name)
+        if digest not in blob_ids:
+            blob, _ = DocumentBlob.objects.get_or_create(sha256=digest, defaults={'size': storage.size(name)})
+            blob_ids[digest] = blob.pk
+        document.file.name = name
+        document.original_filename = document.original_filename or os.path.basename(old)[:255]
+        document.blob_id = blob_ids[digest]
+        document.save(update_fields=['file', 'original_filename', 'blob'])
+        moved.add(old)
+    for pk in blob_ids.values():
+        DocumentBlob.objects.filter(pk=pk).update(refcount=PatientDocument.objects.filter(blob_id=pk).count())
+
+    def remove_originals():
+        for old in moved:
+            storage.delete(old)
+    transaction.on_commit(remove_originals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0008_vitalsrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'patient_document_blobs',
+            },
+        ),
+        migrations.AddField(
+            model_name='patientdocument',
+            name='original_filename',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='patientdocument',
+            name='file',
+            field=models.FileField(storage=apps.patients.storage.ContentAddressedStorage(), upload_to=apps.patients.models.patient_document_path),
+        ),
+        migrations.AddField(
+            model_name='patientdocument',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='documents', to='patients.documentblob'),
+        ),
+        migrations.RunPython(dedupe_documents, migrations.RunPython.noop),
+    ]
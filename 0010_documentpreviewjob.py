@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0009_document_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentPreviewJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('blob', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='preview_job', to='patients.documentblob')),
+            ],
+            options={
+                'db_table': 'patient_document_preview_jobs',
+                'indexes': [models.Index(fields=['status', 'created_at'], name='preview_job_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0011_pendingfiledeletion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['updated_at'], name='patients_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('patients', '0012_patient_updated_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientAccessEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('view', 'Viewed'), ('history', 'Viewed history'), ('update', 'Updated'), ('delete', 'Deleted'), ('download', 'Downloaded document'), ('batch', 'Fetched in batch')], max_length=10)),
+                ('detail', models.CharField(blank=True, max_length=100)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('occurred_at', models.DateTimeField()),
+                ('patient', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='patients.patient')),
+                ('user', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'patient_access_events',
+                'indexes': [models.Index(fields=['patient', '-occurred_at'], name='access_event_patient_idx'), models.Index(fields=['user', '-occurred_at'], name='access_event_user_idx')],
+            },
+        ),
+    ]
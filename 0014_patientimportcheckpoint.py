@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0013_patientaccessevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientImportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=500, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('position', models.PositiveBigIntegerField(default=0)),
+                ('created', models.PositiveIntegerField(default=0)),
+                ('errors', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'patient_import_checkpoints',
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0014_patientimportcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientvitals',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='patientvitals',
+            index=models.Index(fields=['patient', 'updated_at'], name='vitals_patient_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:40
+
+from importlib import import_module
+
+from django.db import migrations
+from django.db.utils import OperationalError
+
+FTS_TABLE = 'patients_fts'
+SEARCH_COLUMNS = 'first_name, last_name, phone, patient_id'
+
+
+def word_index():
+    return import_module('.0003_patient_search', __package__)
+
+
+def create_trigram_index(apps, schema_editor):
+    """Substring matching: FTS5's trigram tokenizer, or trigram rows in the token table."""
+    connection = schema_editor.connection
+    if connection.vendor == 'mysql':
+        # The ngram FULLTEXT index already matches substrings.
+        return
+    PatientSearchToken = apps.get_model('patients', 'PatientSearchToken')
+    PatientSearchToken.objects.all().delete()
+    if connection.vendor == 'sqlite':
+        word_index().drop_search_index(apps, schema_editor)
+        try:
+            # SQLite 3.34+.
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                f"{SEARCH_COLUMNS}, content='patients', content_rowid='id', tokenize='trigram')"
+            )
+        except OperationalError:
+            build_grams(apps)
+            return
+        word_index().create_search_triggers(schema_editor)
+        schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        return
+    build_grams(apps)
+
+
+def restore_word_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'mysql':
+        return
+    PatientSearchToken = apps.get_model('patients', 'PatientSearchToken')
+    PatientSearchToken.objects.all().delete()
+    if connection.vendor == 'sqlite':
+        word_index().drop_search_index(apps, schema_editor)
+    word_index().create_search_index(apps, schema_editor)
+
+
+def build_grams(apps):
+    import re
+    Patient = apps.get_model('patients', 'Patient')
+    PatientSearchToken = apps.get_model('patients', 'PatientSearchToken')
+    batch = []
+    fields = ('first_name', 'last_name', 'phone', 'patient_id')
+    for row in Patient.objects.values_list('pk', *fields).iterator(chunk_size=2000):
+        words = {t.lower() for value in row[1:] for t in re.findall(r'\w+', value or '')}
+        tokens = {word[start:start + 3] for word in words for start in range(len(word))}
+        batch.extend(PatientSearchToken(patient_id=row[0], token=token) for token in tokens)
+        if len(batch) >= 5000:
+            PatientSearchToken.objects.bulk_create(batch)
+            batch = []
+    PatientSearchToken.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0015_vitals_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, restore_word_index),
+    ]
@@ -0,0 +1,206 @@
+"""
+Versioned response cache for the patient API.
+
+A cached body is stored under the current version token of every
+namespace it depends on:
+
+* `patients`       - list and search (any patient saved or deleted)
+* `patient:<pk>`   - one patient's detail
+* `vitals:<pk>`    - one patient's vitals pages
+
+Saves and deletes replace the affected tokens when their transaction
+commits, so stale entries are never read again. No TTL has to be guessed;
+entries nobody asks for simply age out. A missing token is recreated at
+random, never reset to an old value. That makes an evicted token as safe
+as a bumped one.
+
+The cache backend (PATIENT_API_CACHE) must be shared by all workers.
+FileBasedCache works on one host; Redis or Memcached work across hosts.
+Hit and miss counts are kept per process and added to shared counters every
+METRICS_FLUSH_EVERY lookups; `manage.py api_cache_stats` reports them.
+"""
+
+import hashlib
+import secrets
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+from .conditional import add_validators, conditional_response, precondition_response, response_format
+
+METRICS_FLUSH_EVERY = 100
+METRIC_KEYS = ('hits', 'misses')
+
+_pending = threading.local()
+_counts = {'hits': 0, 'misses': 0}
+_counts_lock = threading.Lock()
+
+
+def get_cache():
+    alias = getattr(settings, 'PATIENT_API_CACHE', '')
+    return caches[alias] if alias else None
+
+
+def _version_key(namespace):
+    return f'patient_api:v:{namespace}'
+
+
+def versions(cache, namespaces):
+    """Current token of each namespace, creating any that are missing."""
+    keys = [_version_key(namespace) for namespace in namespaces]
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, secrets.token_hex(8), timeout=None)
+        # Another worker may have won the add; read back whichever stuck.
+        found.update(cache.get_many(missing))
+    return [found.get(key, '') for key in keys]
+
+
+def bump(*namespaces):
+    """Give `namespaces` fresh tokens now (bulk paths that skip signals)."""
+    cache = get_cache()
+    if cache is not None and namespaces:
+        cache.set_many({_version_key(namespace): secrets.token_hex(8) for namespace in namespaces}, timeout=None)
+
+
+def _flush():
+    namespaces = getattr(_pending, 'namespaces', None)
+    if namespaces:
+        _pending.namespaces = set()
+        bump(*namespaces)
+
+
+def changed(*namespaces):
+    """
+    Bump `namespaces` when the current transaction commits. Bumping earlier
+    would let a reader cache rows the transaction has not committed yet
+    under the new token.
+    """
+    _pending.__dict__.setdefault('namespaces', set()).update(namespaces)
+    transaction.on_commit(_flush)
+
+
+def patient_changed(pk):
+    changed('patients', f'patient:{pk}')
+
+
+def vitals_changed(*patient_pks):
+    changed(*(f'vitals:{pk}' for pk in patient_pks))
+
+
+def _count(cache, outcome):
+    with _counts_lock:
+        _counts[outcome] += 1
+        if sum(_counts.values()) < METRICS_FLUSH_EVERY:
+            return
+        pending = dict(_counts)
+        _counts.update(hits=0, misses=0)
+    for name, value in pending.items():
+        if value:
+            try:
+                cache.incr(f'patient_api:metrics:{name}', value)
+            except ValueError:
+                cache.add(f'patient_api:metrics:{name}', 0, timeout=None)
+                cache.incr(f'patient_api:metrics:{name}', value)
+
+
+def stats():
+    """Shared hit/miss counters across workers (plus this process's unflushed counts)."""
+    cache = get_cache()
+    if cache is None:
+        return None
+    shared = cache.get_many([f'patient_api:metrics:{name}' for name in METRIC_KEYS])
+    with _counts_lock:
+        result = {name: shared.get(f'patient_api:metrics:{name}', 0) + _counts[name] for name in METRIC_KEYS}
+    lookups = result['hits'] + result['misses']
+    result['hit_rate'] = result['hits'] / lookups if lookups else None
+    return result
+
+
+def reset_stats():
+    cache = get_cache()
+    if cache is not None:
+        cache.delete_many([f'patient_api:metrics:{name}' for name in METRIC_KEYS])
+    with _counts_lock:
+        _counts.update(hits=0, misses=0)
+
+
+def _lookup(cache, request, namespaces):
+    """(key, stored entry or None) for this URL under the namespaces' current tokens."""
+    tokens = versions(cache, namespaces)
+    url = request.build_absolute_uri()
+    digest = hashlib.md5(repr((response_format(request), url)).encode(), usedforsecurity=False).hexdigest()
+    key = f"patient_api:r:{':'.join(tokens)}:{digest}"
+    entry = cache.get(key)
+    _count(cache, 'misses' if entry is None else 'hits')
+    return key, entry
+
+
+def cached_response(request, namespaces, validators, build):
+    """
+    The cached body for this URL under the namespaces' current tokens, with
+    conditional GET answered from the stored ETag and Last-Modified.
+    On a miss `validators()` gives (etag, last_modified) and `build()`
+    the response; a 200 from it is stored. Sets X-Cache: HIT or MISS.
+    """
+    cache = get_cache()
+    if cache is None:
+        return conditional_response(request, *validators(), build)
+
+    key, entry = _lookup(cache, request, namespaces)
+    if entry is not None:
+        response = conditional_response(request, entry['etag'], entry['last_modified'], lambda: Response(entry['data']))
+        response['X-Cache'] = 'HIT'
+        return response
+
+    etag, last_modified = validators()
+
+    def build_and_store():
+        response = build()
+        if response.status_code == 200 and isinstance(response, Response):
+            cache.set(key, {'data': response.data, 'etag': etag, 'last_modified': last_modified})
+        return response
+
+    response = conditional_response(request, etag, last_modified, build_and_store)
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+async def acached_response(request, namespaces, validators, build, respond):
+    """
+    cached_response() for async views. `validators` and `build` are coroutine
+    functions; `build()` returns the body data, or None to give up, and
+    `respond(data)` turns data into a response. Entries are shared with the
+    sync views, so either one can fill the cache for the other.
+    """
+    cache = get_cache()
+    if cache is not None:
+        key, entry = await sync_to_async(_lookup)(cache, request, namespaces)
+        if entry is not None:
+            response = precondition_response(request, entry['etag'], entry['last_modified']) or respond(entry['data'])
+            response = add_validators(response, entry['etag'], entry['last_modified'])
+            response['X-Cache'] = 'HIT'
+            return response
+
+    validated = await validators()
+    if validated is None:
+        return None
+    etag, last_modified = validated
+    response = precondition_response(request, etag, last_modified)
+    if response is None:
+        data = await build()
+        if data is None:
+            return None
+        if cache is not None:
+            await cache.aset(key, {'data': data, 'etag': etag, 'last_modified': last_modified})
+        response = respond(data)
+    response = add_validators(response, etag, last_modified)
+    if cache is not None:
+        response['X-Cache'] = 'MISS'
+    return response
@@ -0,0 +1,28 @@
+"""
+Management command to report patient API cache hits and misses.
+Usage: python manage.py api_cache_stats [--reset]
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Show hit/miss counts of the patient API response cache across all workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after reporting')
+
+    def handle(self, *args, **options):
+        from apps.patients import api_cache
+
+        stats = api_cache.stats()
+        if stats is None:
+            raise CommandError('The patient API cache is disabled (PATIENT_API_CACHE is empty).')
+        rate = f"{stats['hit_rate']:.1%}" if stats['hit_rate'] is not None else 'n/a'
+        self.stdout.write(f"Hits:     {stats['hits']:,}")
+        self.stdout.write(f"Misses:   {stats['misses']:,}")
+        self.stdout.write(self.style.SUCCESS(f'Hit rate: {rate}'))
+        self.stdout.write(f'Counts are flushed every {api_cache.METRICS_FLUSH_EVERY} lookups per worker.')
+        if options['reset']:
+            api_cache.reset_stats()
+            self.stdout.write('Counters reset.')
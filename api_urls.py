@@ -1,9 +1,33 @@
+from django.conf import settings
 from django.urls import path
-from . import api_views
+from . import api_views, async_views
 
-urlpatterns = [
-    path('', api_views.PatientListCreateView.as_view()),
-    path('<int:pk>/', api_views.PatientDetailView.as_view()),
-    path('search/', api_views.patient_search),
+
+def read_urlpatterns(async_reads):
+    """List, detail and search: the async views under ASGI, the DRF views otherwise."""
+    if async_reads:
+        return [
+            path('', async_views.patient_list),
+            path('<int:pk>/', async_views.patient_detail),
+            path('search/', async_views.patient_search),
+        ]
+    return [
+        path('', api_views.PatientListCreateView.as_view()),
+        path('<int:pk>/', api_views.PatientDetailView.as_view()),
+        path('search/', api_views.patient_search),
+    ]
+
+
+urlpatterns = read_urlpatterns(getattr(settings, 'PATIENT_ASYNC_READS', False)) + [
+    path('batch/', api_views.patient_batch),
+    path('audit/', api_views.PatientAuditView.as_view()),
+    path('census/', api_views.patient_census),
+    path('export/', api_views.patient_export),
+    path('import/', api_views.patient_import),
+    path('vitals/bulk/', api_views.patient_vitals_bulk),
     path('<int:pk>/vitals/', api_views.PatientVitalsView.as_view()),
+    path('<int:pk>/vitals/series/', api_views.patient_vitals_series),
+    path('<int:pk>/timeline/', api_views.patient_timeline),
+    path('<int:pk>/audit/', api_views.PatientAuditView.as_view()),
+    path('<int:pk>/documents/<int:document_pk>/download/', api_views.document_download),
 ]
@@ -1,8 +1,25 @@
-from rest_framework import generics, serializers
-from rest_framework.decorators import api_view
+import io
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.shortcuts import get_object_or_404
+from rest_framework import generics, serializers, status
+from rest_framework.decorators import api_view, parser_classes, permission_classes, renderer_classes
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.response import Response
-from django.db.models import Q
-from .models import Patient, PatientVitals
+from rest_framework.settings import api_settings
+from . import api_cache, audit, batch, census, exports, imports, timeline
+from .conditional import conditional_response, make_etag
+from .downloads import CanViewDocuments, document_response
+from .models import Patient, PatientAccessEvent, PatientDocument, PatientVitals, reading_conflicts
+from .parsers import NDJSONParser
+from .pagination import PatientKeysetPagination, PatientPageNumberPagination, wants_keyset
+from .projections import PATIENT_COMPUTED, Projection, parse_fields, readable_fields
+from .rollups import RESOLUTIONS, vitals_series
+from .search import search_patients
+from .vitals import ingest_readings, range_from_params, vitals_in_range
 
 
 class PatientSerializer(serializers.ModelSerializer):
@@ -21,26 +38,86 @@ class PatientSerializer(serializers.ModelSerializer):
         return obj.status
 
 
+def patient_projection(request):
+    """The fast read path for PatientSerializer output, narrowed by ?fields=id,full_name,..."""
+    available = readable_fields(PatientSerializer)
+    try:
+        fields = parse_fields(request.GET.get('fields'), available)
+    except ValueError as exc:
+        raise ValidationError({'fields': str(exc)})
+    return Projection(PatientSerializer, PATIENT_COMPUTED, fields)
+
+
 class PatientVitalsSerializer(serializers.ModelSerializer):
     class Meta:
         model = PatientVitals
         fields = '__all__'
         read_only_fields = ['recorded_at']
 
+    def validate(self, attrs):
+        errors = reading_conflicts(attrs)
+        if errors:
+            raise ValidationError(errors)
+        return attrs
+
+
+class PatientAccessEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PatientAccessEvent
+        fields = ['id', 'patient', 'user', 'action', 'detail', 'ip_address', 'occurred_at']
+
 
 class PatientListCreateView(generics.ListCreateAPIView):
     serializer_class = PatientSerializer
+    pagination_class = PatientPageNumberPagination
 
-    def get_queryset(self):
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.request is not None and wants_keyset(self.request.query_params):
+                self._paginator = PatientKeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self, ranked=None):
         qs = Patient.objects.all()
-        q = self.request.query_params.get('q')
+        params = self.request.query_params
+        q = params.get('q')
         if q:
-            qs = qs.filter(
-                Q(first_name__icontains=q) | Q(last_name__icontains=q) |
-                Q(phone__icontains=q) | Q(patient_id__icontains=q)
-            )
+            qs = search_patients(qs, q, ranked=not wants_keyset(params) if ranked is None else ranked)
+        status_filter = params.get('status')
+        if status_filter == 'admitted':
+            qs = qs.filter(is_admitted=True)
+        elif status_filter == 'discharged':
+            qs = qs.filter(is_admitted=False)
         return qs
 
+    def get_validators(self):
+        """(ETag, Last-Modified) for the listing, without fetching it."""
+        queryset = self.get_queryset(ranked=False).order_by()
+        if self.request.query_params.get('q'):
+            stats = queryset.aggregate(count=Count('pk'), latest=Max('updated_at'))
+            return make_etag(self.request, stats['count'], stats['latest']), None
+        # The census row is stamped on every create, delete and admission
+        # change, so it also moves when rows leave the listing.
+        current = census.get_census()
+        latest = queryset.aggregate(latest=Max('updated_at'))['latest']
+        changed = max(latest, current.updated_at) if latest else current.updated_at
+        return make_etag(self.request, current.total, current.admitted, changed), changed
+
+    def list(self, request, *args, **kwargs):
+        projection = patient_projection(request)
+
+        def build():
+            # Keyset cursors are built from created_at and id.
+            queryset = projection.values(self.filter_queryset(self.get_queryset()), 'created_at', 'id')
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                return self.get_paginated_response(projection.rows(page))
+            return Response(projection.rows(queryset))
+        return api_cache.cached_response(request, ['patients'], self.get_validators, build)
+
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
 
@@ -49,26 +126,256 @@ class PatientDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Patient.objects.all()
     serializer_class = PatientSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        projection = patient_projection(request)
+        fetched = {}
+
+        def validators():
+            row = get_object_or_404(projection.values(self.get_queryset(), 'updated_at'), pk=kwargs['pk'])
+            self.check_object_permissions(request, row)
+            fetched['row'] = row
+            return make_etag(request, kwargs['pk'], row['updated_at']), row['updated_at']
+
+        response = api_cache.cached_response(
+            request, [f"patient:{kwargs['pk']}"], validators, lambda: Response(projection.row(fetched['row']))
+        )
+        if response.status_code in (200, 304):
+            audit.record(request, kwargs['pk'], 'view')
+        return response
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        audit.record(self.request, serializer.instance.pk, 'update')
+
+    def perform_destroy(self, instance):
+        pk = instance.pk
+        super().perform_destroy(instance)
+        audit.record(self.request, pk, 'delete')
+
 
 @api_view(['GET'])
 def patient_search(request):
     q = request.query_params.get('q', '')
-    patients = Patient.objects.filter(
-        Q(first_name__icontains=q) | Q(last_name__icontains=q) |
-        Q(phone__icontains=q) | Q(patient_id__icontains=q)
-    )[:10]
-    serializer = PatientSerializer(patients, many=True)
-    return Response(serializer.data)
+    projection = patient_projection(request)
+    return api_cache.cached_response(
+        request, ['patients'], lambda: (None, None),
+        lambda: Response(projection.rows(projection.values(search_patients(Patient.objects.all(), q))[:10])),
+    )
+
+
+@api_view(['POST'])
+def patient_batch(request):
+    """
+    Many patients in one round-trip: {"ids": [12, "P20240100001", ...]}
+    takes internal ids and patient IDs; "latest_vitals": true embeds each
+    patient's newest reading. Unknown ids map to null and are listed in
+    `not_found`.
+    """
+    data = request.data if isinstance(request.data, dict) else {}
+    try:
+        ids = batch.parse_ids(data.get('ids'), getattr(settings, 'PATIENT_BATCH_MAX_IDS', 500))
+    except ValueError as exc:
+        raise ValidationError({'ids': str(exc)})
+    vitals_projection = None
+    if data.get('latest_vitals'):
+        vitals_projection = Projection(PatientVitalsSerializer, {})
+    results, found = batch.fetch(ids, patient_projection(request), vitals_projection)
+    for pk in found:
+        audit.record(request, pk, 'batch')
+    return Response({
+        'results': results,
+        'not_found': [key for key, value in results.items() if value is None],
+    })
+
+
+@api_view(['GET'])
+def patient_census(request):
+    return Response(census.as_dict(census.get_census()))
+
+
+def _flag(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValidationError({name: 'Must be true or false.'})
+
+
+@api_view(['GET'])
+@renderer_classes([exports.CSVRenderer, exports.NDJSONRenderer])
+def patient_export(request):
+    """
+    Stream the whole patient register as CSV (default) or ?format=ndjson.
+    Filters: ?admitted=, ?ayushman= (true/false), ?from=&to= on entry date;
+    ?fields= picks columns.
+    """
+    params = request.query_params
+    admitted, ayushman = _flag(params, 'admitted'), _flag(params, 'ayushman')
+    entered_from, entered_to = range_from_params(params)
+    try:
+        fields = parse_fields(params.get('fields'), exports.PATIENT_FIELDS) or exports.PATIENT_FIELDS
+    except ValueError as exc:
+        raise ValidationError({'fields': str(exc)})
+    queryset = exports.patient_queryset(admitted, entered_from, entered_to, ayushman)
+    return exports.patient_response(queryset, request.accepted_renderer.format, fields)
+
+
+@api_view(['GET'])
+def patient_timeline(request, pk):
+    section = request.query_params.get('section')
+    if section is None:
+        patient = get_object_or_404(timeline.with_counts(Patient.objects.all()), pk=pk)
+        return Response({'patient': patient.pk, **timeline.serialize(timeline.build(patient))})
+
+    if section not in timeline.SECTIONS:
+        raise ValidationError({'section': f"Choose from {', '.join(timeline.SECTIONS)}."})
+    limit = request.query_params.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer.'})
+        if limit < 1:
+            raise ValidationError({'limit': 'Must be at least 1.'})
+        limit = min(limit, 100)
+    if not Patient.objects.filter(pk=pk).exists():
+        raise NotFound()
+    try:
+        page = timeline.section_page(pk, section, request.query_params.get('cursor'), limit)
+    except ValueError:
+        raise NotFound('Invalid cursor')
+    return Response({'patient': pk, **timeline.serialize({section: page})})
 
 
 class PatientVitalsView(generics.ListCreateAPIView):
     serializer_class = PatientVitalsSerializer
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, exports.CSVRenderer, exports.NDJSONRenderer]
 
     def get_queryset(self):
-        return PatientVitals.objects.filter(patient_id=self.kwargs['pk'])
+        return vitals_in_range(self.kwargs['pk'], *range_from_params(self.request.query_params))
+
+    def list(self, request, *args, **kwargs):
+        pk = self.kwargs['pk']
+
+        def validators():
+            # The count and highest id catch readings added to or removed from
+            # the window; the patient's newest updated_at catches edits,
+            # including ones that move a reading into or out of it.
+            stats = self.get_queryset().aggregate(count=Count('pk'), last=Max('pk'))
+            changed = PatientVitals.objects.filter(patient_id=pk).aggregate(changed=Max('updated_at'))['changed']
+            return make_etag(request, pk, stats['count'], stats['last'], changed), None
+
+        # ?format=csv / ?format=ndjson stream every reading instead of a page.
+        fmt = request.accepted_renderer.format
+        if fmt in exports.FORMATS:
+            return conditional_response(
+                request, *validators(), lambda: exports.vitals_response(self.get_queryset(), fmt, f'patient-{pk}-vitals')
+            )
+        return api_cache.cached_response(
+            request, [f'vitals:{pk}'], validators, lambda: super(PatientVitalsView, self).list(request, *args, **kwargs)
+        )
 
     def perform_create(self, serializer):
         serializer.save(
             patient_id=self.kwargs['pk'],
             recorded_by=self.request.user
         )
+
+
+class PatientAuditView(generics.ListAPIView):
+    """Access events newest first: for one patient, or for ?user=<id> across patients."""
+    serializer_class = PatientAccessEventSerializer
+    permission_classes = [audit.CanViewAudit]
+
+    def get_queryset(self):
+        if 'pk' in self.kwargs:
+            return audit.for_patient(self.kwargs['pk'])
+        try:
+            return audit.for_user(int(self.request.query_params['user']))
+        except (KeyError, ValueError):
+            raise ValidationError({'user': 'Pass a user id.'})
+
+
+@api_view(['GET'])
+@permission_classes([CanViewDocuments])
+def document_download(request, pk, document_pk):
+    """
+    A patient's document file; ?download=1 asks the browser to save it and
+    ?variant=thumb|preview returns a rendered image instead.
+    """
+    variant = request.query_params.get('variant') or None
+    if variant is not None and variant not in settings.DOCUMENT_PREVIEW_SIZES:
+        raise ValidationError({'variant': f"Choose from {', '.join(settings.DOCUMENT_PREVIEW_SIZES)}."})
+    document = get_object_or_404(
+        PatientDocument.objects.select_related('blob'), pk=document_pk, patient_id=pk
+    )
+    attachment = request.query_params.get('download', '').lower() in ('1', 'true', 'yes')
+    audit.record(request, pk, 'download', f'document {document.pk}' + (f' {variant}' if variant else ''))
+    return document_response(request, document, attachment=attachment, variant=variant)
+
+
+@api_view(['GET'])
+def patient_vitals_series(request, pk):
+    """Downsampled vitals for charts: ?from=&to= (YYYY-MM-DD), ?resolution=, ?points=."""
+    resolution = request.query_params.get('resolution') or None
+    if resolution is not None and resolution not in RESOLUTIONS:
+        raise ValidationError({'resolution': f"Choose from {', '.join(RESOLUTIONS)}."})
+    try:
+        max_points = max(1, min(int(request.query_params.get('points', 500)), 2000))
+    except ValueError:
+        raise ValidationError({'points': 'Must be an integer.'})
+    if not Patient.objects.filter(pk=pk).exists():
+        raise NotFound()
+    start, end = range_from_params(request.query_params)
+    return Response({'patient': pk, **vitals_series(pk, start, end, resolution, max_points)})
+
+
+@api_view(['POST'])
+@parser_classes([JSONParser, NDJSONParser])
+def patient_vitals_bulk(request):
+    """
+    Bulk-ingest readings for many patients: a JSON array (or
+    {"readings": [...]}) or an application/x-ndjson body.
+    """
+    rows = request.data
+    if isinstance(rows, dict):
+        rows = rows.get('readings')
+    if not isinstance(rows, list):
+        raise ValidationError({'readings': 'Expected a list of readings.'})
+    try:
+        result = ingest_readings(rows, recorded_by=request.user)
+    except ValueError as exc:
+        raise ValidationError({'readings': str(exc)})
+    if result['created']:
+        return Response(result, status=status.HTTP_201_CREATED)
+    return Response(result, status=status.HTTP_400_BAD_REQUEST if result['errors'] else status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@parser_classes([MultiPartParser])
+def patient_import(request):
+    """
+    Import patients from an uploaded CSV or NDJSON `file` (same columns as
+    the export). Rows are inserted in chunks; rejected rows are listed.
+    """
+    upload = request.FILES.get('file')
+    if upload is None:
+        raise ValidationError({'file': 'Upload a CSV or NDJSON file.'})
+    max_rows = getattr(settings, 'PATIENT_IMPORT_MAX_ROWS', 50_000)
+    fmt = imports.guess_format(upload.name, upload.content_type or '')
+    with io.TextIOWrapper(upload, encoding='utf-8-sig', newline='') as fh:
+        try:
+            # Records, not lines: quoted CSV values may span several. Read
+            # before importing so an oversized file writes nothing.
+            rows = list(islice(imports.read_rows(fh, fmt), max_rows + 1))
+        except UnicodeDecodeError:
+            raise ValidationError({'file': 'The file must be UTF-8 text.'})
+    if len(rows) > max_rows:
+        raise ValidationError({'file': f'At most {max_rows} rows per upload; use manage.py import_patients.'})
+    result = imports.import_patients(rows, created_by=request.user)
+    if result['created']:
+        return Response(result, status=status.HTTP_201_CREATED)
+    return Response(result, status=status.HTTP_400_BAD_REQUEST if result['error_count'] else status.HTTP_200_OK)
@@ -0,0 +1,5 @@
+import os
+from django.core.asgi import get_asgi_application
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hospital_mgmt.settings')
+os.environ.setdefault('DJANGO_ASGI', '1')
+application = get_asgi_application()
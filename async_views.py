@@ -0,0 +1,148 @@
+"""
+Async patient reads for ASGI deployments (asgi.py), routed in place of
+the DRF list, detail and search views when PATIENT_ASYNC_READS is set.
+
+Under gunicorn's sync workers a request holds its worker for as long as
+the database takes, so a slow database leaves autocomplete and tablet
+polling queued behind a fixed number of workers. Under ASGI these views
+wait on the database without holding a worker.
+
+Django 4.2's async ORM still runs each query in a thread (one per request),
+so a DB-bound read costs the same work; what changes is that requests no
+longer queue for a worker. The views answer GET JSON themselves. Anything
+else goes to the DRF view each one replaces: writes, the browsable API,
+?format=, anonymous or bad credentials and every error response. Both
+paths produce the same body, ETag and cache entries.
+"""
+
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import api_cache, api_views, audit
+from .conditional import make_etag
+from .models import Patient
+from .search import search_patients
+
+
+def _authenticate(request, view_class):
+    """
+    Run the DRF view's own authentication and permission classes. Returns
+    the user (also set as request.user) when they admit the request, or
+    None so the DRF view answers with its 401/403.
+    """
+    drf_request = Request(request, authenticators=[auth() for auth in view_class.authentication_classes])
+    try:
+        user = drf_request.user
+        view = view_class()
+        if all(permission().has_permission(drf_request, view) for permission in view_class.permission_classes):
+            return user
+    except APIException:
+        pass
+    return None
+
+
+def json_response(data):
+    # The same bytes and headers DRF's JSONRenderer would send.
+    response = HttpResponse(JSONRenderer().render(data), content_type='application/json')
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def _wants_json(request):
+    if request.GET.get('format', 'json') != 'json':
+        return False
+    return 'text/html' not in request.headers.get('Accept', '')
+
+
+def api_read(fallback):
+    """
+    Serve GET JSON from the decorated coroutine, which returns a response or
+    None when DRF should answer; everything else goes to `fallback`.
+    """
+    view_class = fallback.cls
+    fallback = sync_to_async(fallback)
+
+    def decorator(func):
+        @wraps(func)
+        async def view(request, *args, **kwargs):
+            user = None
+            if request.method == 'GET' and _wants_json(request):
+                user = await sync_to_async(_authenticate)(request, view_class)
+            if user is not None:
+                try:
+                    response = await func(request, *args, **kwargs)
+                except APIException:
+                    response = None
+                if response is not None:
+                    return response
+            return await fallback(request, *args, **kwargs)
+        # DRF enforces CSRF itself for session-authenticated writes.
+        view.csrf_exempt = True
+        return view
+    return decorator
+
+
+@api_read(api_views.PatientListCreateView.as_view())
+async def patient_list(request):
+    # The DRF view's own queryset, validators and paginators, run in the
+    # request's thread, keep the listing identical to the sync path.
+    view = api_views.PatientListCreateView(request=Request(request), args=(), kwargs={}, format_kwarg=None)
+    projection = api_views.patient_projection(request)
+
+    async def validators():
+        return await sync_to_async(view.get_validators)()
+
+    def page():
+        queryset = projection.values(view.filter_queryset(view.get_queryset()), 'created_at', 'id')
+        rows = view.paginate_queryset(queryset)
+        if rows is None:
+            return projection.rows(queryset)
+        return view.get_paginated_response(projection.rows(rows)).data
+
+    async def build():
+        return await sync_to_async(page)()
+
+    return await api_cache.acached_response(request, ['patients'], validators, build, json_response)
+
+
+@api_read(api_views.PatientDetailView.as_view())
+async def patient_detail(request, pk):
+    projection = api_views.patient_projection(request)
+    fetched = {}
+
+    async def validators():
+        row = await projection.values(Patient.objects.filter(pk=pk), 'updated_at').afirst()
+        if row is None:
+            return None
+        fetched['row'] = row
+        return make_etag(request, pk, row['updated_at']), row['updated_at']
+
+    async def build():
+        return projection.row(fetched['row'])
+
+    response = await api_cache.acached_response(request, [f'patient:{pk}'], validators, build, json_response)
+    if response is not None and response.status_code in (200, 304):
+        audit.record(request, pk, 'view')
+    return response
+
+
+@api_read(api_views.patient_search)
+async def patient_search(request):
+    q = request.GET.get('q', '')
+    projection = api_views.patient_projection(request)
+
+    async def validators():
+        return None, None
+
+    async def build():
+        # Picking the search backend may inspect the database once.
+        queryset = await sync_to_async(search_patients)(Patient.objects.all(), q)
+        return [projection.row(values) async for values in projection.values(queryset)[:10]]
+
+    return await api_cache.acached_response(request, ['patients'], validators, build, json_response)
@@ -0,0 +1,168 @@
+"""
+Patient access audit trail.
+
+Views call `record()`, which puts one tuple on a bounded in-process queue
+and returns in microseconds. A background thread per worker drains the
+queue every PATIENT_AUDIT_FLUSH_INTERVAL seconds, or as soon as a batch is
+waiting, and writes it with one bulk_create. The queue is flushed again at
+interpreter exit, so a worker that shuts down cleanly loses nothing.
+
+PATIENT_AUDIT_SINK = 'file' appends JSON lines to PATIENT_AUDIT_FILE
+instead. That file also receives batches the database rejects and events
+that arrive while the queue is full, so nothing is dropped silently.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from rest_framework.permissions import BasePermission
+
+from .models import PatientAccessEvent
+
+logger = logging.getLogger(__name__)
+
+
+class CanViewAudit(BasePermission):
+    """Only admins may read the access trail."""
+
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(user and user.is_authenticated and user.is_admin)
+
+
+class AuditLog:
+
+    def __init__(self):
+        self._queue = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._wake = threading.Event()
+        self.counts = {'written': 0, 'to_file': 0, 'overflowed': 0}
+
+    def _start(self):
+        # Per process: a worker forked from a preloaded master starts its own thread.
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=getattr(settings, 'PATIENT_AUDIT_QUEUE_SIZE', 10_000))
+                threading.Thread(target=self._run, name='patient-audit', daemon=True).start()
+                if self._pid is None:
+                    atexit.register(self.flush)
+                self._pid = os.getpid()
+        return self._queue
+
+    def record(self, patient_pk, user_pk, action, detail='', ip_address=None):
+        event = (patient_pk, user_pk, action, detail[:100], ip_address, timezone.now())
+        events = self._queue if self._pid == os.getpid() else self._start()
+        try:
+            events.put_nowait(event)
+        except queue.Full:
+            self.counts['overflowed'] += 1
+            self._append_file([event])
+            return
+        if events.qsize() >= getattr(settings, 'PATIENT_AUDIT_BATCH_SIZE', 500):
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(getattr(settings, 'PATIENT_AUDIT_FLUSH_INTERVAL', 1.0))
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Patient audit flush failed')
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Write every queued event now; returns how many were taken off the queue."""
+        events = self._queue
+        if events is None:
+            return 0
+        batch_size = getattr(settings, 'PATIENT_AUDIT_BATCH_SIZE', 500)
+        taken = 0
+        with self._flush_lock:
+            while True:
+                batch = []
+                try:
+                    while len(batch) < batch_size:
+                        batch.append(events.get_nowait())
+                except queue.Empty:
+                    pass
+                if not batch:
+                    break
+                taken += len(batch)
+                self._write(batch)
+                if len(batch) < batch_size:
+                    break
+        return taken
+
+    def _write(self, batch):
+        if getattr(settings, 'PATIENT_AUDIT_SINK', 'db') == 'file':
+            self._append_file(batch)
+            return
+        try:
+            PatientAccessEvent.objects.bulk_create([
+                PatientAccessEvent(
+                    patient_id=patient_pk, user_id=user_pk, action=action,
+                    detail=detail, ip_address=ip_address, occurred_at=occurred_at,
+                )
+                for patient_pk, user_pk, action, detail, ip_address, occurred_at in batch
+            ])
+        except Exception:
+            logger.exception('Writing %d patient audit events failed; appending them to the audit file', len(batch))
+            self._append_file(batch)
+        else:
+            self.counts['written'] += len(batch)
+
+    def _append_file(self, batch):
+        path = settings.PATIENT_AUDIT_FILE
+        lines = ''.join(
+            json.dumps({
+                'patient': patient_pk, 'user': user_pk, 'action': action, 'detail': detail,
+                'ip_address': ip_address, 'occurred_at': occurred_at.isoformat(),
+            }) + '\n'
+            for patient_pk, user_pk, action, detail, ip_address, occurred_at in batch
+        )
+        with self._file_lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as fh:
+                fh.write(lines)
+        self.counts['to_file'] += len(batch)
+
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0
+
+
+log = AuditLog()
+
+
+def record(request, patient_pk, action, detail=''):
+    """Queue an access to `patient_pk` by the request's user."""
+    if not getattr(settings, 'PATIENT_AUDIT_SINK', 'db'):
+        return
+    user = request.user
+    log.record(
+        patient_pk, user.pk if user.is_authenticated else None, action,
+        detail, request.META.get('REMOTE_ADDR') or None,
+    )
+
+
+def flush():
+    return log.flush()
+
+
+def for_patient(patient_pk):
+    return PatientAccessEvent.objects.filter(patient_id=patient_pk).order_by('-occurred_at')
+
+
+def for_user(user_pk):
+    return PatientAccessEvent.objects.filter(user_id=user_pk).order_by('-occurred_at')
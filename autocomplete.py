@@ -0,0 +1,352 @@
+"""
+In-process prefix index for reception autocomplete.
+
+Each worker keeps a sorted array of keys (name tokens, phone digits and
+patient IDs) with a parallel array of patient pks, plus one compact tuple per
+patient holding what `patient_search_ajax` returns. Name tokens are interned
+so common names are stored once. The index is built on first use and kept
+current by Patient signals in the worker that made the change. Other
+workers catch up at most every PATIENT_AUTOCOMPLETE_CHECK_INTERVAL seconds
+by applying patients whose `updated_at` moved since their last look, so
+saving a patient costs no extra write and the common keystroke is answered
+without touching the database.
+
+Deletes and bulk inserts that skip signals bump a version row instead.
+A worker that sees it move rebuilds on a background thread and swaps the
+new arrays in; searches keep using the old ones meanwhile.
+
+The index matches key prefixes only. Patient search matches substrings
+anywhere (trailing phone digits, a patient ID suffix), so a query with
+fewer than a full page of prefix hits is left to the database.
+"""
+
+import heapq
+import logging
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import IndexVersion, Patient
+from .search import tokenize
+
+logger = logging.getLogger(__name__)
+
+VERSION_NAME = 'patient_autocomplete'
+GENDERS = dict(Patient.GENDER_CHOICES)
+ROW_FIELDS = ('pk', 'patient_id', 'first_name', 'last_name', 'phone', 'age', 'gender')
+# Edits are re-read for this long after their updated_at, so a transaction
+# that commits after the next check is still picked up.
+CHANGE_OVERLAP = timedelta(seconds=60)
+# More edits than this since the last check rebuild instead.
+MAX_CHANGES = 1000
+
+
+def _keys_for(patient_id, first_name, last_name, phone):
+    keys = {sys.intern(token) for token in tokenize(first_name) + tokenize(last_name)}
+    digits = ''.join(ch for ch in phone or '' if ch.isdigit())
+    if digits:
+        keys.add(digits)
+    if patient_id:
+        keys.add(patient_id.lower())
+    return tuple(keys)
+
+
+def _row(pk, patient_id, first_name, last_name, phone, age, gender):
+    return (pk, patient_id, sys.intern(first_name), sys.intern(last_name), phone, age, sys.intern(gender))
+
+
+class PatientPrefixIndex:
+
+    def __init__(self, max_entries=None, check_interval=None, background=True):
+        self.max_entries = max_entries or getattr(settings, 'PATIENT_AUTOCOMPLETE_MAX_ENTRIES', 100_000)
+        self.check_interval = (
+            check_interval if check_interval is not None
+            else getattr(settings, 'PATIENT_AUTOCOMPLETE_CHECK_INTERVAL', 2.0)
+        )
+        # False rebuilds in the calling thread, e.g. inside a test transaction.
+        self.background = background
+        self._lock = threading.RLock()
+        self.rebuilding = False
+        self._reset()
+
+    def _reset(self):
+        self._keys = []
+        self._key_pks = array('q')
+        self._rows = {}
+        self._row_keys = {}
+        self.version = None
+        self.complete = False
+        self.built = False
+        self.checked_at = 0.0
+        self.changed_since = None
+        self.approx_bytes = 0
+
+    # -- building -----------------------------------------------------------
+
+    def _current_version(self):
+        stamp = IndexVersion.objects.filter(name=VERSION_NAME).values_list('version', flat=True).first()
+        return stamp or 0
+
+    def _load(self):
+        """Read the newest max_entries patients into fresh arrays, without touching the live ones."""
+        started = time.perf_counter()
+        # Read before the rows: a change made during the load is applied again afterwards.
+        state = {'version': self._current_version(), 'changed_since': timezone.now() - CHANGE_OVERLAP}
+        rows_by_pk, row_keys_by_pk, pairs = {}, {}, []
+        complete = False
+        rows = Patient.objects.order_by('-pk').values_list(*ROW_FIELDS)[:self.max_entries + 1]
+        for values in rows.iterator(chunk_size=5000):
+            if len(rows_by_pk) == self.max_entries:
+                break
+            pk, patient_id, first_name, last_name, phone = values[:5]
+            rows_by_pk[pk] = _row(*values)
+            row_keys = _keys_for(patient_id, first_name, last_name, phone)
+            row_keys_by_pk[pk] = row_keys
+            pairs.extend((key, pk) for key in row_keys)
+        else:
+            complete = True
+        pairs.sort()
+        keys = [key for key, _ in pairs]
+        key_pks = array('q', (pk for _, pk in pairs))
+        del pairs
+        state.update(
+            _keys=keys, _key_pks=key_pks, _rows=rows_by_pk, _row_keys=row_keys_by_pk, complete=complete,
+            approx_bytes=self._measure(keys, key_pks, rows_by_pk, row_keys_by_pk),
+        )
+        logger.info(
+            'Patient autocomplete index built: %d patients, %d keys, ~%.1f MB in %.0f ms%s',
+            len(rows_by_pk), len(keys), state['approx_bytes'] / 1e6,
+            (time.perf_counter() - started) * 1000, '' if complete else ' (truncated)',
+        )
+        return state
+
+    def _swap(self, state):
+        with self._lock:
+            self.__dict__.update(state)
+            self.built = True
+            self.checked_at = time.monotonic()
+
+    def build(self):
+        """Load and swap in the index in the calling thread."""
+        self._swap(self._load())
+
+    def _rebuild_in_background(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception('Patient autocomplete rebuild failed')
+        finally:
+            self.rebuilding = False
+            connection.close()
+
+    def schedule_rebuild(self):
+        """Rebuild, in the background when configured; searches use the current arrays meanwhile."""
+        with self._lock:
+            if self.rebuilding:
+                return
+            if not self.background:
+                self.build()
+                return
+            self.rebuilding = True
+        threading.Thread(target=self._rebuild_in_background, name='patient-autocomplete', daemon=True).start()
+
+    @staticmethod
+    def _measure(keys, key_pks, rows, row_keys_by_pk):
+        # Interned/shared strings are counted once.
+        seen = set()
+        size = sum(sys.getsizeof(obj) for obj in (keys, key_pks, rows, row_keys_by_pk))
+        for value in keys:
+            if id(value) not in seen:
+                seen.add(id(value))
+                size += sys.getsizeof(value)
+        for row in rows.values():
+            size += sys.getsizeof(row)
+            for value in row[1:5]:
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    size += sys.getsizeof(value)
+        for row_keys in row_keys_by_pk.values():
+            size += sys.getsizeof(row_keys)
+        return size
+
+    def ensure_fresh(self):
+        if not self.built:
+            # Only the first searches in a worker wait for a build.
+            with self._lock:
+                if not self.built:
+                    self.build()
+            return
+        now = time.monotonic()
+        if now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+        if self._current_version() != self.version:
+            self.schedule_rebuild()
+        self.apply_changes()
+
+    def apply_changes(self):
+        """Upsert patients other workers saved since the last check."""
+        checked = timezone.now()
+        rows = list(
+            Patient.objects.filter(updated_at__gte=self.changed_since)
+            .order_by().values_list(*ROW_FIELDS)[:MAX_CHANGES + 1]
+        )
+        if len(rows) > MAX_CHANGES:
+            self.schedule_rebuild()
+            return
+        with self._lock:
+            for values in rows:
+                self._upsert(*values)
+            self.changed_since = checked - CHANGE_OVERLAP
+
+    # -- maintenance --------------------------------------------------------
+
+    def _remove(self, pk):
+        for key in self._row_keys.pop(pk, ()):
+            start = bisect_left(self._keys, key)
+            end = bisect_right(self._keys, key, lo=start)
+            for index in range(start, end):
+                if self._key_pks[index] == pk:
+                    del self._keys[index]
+                    del self._key_pks[index]
+                    break
+        self._rows.pop(pk, None)
+
+    def _upsert(self, pk, patient_id, first_name, last_name, phone, age, gender):
+        row = _row(pk, patient_id, first_name, last_name, phone, age, gender)
+        if self._rows.get(pk) == row:
+            return
+        if pk not in self._rows and len(self._rows) >= self.max_entries:
+            # Full: keep the newest patients, as build() does.
+            oldest = min(self._rows)
+            if pk < oldest:
+                return
+            self._remove(oldest)
+            self.complete = False
+        self._remove(pk)
+        self._rows[pk] = row
+        row_keys = _keys_for(patient_id, first_name, last_name, phone)
+        self._row_keys[pk] = row_keys
+        for key in row_keys:
+            index = bisect_left(self._keys, key)
+            self._keys.insert(index, key)
+            self._key_pks.insert(index, pk)
+
+    def upsert(self, patient):
+        with self._lock:
+            if self.built:
+                self._upsert(*(getattr(patient, field) for field in ROW_FIELDS))
+
+    def remove(self, pk):
+        with self._lock:
+            if self.built:
+                self._remove(pk)
+
+    def note_version(self, version):
+        """Adopt `version` if it directly follows ours; otherwise rebuild."""
+        with self._lock:
+            if not self.built:
+                return
+            if self.version is not None and version == self.version + 1:
+                self.version = version
+            else:
+                self.schedule_rebuild()
+
+    # -- queries ------------------------------------------------------------
+
+    def search(self, query, limit=10):
+        """
+        Return up to `limit` result dicts, or None when the index cannot
+        answer authoritatively and the caller should query the database.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return None
+        self.ensure_fresh()
+        with self._lock:
+            driver = max(terms, key=len)
+            others = [term for term in terms if term != driver]
+            keys, key_pks, row_keys = self._keys, self._key_pks, self._row_keys
+            start = bisect_left(keys, driver)
+            # Everything sharing the prefix sorts before driver + U+10FFFF.
+            end = bisect_left(keys, driver + '\U0010ffff', lo=start)
+            if not others:
+                # A patient can hold several keys with the same prefix, so
+                # over-fetch before dropping duplicates.
+                chosen = list(dict.fromkeys(heapq.nlargest(limit * 4, key_pks[start:end])))[:limit]
+            else:
+                # Newest first, stopping as soon as enough rows match every term.
+                chosen = []
+                for pk in sorted(set(key_pks[start:end]), reverse=True):
+                    if all(any(k.startswith(term) for k in row_keys[pk]) for term in others):
+                        chosen.append(pk)
+                        if len(chosen) == limit:
+                            break
+            if len(chosen) < limit:
+                # The database may find more as substrings.
+                return None
+            return [self._result(self._rows[pk]) for pk in chosen]
+
+    @staticmethod
+    def _result(row):
+        pk, patient_id, first_name, last_name, phone, age, gender = row
+        return {
+            'id': pk,
+            'patient_id': patient_id,
+            'full_name': f'{first_name} {last_name}',
+            'phone': phone,
+            'age': age,
+            'gender': GENDERS.get(gender, gender),
+        }
+
+    def stats(self):
+        return {
+            'built': self.built,
+            'complete': self.complete,
+            'patients': len(self._rows),
+            'keys': len(self._keys),
+            'approx_bytes': self.approx_bytes,
+            'version': self.version,
+            'rebuilding': self.rebuilding,
+        }
+
+
+index = PatientPrefixIndex()
+
+
+def bump_version():
+    with transaction.atomic():
+        updated = IndexVersion.objects.filter(name=VERSION_NAME).update(version=F('version') + 1)
+        if not updated:
+            IndexVersion.objects.get_or_create(name=VERSION_NAME, defaults={'version': 1})
+        return IndexVersion.objects.filter(name=VERSION_NAME).values_list('version', flat=True).get()
+
+
+def patient_changed(patient):
+    # Other workers pick the change up from updated_at.
+    transaction.on_commit(lambda: index.upsert(patient))
+
+
+def patient_deleted(pk):
+    def apply():
+        index.remove(pk)
+        index.note_version(bump_version())
+    transaction.on_commit(apply)
+
+
+def invalidate():
+    """Make every worker rebuild, e.g. after bulk inserts that skip signals."""
+    bump_version()
+    index.note_version(None)
+
+
+def search(query, limit=10):
+    return index.search(query, limit=limit)
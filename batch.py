@@ -0,0 +1,88 @@
+"""
+Batch patient lookups for downstream systems (lab, pharmacy).
+
+One request resolves up to PATIENT_BATCH_MAX_IDS patients by internal id
+or human patient_id with a single IN query. The latest vitals reading of
+each patient found comes from one more query: ROW_NUMBER() per patient
+where the database has window functions, a correlated subquery otherwise.
+"""
+
+from django.db import connection
+from django.db.backends.base.operations import BaseDatabaseOperations
+from django.db.models import F, OuterRef, Q, Subquery, Window
+from django.db.models.functions import RowNumber
+
+from .models import Patient, PatientVitals
+
+# The largest value the pk column holds; anything bigger would overflow in the query.
+MAX_PK = BaseDatabaseOperations.integer_field_ranges[Patient._meta.pk.get_internal_type()][1]
+
+
+def parse_ids(values, max_ids):
+    """
+    {key: pk or patient_id} in request order, keyed by the id as the
+    response will show it. Integers (and digit strings) are internal ids,
+    up to MAX_PK; other strings are patient_ids. Raises ValueError for
+    anything else.
+    """
+    if not isinstance(values, list) or not values:
+        raise ValueError('Expected a non-empty list of ids.')
+    if len(values) > max_ids:
+        raise ValueError(f'At most {max_ids} ids per request.')
+    ids = {}
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise ValueError(f'Invalid id: {value!r}.')
+        key = str(value).strip()
+        if not key:
+            raise ValueError('Ids must not be blank.')
+        if not key.isdecimal():
+            ids[key] = key
+        elif int(key) > MAX_PK:
+            raise ValueError(f'Invalid id: {value!r}.')
+        else:
+            ids[key] = int(key)
+    return ids
+
+
+def latest_vitals(patient_pks):
+    """The newest reading of each of `patient_pks`, as one queryset."""
+    readings = PatientVitals.objects.filter(patient_id__in=patient_pks).order_by()
+    if connection.features.supports_over_clause:
+        return readings.annotate(position=Window(
+            RowNumber(), partition_by=F('patient_id'), order_by=[F('recorded_at').desc(), F('pk').desc()],
+        )).filter(position=1)
+    newest = PatientVitals.objects.filter(patient_id=OuterRef('patient_id')).order_by('-recorded_at', '-pk')
+    return readings.filter(pk=Subquery(newest.values('pk')[:1]))
+
+
+def fetch(ids, projection, vitals_projection=None):
+    """
+    ({key: patient dict or None}, pks found) for ids from parse_ids(); with
+    `vitals_projection` each patient gets its `latest_vitals` (or None).
+    """
+    pks = [value for value in ids.values() if isinstance(value, int)]
+    codes = [value for value in ids.values() if isinstance(value, str)]
+    rows = projection.values(
+        Patient.objects.filter(Q(pk__in=pks) | Q(patient_id__in=codes)).order_by(),
+        'id', 'patient_id',
+    )
+    by_pk = {}
+    by_code = {}
+    for values in rows:
+        by_pk[values['id']] = by_code[values['patient_id']] = values
+    vitals = {}
+    if vitals_projection is not None and by_pk:
+        readings = vitals_projection.values(latest_vitals(list(by_pk)), 'patient_id')
+        vitals = {values['patient_id']: vitals_projection.row(values) for values in readings}
+
+    results = {}
+    for key, value in ids.items():
+        values = (by_pk if isinstance(value, int) else by_code).get(value)
+        if values is None:
+            results[key] = None
+            continue
+        results[key] = projection.row(values)
+        if vitals_projection is not None:
+            results[key]['latest_vitals'] = vitals.get(values['id'])
+    return results, list(by_pk)
@@ -0,0 +1,61 @@
+"""
+Management command to run patient module benchmarks on a scratch database.
+Usage: python manage.py benchmark search --sizes 10000,100000
+       python manage.py benchmark views --output views.json --baseline views-main.json
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Run a patients benchmark against a throw-away test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help='Benchmark to run')
+        parser.add_argument('--sizes', help='Comma separated dataset sizes')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--output', help='Write results as JSON to this file')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the scratch database')
+        parser.add_argument('--baseline', help='Fail if the results regress against this earlier --output file')
+        parser.add_argument(
+            '--threshold', type=float, default=0.5,
+            help='Allowed slowdown against --baseline as a fraction (default 0.5); query counts may not grow',
+        )
+
+    def handle(self, *args, **options):
+        from apps.patients.benchmarks import BENCHMARKS, compare_results, scratch_database
+
+        func = BENCHMARKS.get(options['name'])
+        if func is None:
+            raise CommandError(f"Unknown benchmark. Choose from: {', '.join(sorted(BENCHMARKS))}")
+        sizes = func.default_sizes
+        if options['sizes']:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as fh:
+                    baseline = json.load(fh)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Cannot read baseline {options['baseline']}: {exc}")
+            if baseline.get('benchmark') != options['name']:
+                raise CommandError(f"{options['baseline']} holds {baseline.get('benchmark')!r} results")
+
+        self.stdout.write(f"Running {options['name']} benchmark: {func.__doc__.strip()}")
+        with scratch_database(keepdb=options['keepdb']):
+            results = func(sizes, repeat=options['repeat'], stdout=self.stdout)
+
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump({'benchmark': options['name'], 'results': results}, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"✓ Results written to {options['output']}"))
+
+        if baseline is not None:
+            regressions = compare_results(results, baseline['results'], options['threshold'])
+            for regression in regressions:
+                self.stderr.write(f'  {regression}')
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s) against {options['baseline']}")
+            self.stdout.write(self.style.SUCCESS(f"✓ No regressions against {options['baseline']}"))
@@ -0,0 +1,1220 @@
+"""
+Benchmarks for the patients module.
+
+Each benchmark runs against a throw-away test database so it never touches
+real data. Run them with `python manage.py benchmark <name>`.
+"""
+
+import random
+import re
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from .sample_data import CITIES, FIRST_NAMES, LAST_NAMES
+
+BENCHMARKS = {}
+
+
+def benchmark(name, sizes):
+    """Register a benchmark function under `name` with default dataset sizes."""
+    def decorator(func):
+        func.default_sizes = sizes
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+@contextmanager
+def scratch_database(keepdb=False):
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+
+def time_calls(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    return {
+        'mean_ms': round(statistics.fmean(samples), 3),
+        'p50_ms': round(percentile(samples, 50), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+    }
+
+
+class QueryLog:
+    """connection.execute_wrapper() that keeps (sql, params, seconds) per query."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, params, time.perf_counter() - start))
+
+    @property
+    def sql_ms(self):
+        return sum(seconds for _, _, seconds in self.queries) * 1000
+
+
+def full_scans(queries, min_rows=1000):
+    """
+    SELECTs whose plan reads every row of a table holding at least
+    `min_rows`, i.e. a filter or join no index serves. SQLite and
+    PostgreSQL only; other databases report none.
+    """
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return []
+    found = []
+    sizes = {}
+    with connection.cursor() as cursor:
+        tables = set(connection.introspection.table_names(cursor))
+        for sql, params in dict.fromkeys((sql, tuple(params or ())) for sql, params, _ in queries):
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            plan = [str(row[-1]) for row in cursor.fetchall()]
+            aliases = dict((alias, table) for table, alias in re.findall(r'"(\w+)" ([A-Z]\d+)\b', sql))
+            for line in plan:
+                match = (
+                    re.search(r'\bSCAN (\w+)$', line) if connection.vendor == 'sqlite'
+                    else re.search(r'Seq Scan on (\w+)', line)
+                )
+                if not match:
+                    continue
+                table = aliases.get(match.group(1), match.group(1))
+                if table not in tables:
+                    continue  # a derived table, e.g. a window function's subquery
+                if table not in sizes:
+                    cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+                    sizes[table] = cursor.fetchone()[0]
+                if sizes[table] >= min_rows:
+                    found.append(f'{table}: {sql[:120]}')
+    return found
+
+
+# Metrics compare_results() checks: counts may never grow, median times may
+# grow by the threshold (and at least NOISE_FLOOR_MS), rates may drop by it.
+# Tail percentiles of a few dozen samples are too noisy to gate on.
+EXACT_METRICS = ('queries', 'full_scans')
+TIME_METRICS = ('p50_ms', 'sql_ms')
+NOISE_FLOOR_MS = 2.0
+
+
+def compare_results(results, baseline, threshold):
+    """
+    Regressions of `results` against `baseline` (both benchmark result
+    lists), as messages. Rows are matched on their text fields and size.
+    """
+    def key(row):
+        return tuple(sorted(
+            (name, value) for name, value in row.items() if isinstance(value, str) or name in ('size', 'clients')
+        ))
+
+    previous = {key(row): row for row in baseline}
+    regressions = []
+    for row in results:
+        old = previous.get(key(row))
+        if old is None:
+            continue
+        label = ' '.join(str(value) for _, value in key(row))
+        for name, value in row.items():
+            before = old.get(name)
+            if not isinstance(value, (int, float)) or not isinstance(before, (int, float)):
+                continue
+            if name in EXACT_METRICS:
+                worse = value > before
+            elif name in TIME_METRICS:
+                worse = value > before * (1 + threshold) and value - before >= NOISE_FLOOR_MS
+            elif name.endswith('_per_sec'):
+                worse = value < before / (1 + threshold)
+            else:
+                continue
+            if worse:
+                regressions.append(f'{label}: {name} {before} -> {value}')
+    return regressions
+
+
+def seed_patients(count, seed=42, chunk_size=5000):
+    """Bulk-insert `count` synthetic patients; returns how many were added."""
+    from . import api_cache, census
+    from .models import Patient
+
+    rng = random.Random(seed)
+    now = timezone.now()
+    created = 0
+    while created < count:
+        size = min(chunk_size, count - created)
+        patient_ids = Patient.reserve_patient_ids(size)
+        batch = []
+        for patient_id in patient_ids:
+            city, state = rng.choice(CITIES)
+            admitted = rng.random() < 0.3
+            batch.append(Patient(
+                patient_id=patient_id,
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                age=rng.randint(0, 95),
+                gender=rng.choice('MF'),
+                phone=f'9{rng.randint(0, 999999999):09d}',
+                address=f'{city}, {state}',
+                city=city,
+                state=state,
+                entry_datetime=now - timedelta(minutes=rng.randint(0, 525600)),
+                is_admitted=admitted,
+            ))
+        Patient.objects.bulk_create(batch)
+        created += size
+    # bulk_create skips the signals that keep the census and API cache current.
+    census.rebuild()
+    api_cache.changed('patients')
+    return created
+
+
+@benchmark('search', sizes=[10_000, 100_000, 1_000_000])
+def bench_search(sizes, repeat=20, stdout=None):
+    """Indexed search backend against the legacy icontains scan."""
+    from .models import Patient
+    from .search import get_backend, rebuild_index, search_patients
+
+    backend = get_backend().name
+    results = []
+    seeded = 0
+    for size in sizes:
+        seeded += seed_patients(size - seeded, seed=size)
+        rebuild_index()
+        sample = list(Patient.objects.values_list('last_name', 'phone', 'patient_id')[:repeat])
+        queries = []
+        for last_name, phone, patient_id in sample:
+            # Prefixes, whole values and the substrings reception also types.
+            queries.extend([last_name[:4], last_name[1:5], phone[:6], phone[-4:], patient_id, patient_id[-4:]])
+        for name in ('icontains', backend):
+            samples = []
+            for query in queries:
+                samples.extend(time_calls(
+                    lambda: list(search_patients(Patient.objects.all(), query, backend=name)[:10]), 1
+                ))
+            row = {'size': size, 'backend': name, **summarize(samples)}
+            results.append(row)
+            if stdout:
+                stdout.write(f"{size:>9} rows  {name:<10} p50 {row['p50_ms']:>9.3f} ms  p95 {row['p95_ms']:>9.3f} ms")
+    return results
+
+
+@benchmark('vitals_trend', sizes=[50_000])
+def bench_vitals_trend(sizes, repeat=20, stdout=None):
+    """30-day trend on one patient: rollups and SQL aggregates vs parsing text readings in Python."""
+    from .models import Patient, PatientVitals, parse_blood_pressure, parse_measurement
+    from .rollups import rebuild, vitals_series
+    from .vitals import vitals_in_range, vitals_trend
+
+    seed_patients(1)
+    patient = Patient.objects.latest('pk')
+    rng = random.Random(7)
+    now = timezone.now()
+    results = []
+    seeded = 0
+    for size in sizes:
+        step = timedelta(days=365) / size
+        batch = []
+        for n in range(seeded, size):
+            systolic, diastolic = rng.randint(100, 150), rng.randint(60, 95)
+            pulse, spo2 = rng.randint(55, 110), rng.randint(90, 100)
+            batch.append(PatientVitals(
+                patient=patient, recorded_at=now - step * n,
+                blood_pressure=f'{systolic}/{diastolic}', pulse_rate=f'{pulse} bpm', oxygen_saturation=f'{spo2}%',
+                systolic=systolic, diastolic=diastolic, pulse=pulse, spo2=spo2,
+            ))
+        PatientVitals.objects.bulk_create(batch, batch_size=5000)
+        rebuild([patient.pk])
+        seeded = size
+        start = now - timedelta(days=30)
+
+        def python_trend():
+            days = {}
+            rows = PatientVitals.objects.filter(patient=patient).values_list(
+                'recorded_at', 'blood_pressure', 'pulse_rate', 'oxygen_saturation')
+            for recorded_at, bp, pulse, spo2 in rows:
+                if recorded_at < start:
+                    continue
+                systolic, diastolic = parse_blood_pressure(bp)
+                day = days.setdefault(timezone.localdate(recorded_at), [])
+                day.append((systolic, diastolic, parse_measurement(pulse), parse_measurement(spo2)))
+            return {day: [sum(col) / len(col) for col in zip(*values)] for day, values in days.items()}
+
+        for name, func in (
+            ('python_parse', python_trend),
+            ('sql_trend', lambda: list(vitals_trend(patient.pk, start, now))),
+            ('sql_range', lambda: list(vitals_in_range(patient.pk, start, now).values_list('systolic', 'pulse'))),
+            ('rollup_series', lambda: vitals_series(patient.pk, start, now)),
+            ('rollup_year', lambda: vitals_series(patient.pk, now - timedelta(days=365), now)),
+        ):
+            row = {'size': size, 'method': name, **summarize(time_calls(func, repeat))}
+            results.append(row)
+            if stdout:
+                stdout.write(f"{size:>9} readings  {name:<13} p50 {row['p50_ms']:>9.3f} ms  p95 {row['p95_ms']:>9.3f} ms")
+    return results
+
+
+@benchmark('vitals_ingest', sizes=[10_000, 50_000])
+def bench_vitals_ingest(sizes, repeat=3, stdout=None):
+    """Bulk vitals ingest throughput through the API, JSON and NDJSON bodies."""
+    import json
+
+    from django.test import Client
+
+    from .models import Patient, PatientVitals
+
+    User = Patient._meta.get_field('created_by').related_model
+    user = User.objects.create(username='bench-ingest')
+    client = Client()
+    client.force_login(user)
+    seed_patients(200)
+    patient_pks = list(Patient.objects.values_list('pk', flat=True))
+    rng = random.Random(11)
+    now = timezone.now()
+    results = []
+    for size in sizes:
+        readings = [{
+            'patient': rng.choice(patient_pks),
+            'recorded_at': (now - timedelta(seconds=n * 5)).isoformat(),
+            'systolic': rng.randint(100, 150), 'diastolic': rng.randint(60, 95),
+            'pulse': rng.randint(55, 110), 'spo2': rng.randint(90, 100),
+            'temperature': round(rng.uniform(97, 101), 1),
+        } for n in range(size)]
+        bodies = {
+            'json': (json.dumps(readings), 'application/json'),
+            'ndjson': ('\n'.join(json.dumps(row) for row in readings), 'application/x-ndjson'),
+        }
+        for name, (body, content_type) in bodies.items():
+            samples = time_calls(
+                lambda: client.post('/api/v1/patients/vitals/bulk/', body, content_type=content_type), repeat
+            )
+            row = {'size': size, 'format': name, **summarize(samples)}
+            row['rows_per_sec'] = round(size / (row['p50_ms'] / 1000))
+            results.append(row)
+            if stdout:
+                stdout.write(f"{size:>9} readings  {name:<7} p50 {row['p50_ms']:>10.1f} ms  {row['rows_per_sec']:>9,} rows/sec")
+        PatientVitals.objects.all().delete()
+    return results
+
+
+@benchmark('vitals_export', sizes=[10_000, 100_000])
+def bench_vitals_export(sizes, repeat=3, stdout=None):
+    """Streamed vitals export: throughput and traced peak memory, which should not grow with size."""
+    import gc
+    import tracemalloc
+
+    from .exports import FORMATS, vitals_response
+    from .models import Patient, PatientVitals
+
+    seed_patients(1)
+    patient = Patient.objects.latest('pk')
+    now = timezone.now()
+    results = []
+    seeded = 0
+    for size in sizes:
+        PatientVitals.objects.bulk_create([
+            PatientVitals(
+                patient=patient, recorded_at=now - timedelta(minutes=n), blood_pressure='120/80',
+                systolic=120, diastolic=80, pulse=72, spo2=98, notes='Routine observation',
+            ) for n in range(seeded, size)
+        ], batch_size=5000)
+        seeded = size
+        for fmt in FORMATS:
+
+            def export(traced=False):
+                response = vitals_response(PatientVitals.objects.filter(patient=patient), fmt, 'bench')
+                if traced:
+                    gc.collect()
+                    tracemalloc.start()
+                try:
+                    for _ in response.streaming_content:
+                        pass
+                    if traced:
+                        return tracemalloc.get_traced_memory()[1]
+                finally:
+                    if traced:
+                        tracemalloc.stop()
+                    response.close()
+
+            row = {'size': size, 'format': fmt, **summarize(time_calls(export, repeat))}
+            row['rows_per_sec'] = round(size / (row['p50_ms'] / 1000))
+            row['peak_mb'] = round(export(traced=True) / 1e6, 2)
+            results.append(row)
+            if stdout:
+                stdout.write(
+                    f"{size:>9} readings  {fmt:<7} p50 {row['p50_ms']:>9.1f} ms  "
+                    f"{row['rows_per_sec']:>9,} rows/sec  peak {row['peak_mb']:>5.2f} MB"
+                )
+    return results
+
+
+@benchmark('patient_export', sizes=[10_000, 100_000])
+def bench_patient_export(sizes, repeat=3, stdout=None):
+    """Streamed patient register export vs paging the list API; rows/sec and traced peak memory."""
+    import gc
+    import tracemalloc
+
+    from django.test import Client
+
+    from .exports import patient_queryset, patient_response
+    from .models import Patient
+
+    User = Patient._meta.get_field('created_by').related_model
+    client = Client()
+    client.force_login(User.objects.create(username='bench-export'))
+    results = []
+    seeded = 0
+    for size in sizes:
+        seeded += seed_patients(size - seeded, seed=size)
+
+        def paged_api():
+            page = 1
+            while client.get('/api/v1/patients/', {'page': page}).json().get('next'):
+                page += 1
+
+        def export(fmt, traced=False):
+            response = patient_response(patient_queryset(), fmt)
+            if traced:
+                gc.collect()
+                tracemalloc.start()
+            try:
+                for _ in response.streaming_content:
+                    pass
+                if traced:
+                    return tracemalloc.get_traced_memory()[1]
+            finally:
+                if traced:
+                    tracemalloc.stop()
+                response.close()
+
+        methods = [('csv', lambda: export('csv')), ('ndjson', lambda: export('ndjson'))]
+        # Paging 20 rows at a time is too slow to repeat on big registers.
+        if size <= 20_000:
+            methods.append(('paged_api', paged_api))
+        for name, func in methods:
+            row = {'size': size, 'method': name, **summarize(time_calls(func, 1 if name == 'paged_api' else repeat))}
+            row['rows_per_sec'] = round(size / (row['p50_ms'] / 1000))
+            if name != 'paged_api':
+                row['peak_mb'] = round(export(name, traced=True) / 1e6, 2)
+            results.append(row)
+            if stdout:
+                peak = f"  peak {row['peak_mb']:>5.2f} MB" if 'peak_mb' in row else ''
+                stdout.write(
+                    f"{size:>9} patients  {name:<9} p50 {row['p50_ms']:>9.1f} ms  "
+                    f"{row['rows_per_sec']:>9,} rows/sec{peak}"
+                )
+    return results
+
+
+def write_patient_csv(path, count, seed=42):
+    """Write `count` synthetic patients as an import CSV."""
+    import csv
+
+    rng = random.Random(seed)
+    with open(path, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.writer(fh)
+        writer.writerow([
+            'first_name', 'last_name', 'age', 'gender', 'phone', 'address', 'city', 'state',
+            'has_ayushman_card', 'ayushman_card_number', 'entry_datetime', 'is_admitted',
+        ])
+        for n in range(count):
+            city, state = rng.choice(CITIES)
+            ayushman = rng.random() < 0.2
+            writer.writerow([
+                rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), rng.randint(0, 95), rng.choice('MF'),
+                f'9{rng.randint(0, 999999999):09d}', f'{city}, {state}', city, state,
+                'yes' if ayushman else 'no', f'AB{n:010d}' if ayushman else '',
+                f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 10:00', rng.choice(['true', 'false']),
+            ])
+
+
+@benchmark('patient_import', sizes=[10_000, 100_000])
+def bench_patient_import(sizes, repeat=1, stdout=None):
+    """Chunked bulk import from CSV vs saving PatientForm rows one at a time."""
+    import os
+    import tempfile
+
+    from .forms import PatientForm
+    from .imports import import_patients, read_rows
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        sample = os.path.join(tmp, 'sample.csv')
+        write_patient_csv(sample, 1000, seed=1)
+
+        def per_row():
+            with open(sample, newline='') as fh:
+                for row in read_rows(fh, 'csv'):
+                    form = PatientForm({**row, 'has_ayushman_card': row['has_ayushman_card'] == 'yes'})
+                    form.save()
+
+        rate = 1000 / (statistics.fmean(time_calls(per_row, 1)) / 1000)
+        results.append({'size': 1000, 'method': 'form_per_row', 'rows_per_sec': round(rate)})
+        if stdout:
+            stdout.write(f"{1000:>9} rows  {'form_per_row':<12} {rate:>9,.0f} rows/sec")
+
+        for size in sizes:
+            path = os.path.join(tmp, f'patients-{size}.csv')
+            write_patient_csv(path, size, seed=size)
+            outcome = {}
+
+            def bulk():
+                with open(path, newline='') as fh:
+                    outcome.update(import_patients(read_rows(fh, 'csv')))
+
+            # Every run inserts `size` more patients, so keep repeats low.
+            samples = time_calls(bulk, min(repeat, 3))
+            row = {'size': size, 'method': 'bulk_import', **summarize(samples), 'created': outcome['created']}
+            row['rows_per_sec'] = round(size / (row['p50_ms'] / 1000))
+            results.append(row)
+            if stdout:
+                stdout.write(
+                    f"{size:>9} rows  {'bulk_import':<12} {row['rows_per_sec']:>9,} rows/sec  "
+                    f"({outcome['created']} created, {outcome['error_count']} rejected)"
+                )
+    return results
+
+
+def scan_jpeg(seed, size=(2048, 1536)):
+    """A grayscale JPEG about the size of a scanned X-ray."""
+    import io
+
+    from PIL import Image
+
+    rng = random.Random(seed)
+    image = Image.blend(
+        Image.linear_gradient('L').resize(size).rotate(rng.randint(0, 359)),
+        Image.effect_noise(size, rng.randint(5, 15)),
+        0.3,
+    )
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+@benchmark('document_previews', sizes=[200])
+def bench_document_previews(sizes, repeat=20, stdout=None):
+    """Upload latency with the preview queue, and backfill throughput per pool size."""
+    import os
+    import tempfile
+
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.test import override_settings
+
+    from . import previews
+    from .models import DocumentPreviewJob, Patient, PatientDocument
+
+    seed_patients(1)
+    patient = Patient.objects.get()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=tmp):
+        scan = scan_jpeg(0)
+        uploads = iter(range(10 ** 9))
+        for filename in ('scan.pdf', 'scan.jpg'):
+            def upload():
+                # Trailing bytes keep every upload a distinct blob.
+                content = scan + str(next(uploads)).encode()
+                PatientDocument(patient=patient, title=filename, file=SimpleUploadedFile(filename, content)).save()
+            row = {'method': f'upload {filename}', **summarize(time_calls(upload, repeat))}
+            results.append(row)
+            if stdout:
+                stdout.write(f"{row['method']:<22} p50 {row['p50_ms']:>8.2f} ms  p95 {row['p95_ms']:>8.2f} ms")
+        PatientDocument.objects.all().delete()
+
+        for size in sizes:
+            for n in range(size):
+                PatientDocument(
+                    patient=patient, title=f'X-ray {n}', document_type='xray',
+                    file=SimpleUploadedFile(f'xray-{n}.jpg', scan_jpeg(n)),
+                ).save()
+            pools = sorted({1, os.cpu_count() or 1})
+            for fmt, workers in [(fmt, workers) for fmt in previews.FORMATS for workers in pools]:
+                DocumentPreviewJob.objects.update(status='pending', attempts=0)
+                with override_settings(DOCUMENT_PREVIEW_FORMAT=fmt):
+                    stats = previews.run(workers=workers)
+                row = {
+                    'size': size, 'method': f'{fmt} pool x{workers}', 'seconds': round(stats['seconds'], 2),
+                    'images_per_sec': round(stats['done'] / stats['seconds'], 1),
+                    'mb_per_sec': round(stats['bytes'] / stats['seconds'] / 1_000_000, 1),
+                }
+                results.append(row)
+                if stdout:
+                    stdout.write(
+                        f"{size:>6} images  {row['method']:<15} {row['seconds']:>7.2f}s  "
+                        f"{row['images_per_sec']:>7.1f} images/sec  {row['mb_per_sec']:>6.1f} MB/s"
+                    )
+            PatientDocument.objects.all().delete()
+    return results
+
+
+@benchmark('media_gc', sizes=[100_000, 500_000])
+def bench_media_gc(sizes, repeat=1, stdout=None):
+    """Orphan scan rate and traced peak memory, which should not grow with the file count."""
+    import gc
+    import hashlib
+    import os
+    import tempfile
+    import tracemalloc
+
+    from django.test import override_settings
+
+    from .media_gc import find_orphans
+    from .models import DocumentBlob
+    from .storage import document_storage
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=tmp):
+        created = 0
+        for size in sizes:
+            # Every other file has a blob row; the rest are orphans.
+            blobs = []
+            for n in range(created, size):
+                digest = hashlib.sha256(str(n).encode()).hexdigest()
+                path = document_storage.path(document_storage.blob_name(digest))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                open(path, 'wb').close()
+                if n % 2 == 0:
+                    blobs.append(DocumentBlob(sha256=digest, size=0, refcount=1))
+            DocumentBlob.objects.bulk_create(blobs, batch_size=5000)
+            created = size
+
+            def scan(traced=False):
+                if traced:
+                    gc.collect()
+                    tracemalloc.start()
+                try:
+                    orphans = sum(1 for _ in find_orphans(document_storage.path('documents'), min_age=0))
+                    return tracemalloc.get_traced_memory()[1] if traced else orphans
+                finally:
+                    if traced:
+                        tracemalloc.stop()
+
+            started = time.perf_counter()
+            orphans = scan()
+            elapsed = time.perf_counter() - started
+            row = {
+                'size': size, 'orphans': orphans, 'seconds': round(elapsed, 2),
+                'files_per_sec': round(size / elapsed), 'peak_mb': round(scan(traced=True) / 1e6, 2),
+            }
+            results.append(row)
+            if stdout:
+                stdout.write(
+                    f"{size:>9} files  {row['seconds']:>7.2f}s  {row['files_per_sec']:>9,} files/sec  "
+                    f"{orphans:>9,} orphans  peak {row['peak_mb']:>5.2f} MB"
+                )
+    return results
+
+
+@benchmark('patient_serializer', sizes=[1_000, 10_000])
+def bench_patient_serializer(sizes, repeat=20, stdout=None):
+    """PatientSerializer against the .values() read path, all fields and a ?fields= subset."""
+    from .api_views import PatientSerializer
+    from .models import Patient
+    from .projections import PATIENT_COMPUTED, Projection
+
+    sparse = ('id', 'patient_id', 'full_name', 'phone', 'status')
+    results = []
+    seeded = 0
+    for size in sizes:
+        seeded += seed_patients(size - seeded, seed=size)
+        queryset = Patient.objects.order_by('-created_at', 'id')
+
+        def fast(fields=None):
+            projection = Projection(PatientSerializer, PATIENT_COMPUTED, fields)
+            return projection.rows(projection.values(queryset))
+
+        methods = [
+            ('serializer', lambda: PatientSerializer(queryset, many=True).data),
+            ('values', fast),
+            ('values_sparse', lambda: fast(sparse)),
+        ]
+        baseline = None
+        for name, func in methods:
+            row = {'size': size, 'method': name, **summarize(time_calls(func, repeat))}
+            row['rows_per_sec'] = round(size / (row['p50_ms'] / 1000))
+            baseline = baseline or row['p50_ms']
+            row['speedup'] = round(baseline / row['p50_ms'], 1)
+            results.append(row)
+            if stdout:
+                stdout.write(
+                    f"{size:>7} rows  {name:<13} p50 {row['p50_ms']:>9.1f} ms  "
+                    f"{row['rows_per_sec']:>9,} rows/sec  {row['speedup']:>5.1f}x"
+                )
+    return results
+
+
+@benchmark('api_cache', sizes=[10_000, 100_000])
+def bench_api_cache(sizes, repeat=20, stdout=None):
+    """Patient API requests/sec without and with the response cache, at 50 reads per write."""
+    import tempfile
+
+    from django.db import reset_queries
+    from django.test import Client, override_settings
+
+    from . import api_cache
+    from .models import Patient
+
+    User = Patient._meta.get_field('created_by').related_model
+    client = Client()
+    client.force_login(User.objects.create(username='bench-cache'))
+    results = []
+    seeded = 0
+    for size in sizes:
+        seeded += seed_patients(size - seeded, seed=size)
+        rng = random.Random(size)
+        pks = list(Patient.objects.values_list('pk', flat=True)[:2000])
+        names = list(Patient.objects.values_list('last_name', flat=True).distinct())
+        # Ward tablets polling their patients, the admitted list and a few searches.
+        urls = [f'/api/v1/patients/{pk}/' for pk in rng.sample(pks, 20)]
+        urls += ['/api/v1/patients/', '/api/v1/patients/?status=admitted']
+        urls += [f'/api/v1/patients/search/?q={name}' for name in names[:3]]
+        requests = repeat * 50
+
+        def workload():
+            for n in range(requests):
+                reset_queries()
+                if n % 50 == 49:
+                    patient = Patient.objects.get(pk=rng.choice(pks))
+                    patient.notes = f'edit {n}'
+                    patient.save()
+                client.get(rng.choice(urls))
+
+        for name in ('uncached', 'cached'):
+            with tempfile.TemporaryDirectory() as tmp, override_settings(
+                PATIENT_API_CACHE='' if name == 'uncached' else 'patient_api',
+                CACHES={
+                    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                    'patient_api': {
+                        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                        'LOCATION': tmp, 'OPTIONS': {'MAX_ENTRIES': 20_000},
+                    },
+                },
+            ):
+                api_cache.reset_stats()
+                workload()  # warm up
+                api_cache.reset_stats()
+                started = time.perf_counter()
+                workload()
+                elapsed = time.perf_counter() - started
+                stats = api_cache.stats()
+            row = {'size': size, 'mode': name, 'requests': requests, 'requests_per_sec': round(requests / elapsed)}
+            if stats is not None:
+                row['hit_rate'] = round(stats['hit_rate'], 3)
+            results.append(row)
+            if stdout:
+                hit_rate = f"  hit rate {row['hit_rate']:.1%}" if 'hit_rate' in row else ''
+                stdout.write(
+                    f"{size:>9} patients  {name:<9} {row['requests_per_sec']:>7,} requests/sec{hit_rate}"
+                )
+    return results
+
+
+
+@benchmark('patient_batch', sizes=[100, 500])
+def bench_patient_batch(sizes, repeat=20, stdout=None):
+    """
+    Fetching many patients (and their latest vitals) with one detail GET each
+    against one POST /batch/; sizes are ids per batch.
+    """
+    import json
+
+    from django.db import reset_queries
+    from django.test import Client, override_settings
+    from rest_framework.authtoken.models import Token
+
+    from .models import Patient, PatientVitals
+
+    User = Patient._meta.get_field('created_by').related_model
+    token = Token.objects.create(user=User.objects.create(username='bench-batch'))
+    client = Client(headers={'Authorization': f'Token {token.key}'})
+    seed_patients(10_000)
+    rng = random.Random(3)
+    now = timezone.now()
+    pks = list(Patient.objects.values_list('pk', flat=True))
+    PatientVitals.objects.bulk_create([
+        PatientVitals(patient_id=pk, recorded_at=now - timedelta(hours=rng.randint(0, 720)), pulse=rng.randint(55, 110))
+        for pk in pks for _ in range(5)
+    ], batch_size=5000)
+    rounds = max(1, repeat // 5)
+    results = []
+    for size in sizes:
+        ids = rng.sample(pks, size)
+
+        def single(vitals=False):
+            for pk in ids:
+                reset_queries()
+                client.get(f'/api/v1/patients/{pk}/')
+                if vitals:
+                    client.get(f'/api/v1/patients/{pk}/vitals/')
+
+        def batched(vitals=False):
+            reset_queries()
+            body = json.dumps({'ids': ids, 'latest_vitals': vitals})
+            response = client.post('/api/v1/patients/batch/', body, content_type='application/json')
+            assert response.status_code == 200 and not response.json()['not_found']
+
+        baseline = {}
+        with override_settings(PATIENT_API_CACHE=''):
+            for name, func, vitals in (
+                ('single', single, False),
+                ('batch', batched, False),
+                ('single_vitals', single, True),
+                ('batch_vitals', batched, True),
+            ):
+                row = {'size': size, 'method': name, **summarize(time_calls(lambda: func(vitals), rounds))}
+                row['patients_per_sec'] = round(size / (row['p50_ms'] / 1000))
+                baseline.setdefault(vitals, row['patients_per_sec'])
+                row['speedup'] = round(row['patients_per_sec'] / baseline[vitals], 1)
+                results.append(row)
+                if stdout:
+                    stdout.write(
+                        f"{size:>5} ids  {name:<14} {row['p50_ms']:>9.1f} ms  "
+                        f"{row['patients_per_sec']:>9,} patients/sec  {row['speedup']:>6.1f}x"
+                    )
+    return results
+
+@benchmark('asgi_concurrency', sizes=[4, 32])
+def bench_asgi_concurrency(sizes, repeat=20, stdout=None):
+    """
+    Patient API reads under WSGI (4 sync workers) and ASGI with every query
+    slowed by 50 ms; sizes are concurrent clients, each making `repeat` reads.
+    """
+    import asyncio
+    import threading
+    import types
+    from io import BytesIO
+
+    from django.conf import settings
+    from django.core.handlers.asgi import ASGIHandler
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.db.backends.signals import connection_created
+    from django.test import override_settings
+    from django.urls import include, path
+    from rest_framework.authtoken.models import Token
+
+    from .api_urls import read_urlpatterns
+    from .models import Patient
+
+    query_delay = 0.05
+    wsgi_workers = 4
+    User = Patient._meta.get_field('created_by').related_model
+    token = Token.objects.create(user=User.objects.create(username='bench-asgi'))
+    seed_patients(10_000)
+    rng = random.Random(0)
+    pks = list(Patient.objects.values_list('pk', flat=True)[:500])
+    names = list(Patient.objects.values_list('last_name', flat=True).distinct())
+    paths = [(f'/api/v1/patients/{pk}/', '') for pk in rng.sample(pks, 20)]
+    paths += [('/api/v1/patients/', ''), ('/api/v1/patients/', 'status=admitted')]
+    paths += [('/api/v1/patients/search/', f'q={name}') for name in names[:4]]
+    authorization = f'Token {token.key}'
+
+    def slow_query(execute, sql, params, many, context):
+        time.sleep(query_delay)
+        return execute(sql, params, many, context)
+
+    def slow_down(sender, connection, **kwargs):
+        if slow_query not in connection.execute_wrappers:
+            connection.execute_wrappers.append(slow_query)
+
+    def start_response(status, headers):
+        pass
+
+    def run_wsgi(clients):
+        app = WSGIHandler()
+        workers = threading.Semaphore(wsgi_workers)
+        samples = []
+
+        def client(seed):
+            picks = random.Random(seed)
+            for _ in range(repeat):
+                path, query = picks.choice(paths)
+                environ = {
+                    'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+                    'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'HTTP_HOST': 'testserver',
+                    'HTTP_AUTHORIZATION': authorization, 'wsgi.input': BytesIO(), 'wsgi.url_scheme': 'http',
+                }
+                start = time.perf_counter()
+                # A request waits for a free worker, as in gunicorn's accept queue.
+                with workers:
+                    b''.join(app(environ, start_response))
+                samples.append((time.perf_counter() - start) * 1000)
+
+        threads = [threading.Thread(target=client, args=(seed,)) for seed in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return samples
+
+    def run_asgi(clients):
+        app = ASGIHandler()
+        samples = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            pass
+
+        async def client(seed):
+            picks = random.Random(seed)
+            for _ in range(repeat):
+                path, query = picks.choice(paths)
+                scope = {
+                    'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                    'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                    'root_path': '', 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+                    'headers': [(b'host', b'testserver'), (b'authorization', authorization.encode())],
+                }
+                start = time.perf_counter()
+                await app(scope, receive, send)
+                samples.append((time.perf_counter() - start) * 1000)
+
+        async def main():
+            await asyncio.gather(*(client(seed) for seed in range(clients)))
+
+        asyncio.run(main())
+        return samples
+
+    def urlconf(async_reads):
+        # Each deployment's routes, as PATIENT_ASYNC_READS would pick them.
+        module = types.ModuleType(f'bench_urls_{async_reads}')
+        module.urlpatterns = [path('api/v1/patients/', include(read_urlpatterns(async_reads)))]
+        return module
+
+    # asgi.py drops the sync-only WhiteNoise middleware; 'asgi_whitenoise'
+    # shows what keeping it costs.
+    without_whitenoise = [name for name in settings.MIDDLEWARE if not name.startswith('whitenoise.')]
+    with_whitenoise = [*without_whitenoise[:1], 'whitenoise.middleware.WhiteNoiseMiddleware', *without_whitenoise[1:]]
+    modes = [
+        ('wsgi', run_wsgi, with_whitenoise, urlconf(False)),
+        ('asgi', run_asgi, without_whitenoise, urlconf(True)),
+        ('asgi_whitenoise', run_asgi, with_whitenoise, urlconf(True)),
+    ]
+    results = []
+    connection_created.connect(slow_down)
+    slow_down(None, connection)
+    try:
+        with override_settings(PATIENT_API_CACHE='', ALLOWED_HOSTS=['testserver']):
+            for clients in sizes:
+                for name, run, middleware, routes in modes:
+                    with override_settings(MIDDLEWARE=middleware, ROOT_URLCONF=routes):
+                        started = time.perf_counter()
+                        samples = run(clients)
+                        elapsed = time.perf_counter() - started
+                    row = {
+                        'clients': clients, 'mode': name,
+                        'requests_per_sec': round(len(samples) / elapsed, 1), **summarize(samples),
+                    }
+                    results.append(row)
+                    if stdout:
+                        stdout.write(
+                            f"{clients:>4} clients  {name:<16} {row['requests_per_sec']:>7.1f} requests/sec  "
+                            f"p50 {row['p50_ms']:>8.1f} ms  p95 {row['p95_ms']:>8.1f} ms"
+                        )
+    finally:
+        connection_created.disconnect(slow_down)
+        connection.execute_wrappers.remove(slow_query)
+    return results
+
+
+@benchmark('audit', sizes=[1_000, 10_000])
+def bench_audit(sizes, repeat=20, stdout=None):
+    """
+    Cost of auditing a patient access: one synchronous INSERT per event
+    against the write-behind queue (sizes are events), then patient detail
+    GETs with auditing off and on.
+    """
+    from django.test import Client, override_settings
+
+    from .audit import AuditLog
+    from .models import Patient, PatientAccessEvent
+
+    User = Patient._meta.get_field('created_by').related_model
+    user = User.objects.create(username='bench-audit')
+    seed_patients(10_000)
+    pks = list(Patient.objects.values_list('pk', flat=True)[:1000])
+    results = []
+
+    def report(row, label, unit='event'):
+        results.append(row)
+        if stdout:
+            stdout.write(f"{label:<28} {row['p50_ms'] * 1000:>10.1f} us/{unit}  p95 {row['p95_ms'] * 1000:>8.1f} us")
+
+    for size in sizes:
+        events = [pks[i % len(pks)] for i in range(size)]
+
+        def direct():
+            for pk in events:
+                PatientAccessEvent.objects.create(
+                    patient_id=pk, user_id=user.pk, action='view', ip_address='127.0.0.1', occurred_at=timezone.now(),
+                )
+
+        with override_settings(PATIENT_AUDIT_QUEUE_SIZE=size, PATIENT_AUDIT_SINK='db'):
+            samples = [ms / size for ms in time_calls(direct, max(1, repeat // 10))]
+            row = {'size': size, 'method': 'insert', **summarize(samples)}
+            report(row, f'{size:>6} events  insert')
+
+            # A fresh log per round, so its writer drains exactly this round.
+            samples = []
+            drained = []
+            for _ in range(repeat):
+                log = AuditLog()
+                start = time.perf_counter()
+                for pk in events:
+                    log.record(pk, user.pk, 'view', '', '127.0.0.1')
+                samples.append((time.perf_counter() - start) * 1000 / size)
+                log.flush()
+                drained.append(time.perf_counter() - start)
+            row = {
+                'size': size, 'method': 'queued', **summarize(samples),
+                'rows_per_sec': round(size / statistics.median(drained)),
+            }
+            report(row, f'{size:>6} events  queued')
+            if stdout:
+                stdout.write(f"{'':<28} {row['rows_per_sec']:>10,} rows/sec written")
+        PatientAccessEvent.objects.all().delete()
+
+    client = Client()
+    client.force_login(user)
+    for pk in pks[:50]:
+        client.get(f'/api/v1/patients/{pk}/')
+    for sink in ('', 'db'):
+        with override_settings(PATIENT_API_CACHE='', PATIENT_AUDIT_SINK=sink):
+            samples = time_calls(lambda: client.get(f'/api/v1/patients/{random.choice(pks)}/'), repeat * 25)
+        row = {'method': f"detail_get_audit_{'on' if sink else 'off'}", **summarize(samples)}
+        report(row, f"detail GET, audit {'on' if sink else 'off'}", 'request')
+    return results
+
+
+def view_path(view, **kwargs):
+    """The URL of `view` (a view function or class) wherever the URLconf mounts it."""
+    from django.urls import URLResolver, get_resolver
+
+    def walk(patterns, prefix):
+        for pattern in patterns:
+            route = prefix + str(pattern.pattern)
+            if isinstance(pattern, URLResolver):
+                found = walk(pattern.url_patterns, route)
+                if found:
+                    return found
+            elif view in (pattern.callback, getattr(pattern.callback, 'view_class', None)):
+                return route
+        return None
+
+    route = walk(get_resolver().url_patterns, '/')
+    if route is None:
+        return None
+    return re.sub(r'<(?:\w+:)?(\w+)>', lambda match: str(kwargs[match.group(1)]), route)
+
+
+def api_read_views():
+    """The (list, detail, search) views the URLconf routes patient API reads to."""
+    from django.conf import settings
+
+    from . import api_views, async_views
+
+    if getattr(settings, 'PATIENT_ASYNC_READS', False):
+        return async_views.patient_list, async_views.patient_detail, async_views.patient_search
+    return api_views.PatientListCreateView, api_views.PatientDetailView, api_views.patient_search
+
+
+@benchmark('views', sizes=[1_000, 10_000, 100_000])
+def bench_views(sizes, repeat=20, stdout=None):
+    """
+    Query count, SQL time, full table scans and p50/p95/p99 latency of the
+    patient pages and API endpoints as the patients table grows.
+    """
+    import json
+
+    from django.test import Client, override_settings
+
+    from . import api_views, views
+    from .models import Patient, PatientVitals
+
+    User = Patient._meta.get_field('created_by').related_model
+    client = Client()
+    client.force_login(User.objects.create(username='bench-views'))
+    rng = random.Random(7)
+    now = timezone.now()
+    term = LAST_NAMES[0]
+    api_list, api_detail, api_search = api_read_views()
+    results = []
+    seeded = 0
+    for size in sizes:
+        last_pk = Patient.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        seeded += seed_patients(size - seeded, seed=size)
+        new_pks = list(Patient.objects.filter(pk__gt=last_pk).values_list('pk', flat=True))
+        # A couple of readings for everyone; the patient under test has months of them.
+        PatientVitals.objects.bulk_create([
+            PatientVitals(patient_id=pk, recorded_at=now - timedelta(days=rng.randint(0, 365)), pulse=rng.randint(55, 110))
+            for pk in new_pks for _ in range(2)
+        ], batch_size=5000)
+        patient = Patient.objects.order_by('pk').first()
+        PatientVitals.objects.bulk_create([
+            PatientVitals(
+                patient=patient, recorded_at=now - timedelta(hours=hours),
+                systolic=rng.randint(100, 160), diastolic=rng.randint(60, 100), pulse=rng.randint(55, 110),
+            )
+            for hours in range(0, 24 * 90, 6)
+        ])
+        batch = json.dumps({'ids': rng.sample(new_pks, min(100, len(new_pks))), 'latest_vitals': True})
+        cases = [
+            ('patient_list', views.patient_list, {}, ''),
+            ('patient_list_search', views.patient_list, {}, f'q={term}'),
+            ('patient_list_admitted', views.patient_list, {}, 'status=admitted'),
+            ('patient_detail', views.patient_detail, {'pk': patient.pk}, ''),
+            ('patient_history', views.patient_history, {'pk': patient.pk}, ''),
+            ('patient_search_ajax', views.patient_search_ajax, {}, f'q={term[:3]}'),
+            ('api_list', api_list, {}, ''),
+            ('api_list_search', api_list, {}, f'q={term}'),
+            ('api_detail', api_detail, {'pk': patient.pk}, ''),
+            ('api_search', api_search, {}, f'q={term}'),
+            ('api_census', api_views.patient_census, {}, ''),
+            ('api_vitals', api_views.PatientVitalsView, {'pk': patient.pk}, ''),
+            ('api_vitals_series', api_views.patient_vitals_series, {'pk': patient.pk}, ''),
+            ('api_timeline', api_views.patient_timeline, {'pk': patient.pk}, ''),
+            ('api_batch', api_views.patient_batch, {}, batch),
+        ]
+        for name, view, kwargs, query in cases:
+            path = view_path(view, **kwargs)
+            if path is None:
+                continue
+            if view is api_views.patient_batch:
+                def call():
+                    return client.post(path, query, content_type='application/json')
+            else:
+                def call():
+                    return client.get(f'{path}?{query}' if query else path)
+
+            # Audit writes run on their own thread and would only add noise.
+            with override_settings(PATIENT_API_CACHE='', PATIENT_AUDIT_SINK=''):
+                # The first request fills per-process state such as the autocomplete index.
+                response = call()
+                assert response.status_code == 200, f'{name}: {response.status_code}'
+                samples = []
+                logs = []
+                for _ in range(repeat):
+                    log = QueryLog()
+                    with connection.execute_wrapper(log):
+                        start = time.perf_counter()
+                        call()
+                        samples.append((time.perf_counter() - start) * 1000)
+                    logs.append(log)
+            scans = full_scans(logs[-1].queries)
+            row = {
+                'size': size, 'view': name,
+                'queries': statistics.median_low(len(log.queries) for log in logs),
+                'sql_ms': round(statistics.median(log.sql_ms for log in logs), 3),
+                'full_scans': len(scans), **summarize(samples),
+            }
+            results.append(row)
+            if stdout:
+                stdout.write(
+                    f"{size:>7} patients  {name:<22} {row['queries']:>3} queries {row['sql_ms']:>8.2f} ms SQL  "
+                    f"p50 {row['p50_ms']:>7.1f}  p95 {row['p95_ms']:>7.1f}  p99 {row['p99_ms']:>7.1f} ms"
+                )
+                for scan in scans:
+                    stdout.write(f"{'':>18}full scan of {scan}")
+    return results
+
+
+@benchmark('request_timing', sizes=[10_000])
+def bench_request_timing(sizes, repeat=20, stdout=None):
+    """
+    Overhead of RequestTimingMiddleware on a patient page and API list:
+    not installed, installed but not sampled, and sampled.
+    """
+    from django.conf import settings
+    from django.test import Client, override_settings
+
+    from . import instrumentation, views
+    from .models import Patient
+
+    User = Patient._meta.get_field('created_by').related_model
+    user = User.objects.create(username='bench-timing', is_staff=True)
+    middleware = 'apps.patients.instrumentation.RequestTimingMiddleware'
+    without = [name for name in settings.MIDDLEWARE if name != middleware]
+    modes = [
+        ('off', without, 0.0),
+        ('unsampled', [middleware, *without], 0.0),
+        ('sampled', [middleware, *without], 1.0),
+    ]
+    wrappers = connection.execute_wrappers
+
+    def request(mode, client, path):
+        _, stack, rate = modes[mode]
+        with override_settings(
+            MIDDLEWARE=stack, REQUEST_TIMING_SAMPLE_RATE=rate, REQUEST_TIMING_SERVER_TIMING=True,
+            PATIENT_API_CACHE='', PATIENT_AUDIT_SINK='',
+        ):
+            installed = instrumentation._record_query in wrappers
+            if stack is without and installed:
+                wrappers.remove(instrumentation._record_query)
+            try:
+                start = time.perf_counter()
+                client.get(path)
+                return (time.perf_counter() - start) * 1000
+            finally:
+                if stack is without and installed:
+                    wrappers.append(instrumentation._record_query)
+
+    results = []
+    for size in sizes:
+        seed_patients(size)
+        patient = Patient.objects.order_by('pk').first()
+        paths = [
+            ('patient_detail', view_path(views.patient_detail, pk=patient.pk)),
+            ('api_list', view_path(api_read_views()[0])),
+        ]
+        for name, path in paths:
+            if path is None:
+                continue
+            # One client per mode: a client builds its middleware chain on first use.
+            clients = []
+            for mode in range(len(modes)):
+                clients.append(Client())
+                clients[-1].force_login(user)
+                request(mode, clients[-1], path)
+            samples = [[] for _ in modes]
+            # Interleaved, so drift on a busy machine hits every mode alike.
+            for _ in range(repeat * 10):
+                for mode, client in enumerate(clients):
+                    samples[mode].append(request(mode, client, path))
+            baseline = statistics.median(samples[0])
+            for (mode, _, _), mode_samples in zip(modes, samples):
+                row = {'size': size, 'view': name, 'mode': mode, **summarize(mode_samples)}
+                row['overhead_us'] = round((statistics.median(mode_samples) - baseline) * 1000)
+                results.append(row)
+                if stdout:
+                    stdout.write(
+                        f"{name:<16} {mode:<10} p50 {row['p50_ms'] * 1000:>8.0f} us  "
+                        f"p95 {row['p95_ms'] * 1000:>8.0f} us  overhead {row['overhead_us']:>5} us"
+                    )
+    return results
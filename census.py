@@ -0,0 +1,112 @@
+"""
+Denormalized patient census.
+
+`PatientCensus` holds one row of running totals (total, admitted,
+discharged, new today). Patient saves and deletes adjust it with F()
+updates inside the same transaction as the write, so the list page,
+dashboard and API read four integers instead of counting the patients
+table. `rebuild()` recomputes the row from scratch; run the
+`rebuild_census` command after bulk loads that bypass model signals.
+"""
+
+from datetime import datetime, time
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Value, When
+from django.utils import timezone
+
+from .models import Patient, PatientCensus
+
+CENSUS_PK = 1
+
+
+def _start_of_today():
+    return timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+
+
+def compute():
+    """Count the patients table directly; used to rebuild and reconcile."""
+    counts = Patient.objects.aggregate(
+        total=Count('pk'),
+        admitted=Count('pk', filter=Q(is_admitted=True)),
+        new_today=Count('pk', filter=Q(created_at__gte=_start_of_today())),
+    )
+    counts['discharged'] = counts['total'] - counts['admitted']
+    return counts
+
+
+def rebuild():
+    with transaction.atomic():
+        counts = compute()
+        census, _ = PatientCensus.objects.update_or_create(
+            pk=CENSUS_PK, defaults={**counts, 'census_date': timezone.localdate()}
+        )
+    return census
+
+
+def get_census():
+    census = PatientCensus.objects.filter(pk=CENSUS_PK).first()
+    if census is None:
+        return rebuild()
+    if census.census_date != timezone.localdate():
+        census.new_today = 0
+    return census
+
+
+def _apply(total=0, admitted=0, discharged=0, new_today=0):
+    today = timezone.localdate()
+    updated = PatientCensus.objects.filter(pk=CENSUS_PK).update(
+        total=F('total') + total,
+        admitted=F('admitted') + admitted,
+        discharged=F('discharged') + discharged,
+        # The first change of a new day restarts the daily counter.
+        new_today=Case(
+            When(census_date=today, then=F('new_today') + new_today),
+            default=Value(max(new_today, 0)),
+        ),
+        census_date=today,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        # First use: the row is computed from the table, which already
+        # includes the change being recorded.
+        rebuild()
+
+
+def record_save(patient, created):
+    if created:
+        _apply(
+            total=1,
+            admitted=1 if patient.is_admitted else 0,
+            discharged=0 if patient.is_admitted else 1,
+            new_today=1,
+        )
+    else:
+        previous = getattr(patient, '_loaded_is_admitted', None)
+        if previous is not None and previous != patient.is_admitted:
+            shift = 1 if patient.is_admitted else -1
+            _apply(admitted=shift, discharged=-shift)
+    patient._loaded_is_admitted = patient.is_admitted
+
+
+def record_delete(patient):
+    is_admitted = getattr(patient, '_loaded_is_admitted', None)
+    if is_admitted is None:
+        is_admitted = patient.is_admitted
+    created_today = patient.created_at and timezone.localdate(patient.created_at) == timezone.localdate()
+    _apply(
+        total=-1,
+        admitted=-1 if is_admitted else 0,
+        discharged=0 if is_admitted else -1,
+        new_today=-1 if created_today else 0,
+    )
+
+
+def as_dict(census):
+    return {
+        'total': census.total,
+        'admitted': census.admitted,
+        'discharged': census.discharged,
+        'new_today': census.new_today,
+        'census_date': census.census_date,
+    }
@@ -0,0 +1,66 @@
+"""
+Conditional GET for the patient endpoints that ward tablets poll.
+
+Each endpoint computes its validators from one cheap query before it
+builds the body: a patient's `updated_at`, or the row count and newest
+stamps of a listing. A matching If-None-Match gets an empty 304. So does
+an If-Modified-Since that is not older than Last-Modified. Otherwise the
+validators are attached to the normal response.
+
+Last-Modified is only sent where a deletion would move it. Searched lists
+and vitals send just the ETag.
+"""
+
+import hashlib
+from calendar import timegm
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+CACHE_CONTROL = 'private, no-cache'
+
+
+def response_format(request):
+    """The negotiated renderer's format; 'json' for the plain async views."""
+    renderer = getattr(request, 'accepted_renderer', None)
+    return renderer.format if renderer is not None else 'json'
+
+
+def make_etag(request, *parts):
+    """
+    A weak ETag over `parts` and the representation asked for: the query
+    string (page, filters, ?fields=) and the negotiated renderer.
+    """
+    key = repr((response_format(request), sorted(request.GET.lists()), parts))
+    return f'W/"{hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()}"'
+
+
+def _timestamp(last_modified):
+    return timegm(last_modified.utctimetuple()) if last_modified else None
+
+
+def precondition_response(request, etag, last_modified):
+    """The 304 (or 412 for a failed If-Match) to send instead of the body, or None."""
+    if not etag and not last_modified:
+        return None
+    return get_conditional_response(request, etag=etag, last_modified=_timestamp(last_modified))
+
+
+def add_validators(response, etag, last_modified):
+    if (etag or last_modified) and response.status_code in (200, 304):
+        if etag:
+            response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(_timestamp(last_modified))
+        response['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+def conditional_response(request, etag, last_modified, build):
+    """
+    A 304 (or 412 for a failed If-Match) when the client's copy is
+    current, otherwise `build()`. `last_modified` is an aware datetime or None;
+    with no `etag` either, this is just `build()`.
+    """
+    response = precondition_response(request, etag, last_modified)
+    return add_validators(response if response is not None else build(), etag, last_modified)
@@ -0,0 +1,70 @@
+"""
+Management command to report how much disk document deduplication saves.
+Usage: python manage.py document_storage_report [--top 10] [--check]
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _size(num):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if num < 1024 or unit == 'GB':
+            return f'{num:,.0f} {unit}' if unit == 'B' else f'{num:,.1f} {unit}'
+        num /= 1024
+
+
+class Command(BaseCommand):
+    help = 'Summarize deduplicated document storage and the bytes it saves'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='List the N most shared blobs')
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Verify reference counts and blob files; exit with an error on mismatch',
+        )
+
+    def handle(self, *args, **options):
+        from django.db.models import Count, Sum
+
+        from apps.patients.models import DocumentBlob, PatientDocument
+        from apps.patients.storage import document_storage
+
+        documents = PatientDocument.objects.count()
+        legacy = PatientDocument.objects.filter(blob__isnull=True).count()
+        blobs = DocumentBlob.objects.filter(refcount__gt=0).aggregate(count=Count('pk'), stored=Sum('size'))
+        stored = blobs['stored'] or 0
+        queued = DocumentBlob.objects.filter(refcount=0).aggregate(count=Count('pk'), size=Sum('size'))
+        referenced = PatientDocument.objects.aggregate(total=Sum('blob__size'))['total'] or 0
+        saved = referenced - stored
+
+        self.stdout.write(f'Documents:        {documents} ({legacy} stored before deduplication)')
+        self.stdout.write(f"Blobs:            {blobs['count']} (+{queued['count']} unreferenced, "
+                          f"{_size(queued['size'] or 0)} awaiting gc_media)")
+        self.stdout.write(f'Referenced bytes: {_size(referenced)}')
+        self.stdout.write(f'Stored bytes:     {_size(stored)}')
+        share = f' ({saved / referenced:.1%})' if referenced else ''
+        self.stdout.write(self.style.SUCCESS(f'Saved:            {_size(saved)}{share}'))
+
+        shared = DocumentBlob.objects.filter(refcount__gt=1).order_by('-refcount')[:options['top']]
+        if options['top'] and shared:
+            self.stdout.write('\nMost shared:')
+            for blob in shared:
+                example = blob.documents.values_list('original_filename', flat=True).first() or ''
+                self.stdout.write(
+                    f'  {blob.sha256[:12]}  {blob.refcount:>5} refs  {_size(blob.size):>10}  {example}'
+                )
+
+        if not options['check']:
+            return
+        problems = 0
+        counted = DocumentBlob.objects.annotate(actual=Count('documents')).values_list('sha256', 'refcount', 'actual')
+        for sha256, refcount, actual in counted.iterator():
+            if refcount != actual:
+                problems += 1
+                self.stdout.write(f'  {sha256[:12]}: refcount {refcount}, referenced by {actual}')
+            if not document_storage.exists(document_storage.blob_name(sha256)):
+                problems += 1
+                self.stdout.write(f'  {sha256[:12]}: file missing')
+        if problems:
+            raise CommandError(f'{problems} problems found in document storage.')
+        self.stdout.write(self.style.SUCCESS('✓ Document storage is consistent'))
@@ -0,0 +1,172 @@
+"""
+Authenticated document downloads.
+
+Django checks access and conditional headers, then hands the transfer
+off. With DOCUMENT_SENDFILE_BACKEND set, the front-end server sends the
+file (nginx X-Accel-Redirect, Apache/lighttpd X-Sendfile), so the worker
+is free as soon as the headers are out. Standalone, a FileResponse keeps
+the real file descriptor so gunicorn and other WSGI servers with
+`wsgi.file_wrapper` can use os.sendfile. Single byte ranges are answered
+with 206 so interrupted downloads of large scans can resume.
+"""
+
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils.http import content_disposition_header, parse_etags, quote_etag
+from django.views.static import serve
+from rest_framework.permissions import BasePermission
+
+from . import previews
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CACHE_CONTROL = 'private, no-cache'
+
+
+class CanViewDocuments(BasePermission):
+    """Every staff role may view documents (see the roles table in the README)."""
+
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(user and user.is_authenticated and (user.is_admin or user.is_doctor or user.is_receptionist))
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Inclusive (start, end) for a single `bytes=` range, or None to send the
+    whole file (no header, several ranges or a malformed one).
+    """
+    match = RANGE_RE.match((header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        if int(last) == 0:
+            raise RangeNotSatisfiable()
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def document_etag(document, name, stat):
+    # Blobs and their renditions are named by digest, so the name is a strong validator.
+    if document.blob_id:
+        return quote_etag(os.path.basename(name))
+    return f'W/"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+
+
+def _matches(etag, header):
+    """Weak comparison, as If-None-Match requires."""
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or etag.removeprefix('W/') in (tag.removeprefix('W/') for tag in etags)
+
+
+class _FileRange:
+    """Reads at most `length` bytes from the file's current position; keeps fileno() for sendfile."""
+
+    def __init__(self, fh, length):
+        self.fh = fh
+        self.name = fh.name
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fh.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.fh.fileno()
+
+    def close(self):
+        self.fh.close()
+
+
+def document_response(request, document, attachment=False, variant=None):
+    """The document's file, or its `variant` rendition ('thumb', 'preview') once rendered."""
+    storage = document.file.storage
+    name = document.file.name
+    filename = document.original_filename or os.path.basename(name)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if variant:
+        if not document.blob_id:
+            raise Http404('No preview for this document.')
+        name = previews.rendition_name(document.blob.sha256, variant)
+        filename = f'{os.path.splitext(filename)[0]}-{variant}.{previews.extension()}'
+        content_type = previews.content_type()
+    try:
+        path = storage.path(name)
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        raise Http404('Preview is not ready.' if variant else 'Document file is missing.')
+
+    etag = document_etag(document, name, stat)
+    if _matches(etag, request.headers.get('If-None-Match')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        response['Cache-Control'] = CACHE_CONTROL
+        return response
+
+    backend = settings.DOCUMENT_SENDFILE_BACKEND
+    if backend:
+        # The front-end server answers Range requests itself.
+        response = HttpResponse(content_type=content_type)
+        if backend == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = settings.DOCUMENT_ACCEL_REDIRECT_PREFIX + quote(name)
+        else:
+            response['X-Sendfile'] = path
+    else:
+        size = stat.st_size
+        byte_range = None
+        if_range = request.headers.get('If-Range')
+        # If-Range needs a strong match; otherwise the whole file is sent.
+        if not if_range or (if_range == etag and not etag.startswith('W/')):
+            try:
+                byte_range = parse_range(request.headers.get('Range'), size)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+        fh = open(path, 'rb')
+        if byte_range is None:
+            response = FileResponse(fh, content_type=content_type)
+            response['Content-Length'] = size
+        else:
+            start, end = byte_range
+            fh.seek(start)
+            response = FileResponse(_FileRange(fh, end - start + 1), status=206, content_type=content_type)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = content_disposition_header(attachment, filename)
+    response['ETag'] = etag
+    response['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+def serve_public_media(request, path):
+    """
+    Development MEDIA_URL view. Documents, their blobs and renditions live
+    under documents/ and are only ever sent by the authorized download view.
+    """
+    # serve() normalizes the path itself, so 'x/../documents/...' must be caught here.
+    if posixpath.normpath(path).lstrip('/').split('/', 1)[0] == 'documents':
+        raise Http404
+    return serve(request, path, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,200 @@
+"""
+Streaming exports.
+
+Rows are read in fixed-size chunks and written to the response as they
+arrive, so a worker's memory stays flat however much history a patient
+has. SQLite and PostgreSQL stream through `QuerySet.iterator()` (chunked
+fetches, server-side cursors on PostgreSQL); mysqlclient buffers whole
+result sets client-side, so on MySQL the rows are walked in keyset chunks
+instead.
+"""
+
+import csv
+import html
+import json
+from datetime import datetime
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.renderers import BaseRenderer
+
+from .models import Patient
+
+CHUNK_SIZE = 2000
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'html': 'text/html; charset=utf-8',
+}
+VITALS_FIELDS = (
+    'recorded_at', 'systolic', 'diastolic', 'pulse', 'spo2', 'temperature', 'weight', 'height',
+    'blood_pressure', 'pulse_rate', 'oxygen_saturation', 'notes', 'recorded_by_id',
+)
+PATIENT_FIELDS = tuple(field.attname for field in Patient._meta.concrete_fields)
+
+
+def _after(ordering, values):
+    """Rows strictly after `values` in ascending `ordering`."""
+    condition = Q()
+    equal = {}
+    for name, value in zip(ordering, values):
+        condition |= Q(**equal, **{f'{name}__gt': value})
+        equal[name] = value
+    return condition
+
+
+def iterate(queryset, fields, ordering=('id',), chunk_size=CHUNK_SIZE):
+    """Yield `fields` value tuples in `ordering` without holding the whole result set."""
+    queryset = queryset.order_by(*ordering)
+    if connections[queryset.db].vendor != 'mysql':
+        yield from queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+        return
+    keys = len(ordering)
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(_after(ordering, last))
+        rows = list(page.values_list(*ordering, *fields)[:chunk_size])
+        for row in rows:
+            yield row[keys:]
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][:keys]
+
+
+def _localizer():
+    tz = timezone.get_current_timezone()
+
+    def localize(value):
+        return value.astimezone(tz) if isinstance(value, datetime) else value
+    return localize
+
+
+def _texter():
+    # Resolved once per stream; timezone.localtime() looks the zone up per call.
+    localize = _localizer()
+
+    def text(value):
+        if value is None:
+            return ''
+        if isinstance(value, datetime):
+            return localize(value).isoformat()
+        return str(value)
+    return text
+
+
+class _Echo:
+    """File-like object whose write() hands the line back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def csv_lines(fields, rows, batch_size=500):
+    writer = csv.writer(_Echo())
+    text = _texter()
+    yield writer.writerow(fields)
+    for batch in _batches(rows, batch_size):
+        yield ''.join(writer.writerow([text(value) for value in row]) for row in batch)
+
+
+def ndjson_lines(fields, rows, batch_size=500):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    localize = _localizer()
+    for batch in _batches(rows, batch_size):
+        yield ''.join(
+            encoder.encode({name: localize(value) for name, value in zip(fields, row)}) + '\n'
+            for row in batch
+        )
+
+
+def html_lines(fields, rows, title='', batch_size=500):
+    text = _texter()
+    escape = html.escape
+    yield (
+        f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{escape(title)}</title></head>'
+        '<body><table><thead><tr>'
+        + ''.join(f'<th>{escape(name)}</th>' for name in fields)
+        + '</tr></thead><tbody>\n'
+    )
+    for batch in _batches(rows, batch_size):
+        yield ''.join(
+            '<tr>' + ''.join(f'<td>{escape(text(value))}</td>' for value in row) + '</tr>\n'
+            for row in batch
+        )
+    yield '</tbody></table></body></html>\n'
+
+
+def streaming_response(fields, rows, fmt, filename):
+    if fmt == 'csv':
+        content = csv_lines(fields, rows)
+    elif fmt == 'ndjson':
+        content = ndjson_lines(fields, rows)
+    else:
+        content = html_lines(fields, rows, title=filename)
+    response = StreamingHttpResponse(content, content_type=FORMATS[fmt])
+    if fmt != 'html':
+        response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+
+def vitals_response(queryset, fmt, filename):
+    """Stream a vitals queryset oldest first as CSV, NDJSON or an HTML table."""
+    rows = iterate(queryset, VITALS_FIELDS, ordering=('recorded_at', 'id'))
+    return streaming_response(VITALS_FIELDS, rows, fmt, filename)
+
+
+def patient_queryset(admitted=None, entered_from=None, entered_to=None, ayushman=None):
+    """The patient register, optionally narrowed; None leaves a filter off."""
+    qs = Patient.objects.all()
+    if admitted is not None:
+        qs = qs.filter(is_admitted=admitted)
+    if entered_from is not None:
+        qs = qs.filter(entry_datetime__gte=entered_from)
+    if entered_to is not None:
+        qs = qs.filter(entry_datetime__lt=entered_to)
+    if ayushman is not None:
+        qs = qs.filter(has_ayushman_card=ayushman)
+    return qs
+
+
+def patient_rows(queryset, chunk_size=CHUNK_SIZE, fields=PATIENT_FIELDS):
+    return iterate(queryset, fields, ordering=('id',), chunk_size=chunk_size)
+
+
+def patient_response(queryset, fmt, fields=PATIENT_FIELDS):
+    """Stream patients in id order as CSV or NDJSON, optionally only some `fields`."""
+    filename = f'patients-{timezone.localdate():%Y%m%d}'
+    return streaming_response(fields, patient_rows(queryset, fields=fields), fmt, filename)
+
+
+class StreamingRenderer(BaseRenderer):
+    """
+    Lets DRF negotiate ?format=csv / ?format=ndjson; the view streams the
+    body itself, so this only renders error payloads.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+
+class CSVRenderer(StreamingRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class NDJSONRenderer(StreamingRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
@@ -1,5 +1,5 @@
 from django import forms
-from .models import Patient, PatientDocument, PatientVitals
+from .models import Patient, PatientDocument, PatientVitals, validate_ayushman
 
 
 class PatientForm(forms.ModelForm):
@@ -35,10 +35,7 @@ class PatientForm(forms.ModelForm):
 
     def clean(self):
         cleaned_data = super().clean()
-        has_ayushman = cleaned_data.get('has_ayushman_card')
-        ayushman_number = cleaned_data.get('ayushman_card_number')
-        if has_ayushman and not ayushman_number:
-            raise forms.ValidationError('Please enter the Ayushman Card number.')
+        validate_ayushman(cleaned_data.get('has_ayushman_card'), cleaned_data.get('ayushman_card_number'))
         return cleaned_data
 
 
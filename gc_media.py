@@ -0,0 +1,60 @@
+"""
+Management command to delete queued document files and find orphaned media.
+Usage: python manage.py gc_media [--delete] [--min-age 3600] [--no-scan]
+           [--path documents] [--chunk-size 500]
+"""
+
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Drain the file deletion queue, then report (or --delete) unreferenced files under MEDIA_ROOT'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true', help='Remove orphans instead of only reporting them')
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Seconds since last modification before a file can be an orphan (protects in-flight uploads)',
+        )
+        parser.add_argument('--no-scan', action='store_true', help='Only drain the deletion queue')
+        parser.add_argument(
+            '--path', default='documents',
+            help='Directory under MEDIA_ROOT to scan; only patient documents are tracked here',
+        )
+        parser.add_argument('--chunk-size', type=int, default=500, help='Files checked per database query')
+
+    def handle(self, *args, **options):
+        from apps.patients import media_gc
+        from apps.patients.storage import document_storage
+
+        started = time.perf_counter()
+        removed, handled = media_gc.drain(batch_size=options['chunk_size'])
+        self.stdout.write(f'Deletion queue: {handled} entries, {removed} files removed')
+        if options['no_scan']:
+            return
+
+        root = document_storage.path(options['path'])
+        if not os.path.isdir(root):
+            raise CommandError(f'No such directory: {root}')
+        stats = {}
+        orphans = orphan_bytes = 0
+        for name, size in media_gc.find_orphans(root, options['min_age'], options['chunk_size'], stats):
+            orphans += 1
+            orphan_bytes += size
+            if options['delete']:
+                document_storage.delete(name)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {name} ({size:,} bytes)')
+
+        elapsed = time.perf_counter() - started
+        rate = stats['scanned'] / elapsed if elapsed else 0
+        action = 'Removed' if options['delete'] else 'Found'
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Scanned {stats['scanned']:,} files in {elapsed:.1f}s ({rate:,.0f} files/sec); "
+            f'{action} {orphans:,} orphans ({orphan_bytes / 1_000_000:,.1f} MB)'
+        ))
+        if orphans and not options['delete']:
+            self.stdout.write('  Run again with --delete to remove them.')
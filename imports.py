@@ -0,0 +1,168 @@
+"""
+Bulk patient import.
+
+Rows are streamed from a CSV or NDJSON file and validated field by field
+with the form fields PatientForm uses plus the Ayushman rule it shares
+with this module. Valid rows get a block of patient IDs reserved with one
+sequence update and are inserted with `bulk_create`, one transaction per
+chunk that also records the run's checkpoint. `import_chunks` yields
+after each committed chunk so callers can report errors as they go.
+"""
+
+import csv
+import json
+from datetime import datetime
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.utils import timezone
+
+from .models import Patient, validate_ayushman
+from .parsers import InvalidLine
+
+EXCLUDED_FIELDS = ('id', 'patient_id', 'created_by', 'created_at', 'updated_at')
+IMPORT_FIELDS = [field for field in Patient._meta.concrete_fields if field.name not in EXCLUDED_FIELDS]
+# The form fields PatientForm would build, so rows are held to the same rules.
+FORM_FIELDS = {field.name: field.formfield() for field in IMPORT_FIELDS}
+BOOLEAN_TEXT = {
+    '1': True, 'true': True, 'yes': True, 'y': True,
+    '0': False, 'false': False, 'no': False, 'n': False,
+}
+FORMATS = ('csv', 'ndjson')
+
+
+def guess_format(name, content_type=''):
+    if content_type.startswith('application/x-ndjson') or name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return 'csv'
+
+
+def read_rows(fh, fmt):
+    """Yield one dict (or InvalidLine) per record of a text-mode file."""
+    if fmt == 'csv':
+        yield from csv.DictReader(fh)
+        return
+    for line in fh:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as exc:
+            yield InvalidLine(f'Invalid JSON: {exc}')
+
+
+def clean_row(row):
+    """Return (unsaved Patient, None) or (None, errors) for one input row."""
+    if isinstance(row, InvalidLine):
+        return None, {'non_field_errors': [row.message]}
+    if not isinstance(row, dict):
+        return None, {'non_field_errors': ['Expected an object.']}
+    values = {}
+    errors = {}
+    for field in IMPORT_FIELDS:
+        raw = row.get(field.name)
+        if isinstance(raw, str):
+            raw = raw.strip()
+        if raw is None or raw == '':
+            if field.has_default():
+                values[field.attname] = field.get_default()
+            elif field.null:
+                values[field.attname] = None
+            elif field.blank:
+                values[field.attname] = ''
+            else:
+                errors[field.name] = ['This field is required.']
+            continue
+        if isinstance(field, models.BooleanField):
+            value = BOOLEAN_TEXT.get(str(raw).lower())
+            if value is None:
+                errors[field.name] = ['Must be true or false.']
+            else:
+                values[field.attname] = value
+            continue
+        try:
+            value = FORM_FIELDS[field.name].clean(raw if isinstance(raw, str) else str(raw))
+        except ValidationError as exc:
+            errors[field.name] = exc.messages
+            continue
+        if isinstance(value, datetime) and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        values[field.attname] = value
+    if not errors:
+        try:
+            validate_ayushman(values['has_ayushman_card'], values['ayushman_card_number'])
+        except ValidationError as exc:
+            errors['non_field_errors'] = exc.messages
+    if errors:
+        return None, errors
+    return Patient(**values), None
+
+
+def import_chunks(rows, created_by=None, chunk_size=1000, skip=0, checkpoint=None):
+    """
+    Import `rows`, skipping the first `skip` (a resumed run). Yields
+    {'position', 'created', 'errors'} after each committed chunk, where
+    `position` counts input rows consumed so far and error rows are
+    numbered from 1. A PatientImportCheckpoint passed as `checkpoint` is
+    advanced in each chunk's transaction, so it never disagrees with the
+    rows written. The census, search index, autocomplete and API cache
+    are brought up to date once the run stops.
+    """
+    from . import api_cache, autocomplete, census
+    from .search import index_patients, rebuild_index
+
+    created_by_id = getattr(created_by, 'pk', None)
+    position = skip
+    rows = islice(rows, skip, None)
+    created_total = 0
+    reindex = False
+    try:
+        while batch := list(islice(rows, chunk_size)):
+            patients = []
+            errors = []
+            for number, row in enumerate(batch, start=position + 1):
+                patient, row_errors = clean_row(row)
+                if row_errors:
+                    errors.append({'row': number, 'errors': row_errors})
+                else:
+                    patient.created_by_id = created_by_id
+                    patients.append(patient)
+            with transaction.atomic():
+                if patients:
+                    # One sequence update per chunk instead of one per patient,
+                    # rolled back with the chunk so a failed one leaves no gap.
+                    for patient, patient_id in zip(patients, Patient.reserve_patient_ids(len(patients))):
+                        patient.patient_id = patient_id
+                    Patient.objects.bulk_create(patients)
+                    # Backends that cannot return pks (MySQL) get a full reindex at the end.
+                    if all(patient.pk for patient in patients):
+                        index_patients(patients)
+                    else:
+                        reindex = True
+                if checkpoint is not None:
+                    checkpoint.position = position + len(batch)
+                    checkpoint.created += len(patients)
+                    checkpoint.errors += len(errors)
+                    checkpoint.save(update_fields=['position', 'created', 'errors', 'updated_at'])
+            created_total += len(patients)
+            position += len(batch)
+            yield {'position': position, 'created': len(patients), 'errors': errors}
+    finally:
+        if created_total:
+            if reindex:
+                rebuild_index()
+            census.rebuild()
+            autocomplete.invalidate()
+            api_cache.changed('patients')
+
+
+def import_patients(rows, created_by=None, chunk_size=1000, max_errors=1000):
+    """Run a whole import and summarize it; keeps at most `max_errors` error rows."""
+    result = {'received': 0, 'created': 0, 'error_count': 0, 'errors': []}
+    for chunk in import_chunks(rows, created_by, chunk_size):
+        result['received'] = chunk['position']
+        result['created'] += chunk['created']
+        result['error_count'] += len(chunk['errors'])
+        result['errors'].extend(chunk['errors'][:max_errors - len(result['errors'])])
+    return result
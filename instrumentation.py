@@ -0,0 +1,244 @@
+"""
+Per-request SQL and template timing.
+
+RequestTimingMiddleware times every request. A sample of them
+(REQUEST_TIMING_SAMPLE_RATE) is also instrumented: one execute wrapper,
+added to each database connection when it opens, counts the request's
+queries and their time, and Django template rendering is timed while a
+sampled request is in flight. Because the request is found through a
+context variable, queries that async views run on other threads through
+sync_to_async are counted too, and requests outside the sample pay one
+lookup per query.
+
+With REQUEST_TIMING_SERVER_TIMING on, instrumented responses to staff
+users get a Server-Timing header (db, tpl, total) that browser dev tools
+display. A query shape (its SQL with placeholders) run
+REQUEST_TIMING_REPEATED_QUERIES times or more in one request is reported
+as a likely N+1, and requests slower than REQUEST_TIMING_SLOW_MS are
+written as JSON lines to the 'apps.patients.slow_requests' logger.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template
+from django.utils.functional import empty
+
+logger = logging.getLogger(__name__)
+slow_log = logging.getLogger('apps.patients.slow_requests')
+
+_current = ContextVar('request_timing', default=None)
+_installed = False
+# (view, sql) pairs already reported, so a hot N+1 is logged once per
+# process; the least recently seen are forgotten beyond REPORTED_MAX.
+REPORTED_MAX = 1000
+_reported = OrderedDict()
+_reported_lock = threading.Lock()
+# Template.render is wrapped only while sampled requests are in flight.
+_render_lock = threading.Lock()
+_render_scopes = 0
+_original_render = Template.render
+
+
+class RequestTiming:
+    __slots__ = ('queries', 'db', 'template', 'rendering', 'shapes')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.rendering = False
+        self.shapes = {}
+
+    def repeated(self, threshold):
+        """[(sql, count)] for shapes run at least `threshold` times, most frequent first."""
+        found = [(sql, count) for sql, count in self.shapes.items() if count >= threshold]
+        return sorted(found, key=lambda item: -item[1])
+
+
+def _record_query(execute, sql, params, many, context):
+    timing = _current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.db += time.perf_counter() - start
+        timing.queries += 1
+        timing.shapes[sql] = timing.shapes.get(sql, 0) + 1
+
+
+def _add_wrapper(sender=None, connection=None, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _timed_render(render):
+    @wraps(render)
+    def wrapper(self, context=None, request=None):
+        timing = _current.get()
+        # Only the outermost render: templates rendered inside it are already counted.
+        if timing is None or timing.rendering:
+            return render(self, context, request)
+        timing.rendering = True
+        start = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            timing.template += time.perf_counter() - start
+            timing.rendering = False
+    return wrapper
+
+
+def install():
+    """Hook query execution; safe to call repeatedly."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    connection_created.connect(_add_wrapper)
+    for connection in connections.all(initialized_only=True):
+        _add_wrapper(connection=connection)
+
+
+_timed_template_render = _timed_render(_original_render)
+
+
+@contextmanager
+def _timing_templates():
+    """Time template rendering for the duration of the block."""
+    global _render_scopes
+    with _render_lock:
+        _render_scopes += 1
+        if _render_scopes == 1:
+            Template.render = _timed_template_render
+    try:
+        yield
+    finally:
+        with _render_lock:
+            _render_scopes -= 1
+            if _render_scopes == 0 and Template.render is _timed_template_render:
+                Template.render = _original_render
+
+
+def _first_report(view, sql):
+    key = (view, sql)
+    with _reported_lock:
+        if key in _reported:
+            _reported.move_to_end(key)
+            return False
+        _reported[key] = None
+        if len(_reported) > REPORTED_MAX:
+            _reported.popitem(last=False)
+        return True
+
+
+def _loaded_user(request):
+    """request.user if something already loaded it, else None."""
+    # Never load a lazy user here: in an async request that would query the database.
+    user = getattr(request.__dict__.get('user'), '_wrapped', request.__dict__.get('user'))
+    return None if user is empty else user
+
+
+class RequestTimingMiddleware:
+    """Put first in MIDDLEWARE so `total` covers the rest of the stack."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timing, token, start = self._start()
+        if timing is None:
+            response = self.get_response(request)
+            return self._finish(request, response, timing, start)
+        try:
+            with _timing_templates():
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timing, start)
+
+    async def __acall__(self, request):
+        timing, token, start = self._start()
+        if timing is None:
+            response = await self.get_response(request)
+            return self._finish(request, response, timing, start)
+        try:
+            with _timing_templates():
+                response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timing, start)
+
+    def _start(self):
+        rate = getattr(settings, 'REQUEST_TIMING_SAMPLE_RATE', 0.0)
+        if rate <= 0 or random.random() >= rate:
+            return None, None, time.perf_counter()
+        timing = RequestTiming()
+        return timing, _current.set(timing), time.perf_counter()
+
+    def _finish(self, request, response, timing, start):
+        # Streaming responses are timed up to their first byte.
+        total_ms = (time.perf_counter() - start) * 1000
+        repeated = []
+        if timing is not None:
+            repeated = timing.repeated(getattr(settings, 'REQUEST_TIMING_REPEATED_QUERIES', 5))
+            if self._show_server_timing(request):
+                response['Server-Timing'] = (
+                    f'db;dur={timing.db * 1000:.1f};desc="{timing.queries} queries", '
+                    f'tpl;dur={timing.template * 1000:.1f}, total;dur={total_ms:.1f}'
+                )
+        view = getattr(request.resolver_match, 'view_name', None) or request.path
+        for sql, count in repeated:
+            if _first_report(view, sql):
+                logger.warning('Likely N+1 in %s: %d runs of %s', view, count, sql[:500])
+        if total_ms >= getattr(settings, 'REQUEST_TIMING_SLOW_MS', 500):
+            self._log_slow(request, response, view, total_ms, timing, repeated)
+        return response
+
+    @staticmethod
+    def _show_server_timing(request):
+        # Internal timings are for staff only, and only when switched on.
+        if not getattr(settings, 'REQUEST_TIMING_SERVER_TIMING', False):
+            return False
+        return getattr(_loaded_user(request), 'is_staff', False)
+
+    @staticmethod
+    def _log_slow(request, response, view, total_ms, timing, repeated):
+        user = _loaded_user(request)
+        entry = {
+            'method': request.method,
+            'path': request.get_full_path()[:500],
+            'view': view,
+            'status': response.status_code,
+            'user': getattr(user, 'pk', None),
+            'total_ms': round(total_ms, 1),
+        }
+        if timing is not None:
+            entry.update(
+                queries=timing.queries,
+                db_ms=round(timing.db * 1000, 1),
+                template_ms=round(timing.template * 1000, 1),
+                repeated=[{'count': count, 'sql': sql[:500]} for sql, count in repeated[:5]],
+            )
+        slow_log.warning(json.dumps(entry))
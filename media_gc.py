@@ -0,0 +1,130 @@
+"""
+Deferred file deletion and orphaned-media collection.
+
+Deleting a document only writes a PendingFileDeletion row in the same
+transaction, so the request never waits on the media volume and a
+rolled-back delete never loses a file. `drain` removes queued files in
+batches. `find_orphans` walks a directory tree with os.scandir and checks
+files against the database a chunk at a time, so memory stays bounded
+however many files there are.
+"""
+
+import os
+import re
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection, reset_queries, transaction
+
+from .models import DocumentBlob, PatientDocument, PendingFileDeletion
+from .previews import delete_renditions, extension
+from .storage import TEMP_PREFIX, document_storage
+
+RENDITION_RE = re.compile(r'^([0-9a-f]{64})\.(\w+)\.(\w+)$')
+
+
+def drain(batch_size=500):
+    """Delete queued files batch by batch; returns (files removed, queue entries handled)."""
+    removed = handled = 0
+    while True:
+        reset_queries()
+        with transaction.atomic():
+            entries = PendingFileDeletion.objects.order_by('pk')
+            if connection.features.has_select_for_update_skip_locked:
+                entries = entries.select_for_update(skip_locked=True)
+            batch = list(entries.values_list('pk', 'name')[:batch_size])
+            if not batch:
+                break
+            digests = {document_storage.digest(name) for _, name in batch} - {None}
+            # Rows first, files second, in one write transaction: an upload of the
+            # same content either keeps its row (refcount above zero) and its file,
+            # or finds the row gone once this commits and stores the file again.
+            DocumentBlob.objects.filter(sha256__in=digests, refcount=0).delete()
+            deleted = digests - set(
+                DocumentBlob.objects.filter(sha256__in=digests).values_list('sha256', flat=True)
+            )
+            for name in {name for _, name in batch}:
+                digest = document_storage.digest(name)
+                if digest is not None and digest not in deleted:
+                    # Referenced again since it was queued.
+                    continue
+                document_storage.delete(name)
+                if digest is not None:
+                    delete_renditions(digest)
+                removed += 1
+            PendingFileDeletion.objects.filter(pk__in=[pk for pk, _ in batch]).delete()
+        handled += len(batch)
+    return removed, handled
+
+
+def walk(root):
+    """Yield a DirEntry for every file under `root`; holds one scandir iterator per directory level."""
+    if not os.path.isdir(root):
+        return
+    stack = [os.scandir(root)]
+    try:
+        while stack:
+            entry = next(stack[-1], None)
+            if entry is None:
+                stack.pop().close()
+            elif entry.is_dir(follow_symlinks=False):
+                stack.append(os.scandir(entry.path))
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+    finally:
+        for iterator in stack:
+            iterator.close()
+
+
+def _orphans(names):
+    """The subset of {name: size} that nothing in the database refers to."""
+    digests = {}
+    plain = []
+    orphans = []
+    for name in names:
+        base = os.path.basename(name)
+        if base.startswith(TEMP_PREFIX) or base.endswith('.tmp'):
+            # Left behind by an interrupted upload or render.
+            orphans.append(name)
+        elif (digest := document_storage.digest(name)) is not None:
+            digests[name] = digest
+        elif match := RENDITION_RE.match(base):
+            digest, variant, ext = match.groups()
+            if variant in settings.DOCUMENT_PREVIEW_SIZES and ext == extension():
+                digests[name] = digest
+            else:
+                orphans.append(name)
+        else:
+            plain.append(name)
+    # Blobs at refcount zero count as known: the deletion queue owns them.
+    known = set(DocumentBlob.objects.filter(sha256__in=set(digests.values())).values_list('sha256', flat=True))
+    orphans.extend(name for name, digest in digests.items() if digest not in known)
+    if plain:
+        used = set(PatientDocument.objects.filter(file__in=plain).values_list('file', flat=True))
+        orphans.extend(name for name in plain if name not in used)
+    return [(name, names[name]) for name in orphans]
+
+
+def find_orphans(root, min_age=3600, chunk_size=500, stats=None):
+    """
+    Yield (name, size) for files under `root` untouched for `min_age` seconds
+    that no document, blob or rendition accounts for. `stats['scanned']`
+    counts every file seen.
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault('scanned', 0)
+    cutoff = time.time() - min_age
+    media_root = document_storage.location
+    files = walk(root)
+    while chunk := list(islice(files, chunk_size)):
+        # With DEBUG on, Django keeps the SQL of every query; don't let a long scan grow it.
+        reset_queries()
+        stats['scanned'] += len(chunk)
+        names = {}
+        for entry in chunk:
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime < cutoff:
+                names[os.path.relpath(entry.path, media_root).replace(os.sep, '/')] = stat.st_size
+        if names:
+            yield from _orphans(names)
@@ -1,12 +1,81 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
+import os
+import re
 import uuid
 
+from .storage import document_storage
+
+BLOOD_PRESSURE_RE = re.compile(r'(\d{2,3})\s*/\s*(\d{2,3})')
+NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+
 
 def patient_document_path(instance, filename):
     return f'documents/patient_{instance.patient.patient_id}/{filename}'
 
 
+def parse_blood_pressure(text):
+    """'120/80', '120 / 80 mmHg' -> (120, 80); anything else -> (None, None)."""
+    match = BLOOD_PRESSURE_RE.search(text or '')
+    if not match:
+        return None, None
+    return int(match.group(1)), int(match.group(2))
+
+
+def parse_measurement(text):
+    """'72 bpm', '98%', '97.5' -> rounded int, or None."""
+    match = NUMBER_RE.search(text or '')
+    if not match:
+        return None
+    value = round(float(match.group()))
+    return value if 0 <= value <= 32767 else None
+
+
+# Each free-text reading and the typed columns parsed from it.
+READING_TEXT_FIELDS = (
+    ('blood_pressure', ('systolic', 'diastolic')),
+    ('pulse_rate', ('pulse',)),
+    ('oxygen_saturation', ('spo2',)),
+)
+
+
+def parse_reading(text_field, text):
+    """Typed values for one of READING_TEXT_FIELDS, as a tuple."""
+    if text_field == 'blood_pressure':
+        return parse_blood_pressure(text)
+    return (parse_measurement(text),)
+
+
+def format_reading(text_field, values):
+    if None in values:
+        return ''
+    if text_field == 'blood_pressure':
+        return '{}/{}'.format(*values)
+    return f"{values[0]} bpm" if text_field == 'pulse_rate' else f"{values[0]}%"
+
+
+def reading_conflicts(values):
+    """{text field: [message]} for text readings that contradict typed ones given with them."""
+    errors = {}
+    for text_field, typed_fields in READING_TEXT_FIELDS:
+        if not values.get(text_field):
+            continue
+        parsed = parse_reading(text_field, values[text_field])
+        if any(values.get(field) not in (None, value) for field, value in zip(typed_fields, parsed)):
+            errors[text_field] = [f"Does not match {' and '.join(typed_fields)}."]
+    return errors
+
+
+def validate_ayushman(has_card, card_number):
+    """Shared by PatientForm and the bulk importer."""
+    if has_card and not card_number:
+        raise ValidationError('Please enter the Ayushman Card number.')
+
+
 class Patient(models.Model):
     GENDER_CHOICES = [('M', 'Male'), ('F', 'Female'), ('O', 'Other')]
     BLOOD_GROUP_CHOICES = [
@@ -54,21 +123,43 @@ class Patient(models.Model):
     class Meta:
         db_table = 'patients'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', 'id'], name='patients_created_keyset_idx'),
+            # Max(updated_at) for the list API's conditional GET validators.
+            models.Index(fields=['updated_at'], name='patients_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.patient_id} - {self.full_name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so census counters can tell admissions from discharges.
+        instance._loaded_is_admitted = instance.__dict__.get('is_admitted')
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.patient_id:
             self.patient_id = self.generate_patient_id()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     def generate_patient_id(self):
+        return Patient.reserve_patient_ids(1)[0]
+
+    @staticmethod
+    def patient_id_prefix():
         from datetime import date
         today = date.today()
-        prefix = f"P{today.year}{today.month:02d}"
-        last = Patient.objects.filter(patient_id__startswith=prefix).count()
-        return f"{prefix}{last + 1:04d}"
+        return f"P{today.year}{today.month:02d}"
+
+    @staticmethod
+    def reserve_patient_ids(count):
+        """Reserve `count` consecutive patient IDs for the current month."""
+        prefix = Patient.patient_id_prefix()
+        first = PatientIdSequence.allocate(prefix, count)
+        return [f"{prefix}{n:04d}" for n in range(first, first + count)]
 
     @property
     def full_name(self):
@@ -83,6 +174,194 @@ class Patient(models.Model):
         return "Admitted" if self.is_admitted else "Discharged"
 
 
+class PatientIdSequence(models.Model):
+    """Per-month counter backing Patient.patient_id allocation."""
+    prefix = models.CharField(max_length=10, primary_key=True)
+    last_value = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'patient_id_sequences'
+
+    def __str__(self):
+        return f"{self.prefix} @ {self.last_value}"
+
+    @classmethod
+    def allocate(cls, prefix, count=1):
+        """
+        Atomically reserve `count` numbers for `prefix` and return the first.
+        The UPDATE takes a row lock, so concurrent workers are serialized on
+        this single row instead of racing on a COUNT over the patients table.
+        """
+        with transaction.atomic():
+            updated = cls.objects.filter(prefix=prefix).update(
+                last_value=F('last_value') + count
+            )
+            if not updated:
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(
+                            prefix=prefix,
+                            last_value=cls._existing_max(prefix) + count,
+                        )
+                except IntegrityError:
+                    # Another worker created the row first; take the next block.
+                    cls.objects.filter(prefix=prefix).update(
+                        last_value=F('last_value') + count
+                    )
+            last = cls.objects.filter(prefix=prefix).values_list('last_value', flat=True).get()
+        return last - count + 1
+
+    @staticmethod
+    def _existing_max(prefix):
+        # One-off seed for a month that already has patients from before the
+        # sequence table existed.
+        highest = 0
+        ids = Patient.objects.filter(patient_id__startswith=prefix).values_list('patient_id', flat=True)
+        for patient_id in ids.iterator():
+            suffix = patient_id[len(prefix):]
+            if suffix.isdigit():
+                highest = max(highest, int(suffix))
+        return highest
+
+
+class PatientSearchToken(models.Model):
+    """Portable search index used when the database has no full-text support."""
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=64)
+
+    class Meta:
+        db_table = 'patient_search_tokens'
+        indexes = [models.Index(fields=['token', 'patient'], name='patient_search_token_idx')]
+
+    def __str__(self):
+        return self.token
+
+
+class IndexVersion(models.Model):
+    """Monotonic version stamp shared by workers to invalidate in-process indexes."""
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'index_versions'
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+
+class PatientCensus(models.Model):
+    """Single-row running totals so list pages never COUNT(*) the patients table."""
+    total = models.IntegerField(default=0)
+    admitted = models.IntegerField(default=0)
+    discharged = models.IntegerField(default=0)
+    new_today = models.IntegerField(default=0)
+    census_date = models.DateField(default=timezone.localdate)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'patient_census'
+
+    def __str__(self):
+        return f"{self.total} patients ({self.admitted} admitted)"
+
+
+class PatientImportCheckpoint(models.Model):
+    """Progress of an unfinished `import_patients` run, saved in each chunk's transaction."""
+    source = models.CharField(max_length=500, unique=True)
+    size = models.PositiveBigIntegerField()
+    position = models.PositiveBigIntegerField(default=0)
+    created = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'patient_import_checkpoints'
+
+    def __str__(self):
+        return f"{self.source} @ row {self.position}"
+
+
+class DocumentBlob(models.Model):
+    """One stored file per distinct content, shared by every document that uploads it."""
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'patient_document_blobs'
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.refcount} refs)"
+
+    @property
+    def name(self):
+        return document_storage.blob_name(self.sha256)
+
+    @classmethod
+    def acquire(cls, sha256, size):
+        """Add a reference to the blob with this digest, creating its row on first use."""
+        with transaction.atomic():
+            blob, created = cls.objects.select_for_update().get_or_create(
+                sha256=sha256, defaults={'size': size, 'refcount': 1}
+            )
+            if not created:
+                cls.objects.filter(pk=blob.pk).update(refcount=F('refcount') + 1)
+        return blob
+
+    @classmethod
+    def release(cls, pk):
+        """
+        Drop a reference. The last one leaves the row at zero and queues the
+        file; `gc_media` deletes both unless the content was uploaded again.
+        """
+        with transaction.atomic():
+            blob = cls.objects.select_for_update().filter(pk=pk, refcount__gt=0).first()
+            if blob is None:
+                return
+            cls.objects.filter(pk=pk).update(refcount=F('refcount') - 1)
+            if blob.refcount == 1:
+                PendingFileDeletion.objects.create(name=blob.name)
+
+
+class PendingFileDeletion(models.Model):
+    """A stored file to remove; written in the transaction that orphans it, drained by `gc_media`."""
+    name = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'pending_file_deletions'
+
+    def __str__(self):
+        return self.name
+
+
+class DocumentPreviewJob(models.Model):
+    """Queued thumbnail/preview rendering for one image blob."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    blob = models.OneToOneField(DocumentBlob, on_delete=models.CASCADE, related_name='preview_job')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'patient_document_preview_jobs'
+        indexes = [models.Index(fields=['status', 'created_at'], name='preview_job_status_idx')]
+
+    def __str__(self):
+        return f"{self.blob_id} {self.status}"
+
+
 class PatientDocument(models.Model):
     DOC_TYPE_CHOICES = [
         ('prescription', 'Prescription'),
@@ -97,7 +376,11 @@ class PatientDocument(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='documents')
     document_type = models.CharField(max_length=20, choices=DOC_TYPE_CHOICES, default='other')
     title = models.CharField(max_length=200)
-    file = models.FileField(upload_to=patient_document_path)
+    file = models.FileField(upload_to=patient_document_path, storage=document_storage)
+    original_filename = models.CharField(max_length=255, blank=True)
+    blob = models.ForeignKey(
+        DocumentBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='documents'
+    )
     uploaded_at = models.DateTimeField(auto_now_add=True)
     uploaded_by = models.ForeignKey(
         'authentication.User', on_delete=models.SET_NULL, null=True
@@ -110,6 +393,31 @@ class PatientDocument(models.Model):
     def __str__(self):
         return f"{self.patient.full_name} - {self.title}"
 
+    def save(self, *args, **kwargs):
+        previous = self.blob_id
+        uploaded = bool(self.file) and not self.file._committed
+        with transaction.atomic():
+            if uploaded:
+                content = self.file.file
+                self.original_filename = os.path.basename(self.file.name)[:255]
+                # Stores (or finds) the blob now so the row can point at it.
+                self.file.save(self.file.name, content, save=False)
+                self.blob = DocumentBlob.acquire(document_storage.digest(self.file.name), self.file.size)
+                if not document_storage.exists(self.file.name):
+                    # gc_media removed an unreferenced copy between the two steps.
+                    content.seek(0)
+                    document_storage.save(self.file.name, content)
+            super().save(*args, **kwargs)
+            if uploaded:
+                from .previews import enqueue
+                enqueue(self)
+                if previous:
+                    DocumentBlob.release(previous)
+
+    def get_download_url(self, variant=None):
+        url = f'/api/v1/patients/{self.patient_id}/documents/{self.pk}/download/'
+        return f'{url}?variant={variant}' if variant else url
+
 
 class PatientVitals(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='vitals')
@@ -124,10 +432,205 @@ class PatientVitals(models.Model):
     oxygen_saturation = models.CharField(max_length=10, blank=True)
     notes = models.TextField(blank=True)
     recorded_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Structured readings for range queries and SQL aggregates; filled from
+    # the text fields above when a reading is entered as free text.
+    systolic = models.PositiveSmallIntegerField(null=True, blank=True)
+    diastolic = models.PositiveSmallIntegerField(null=True, blank=True)
+    pulse = models.PositiveSmallIntegerField(null=True, blank=True)
+    spo2 = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name='SpO2')
 
     class Meta:
         db_table = 'patient_vitals'
         ordering = ['-recorded_at']
+        indexes = [
+            models.Index(fields=['patient', 'recorded_at'], name='vitals_patient_recorded_idx'),
+            # Max(updated_at) per patient for the vitals API's conditional GET validators.
+            models.Index(fields=['patient', 'updated_at'], name='vitals_patient_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.patient.full_name} vitals at {self.recorded_at}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so an edited reading also refreshes the rollup it left,
+        # and so sync_readings can tell which side of a reading was edited.
+        instance._loaded_recorded_at = instance.__dict__.get('recorded_at')
+        instance._loaded_readings = instance._reading_values()
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.sync_readings()
+        super().save(*args, **kwargs)
+        self._loaded_readings = self._reading_values()
+
+    def _reading_values(self):
+        return {
+            field: self.__dict__[field]
+            for text_field, typed_fields in READING_TEXT_FIELDS
+            for field in (text_field, *typed_fields)
+            if field in self.__dict__
+        }
+
+    def sync_readings(self):
+        """
+        Keep each text reading and its typed columns in step. A new reading
+        fills whichever side is missing; an edited one follows the side that
+        changed since it was loaded.
+        """
+        loaded = getattr(self, '_loaded_readings', None)
+        for text_field, typed_fields in READING_TEXT_FIELDS:
+            text = getattr(self, text_field)
+            typed = tuple(getattr(self, field) for field in typed_fields)
+            if loaded is None:
+                if text:
+                    for field, value, parsed in zip(typed_fields, typed, parse_reading(text_field, text)):
+                        if value is None:
+                            setattr(self, field, parsed)
+                elif None not in typed:
+                    setattr(self, text_field, format_reading(text_field, typed))
+                continue
+            text_changed = text != loaded.get(text_field, text)
+            typed_changed = any(value != loaded.get(field, value) for field, value in zip(typed_fields, typed))
+            if text_changed and not typed_changed:
+                for field, value in zip(typed_fields, parse_reading(text_field, text)):
+                    setattr(self, field, value)
+            elif typed_changed and not text_changed:
+                setattr(self, text_field, format_reading(text_field, typed))
+
+
+class VitalsRollup(models.Model):
+    """Hourly and daily min/max/sum/count of a patient's typed readings."""
+    GRANULARITY_CHOICES = [
+        ('hour', 'Hourly'),
+        ('day', 'Daily'),
+    ]
+
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='vitals_rollups')
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    readings = models.PositiveIntegerField(default=0)
+    systolic_min = models.FloatField(null=True, blank=True)
+    systolic_max = models.FloatField(null=True, blank=True)
+    systolic_sum = models.FloatField(null=True, blank=True)
+    systolic_count = models.PositiveIntegerField(default=0)
+    diastolic_min = models.FloatField(null=True, blank=True)
+    diastolic_max = models.FloatField(null=True, blank=True)
+    diastolic_sum = models.FloatField(null=True, blank=True)
+    diastolic_count = models.PositiveIntegerField(default=0)
+    pulse_min = models.FloatField(null=True, blank=True)
+    pulse_max = models.FloatField(null=True, blank=True)
+    pulse_sum = models.FloatField(null=True, blank=True)
+    pulse_count = models.PositiveIntegerField(default=0)
+    spo2_min = models.FloatField(null=True, blank=True)
+    spo2_max = models.FloatField(null=True, blank=True)
+    spo2_sum = models.FloatField(null=True, blank=True)
+    spo2_count = models.PositiveIntegerField(default=0)
+    temperature_min = models.FloatField(null=True, blank=True)
+    temperature_max = models.FloatField(null=True, blank=True)
+    temperature_sum = models.FloatField(null=True, blank=True)
+    temperature_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'patient_vitals_rollups'
+        ordering = ['bucket_start']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['patient', 'granularity', 'bucket_start'], name='vitals_rollup_bucket_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.patient_id} {self.granularity} {self.bucket_start}"
+
+
+class PatientAccessEvent(models.Model):
+    """Who viewed or changed a patient; written in batches by `audit`."""
+    ACTION_CHOICES = [
+        ('view', 'Viewed'),
+        ('history', 'Viewed history'),
+        ('update', 'Updated'),
+        ('delete', 'Deleted'),
+        ('download', 'Downloaded document'),
+        ('batch', 'Fetched in batch'),
+    ]
+
+    # No foreign key constraints: the trail must outlive deleted patients and users.
+    patient = models.ForeignKey(
+        Patient, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name='+'
+    )
+    user = models.ForeignKey(
+        'authentication.User', on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+        null=True, related_name='+'
+    )
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    detail = models.CharField(max_length=100, blank=True)
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    occurred_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'patient_access_events'
+        indexes = [
+            models.Index(fields=['patient', '-occurred_at'], name='access_event_patient_idx'),
+            models.Index(fields=['user', '-occurred_at'], name='access_event_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.action} {self.patient_id} at {self.occurred_at}"
+
+
+@receiver(post_save, sender=Patient)
+def patient_saved(sender, instance, update_fields=None, **kwargs):
+    from . import autocomplete
+    from .search import SEARCH_FIELDS, index_patients
+    if update_fields is None or set(update_fields) & set(SEARCH_FIELDS + ('age', 'gender')):
+        index_patients([instance])
+        autocomplete.patient_changed(instance)
+
+
+@receiver(post_save, sender=Patient)
+def patient_census_saved(sender, instance, created, **kwargs):
+    from . import census
+    census.record_save(instance, created)
+
+
+@receiver(post_delete, sender=Patient)
+def patient_deleted(sender, instance, **kwargs):
+    from . import autocomplete, census
+    census.record_delete(instance)
+    autocomplete.patient_deleted(instance.pk)
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def patient_api_cache_changed(sender, instance, **kwargs):
+    from . import api_cache
+    api_cache.patient_changed(instance.pk)
+
+
+@receiver(post_save, sender=PatientVitals)
+def vitals_saved(sender, instance, **kwargs):
+    from . import api_cache, rollups
+    rollups.vitals_changed(instance.patient_id, instance.recorded_at, getattr(instance, '_loaded_recorded_at', None))
+    instance._loaded_recorded_at = instance.recorded_at
+    api_cache.vitals_changed(instance.patient_id)
+
+
+@receiver(post_delete, sender=PatientVitals)
+def vitals_deleted(sender, instance, **kwargs):
+    from . import api_cache, rollups
+    rollups.vitals_changed(instance.patient_id, instance.recorded_at)
+    api_cache.vitals_changed(instance.patient_id)
+
+
+@receiver(post_delete, sender=PatientDocument)
+def document_deleted(sender, instance, **kwargs):
+    if instance.blob_id:
+        DocumentBlob.release(instance.blob_id)
+    elif instance.file:
+        # Files stored before deduplication belong to this document alone.
+        PendingFileDeletion.objects.create(name=instance.file.name)
@@ -0,0 +1,169 @@
+"""Pagination helpers for patient listings."""
+
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .census import get_census
+
+KEYSET_ORDERING = ('-created_at', 'id')
+
+
+class KnownCountPaginator(Paginator):
+    """Paginator that trusts a count supplied by the caller instead of running COUNT(*)."""
+
+    def __init__(self, object_list, per_page, known_count=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.known_count = known_count
+
+    @cached_property
+    def count(self):
+        if self.known_count is not None:
+            return self.known_count
+        return super().count
+
+
+def census_count(query='', status='', census=None):
+    """
+    Row count for an unsearched patient listing, read from the census (or
+    the one passed in), or None when the listing has to be counted.
+    `status` must be the filter actually applied to the listing.
+    """
+    if query:
+        return None
+    census = census or get_census()
+    return {'': census.total, 'admitted': census.admitted, 'discharged': census.discharged}.get(status)
+
+
+class PatientPageNumberPagination(PageNumberPagination):
+
+    def paginate_queryset(self, queryset, request, view=None):
+        known_count = census_count(request.query_params.get('q', ''), request.query_params.get('status', ''))
+
+        def paginator_class(object_list, per_page):
+            return KnownCountPaginator(object_list, per_page, known_count=known_count)
+
+        self.django_paginator_class = paginator_class
+        return super().paginate_queryset(queryset, request, view)
+
+
+def wants_keyset(params):
+    return 'cursor' in params or params.get('pagination') == 'cursor'
+
+
+def encode_cursor(created_at, pk):
+    payload = json.dumps({'c': created_at.isoformat(), 'i': pk}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return (created_at, pk) for a cursor token; raises ValueError if it is malformed."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(payload['c']), int(payload['i'])
+    except (TypeError, KeyError, ValueError, UnicodeDecodeError, AttributeError) as exc:
+        raise ValueError('Invalid cursor') from exc
+
+
+def _row_key(row):
+    if isinstance(row, dict):
+        return row['created_at'], row['id']
+    return row.created_at, row.pk
+
+
+class KeysetPage:
+    """One page of a keyset walk over patients ordered by (-created_at, id)."""
+
+    def __init__(self, object_list, next_cursor, approximate_count=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.approximate_count = approximate_count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def keyset_page(queryset, cursor=None, page_size=20, approximate_count=None):
+    """
+    Fetch the page after `cursor`. The seek predicate keeps every page a
+    single indexed range read, however deep the walk goes.
+    """
+    queryset = queryset.order_by(*KEYSET_ORDERING)
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        # The redundant created_at <= bound lets the planner seek the index
+        # instead of scanning it from the start.
+        queryset = queryset.filter(created_at__lte=created_at).filter(
+            Q(created_at__lt=created_at) | Q(id__gt=pk)
+        )
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(*_row_key(rows[-1]))
+    return KeysetPage(rows, next_cursor, approximate_count)
+
+
+class PatientKeysetPagination(BasePagination):
+    """
+    Cursor pagination for the patient API. Pass `?pagination=cursor` to
+    start and follow `next`; add `with_total=1` for the census-based count.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_page_size(self, request):
+        page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE', 20)
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        return max(1, min(requested, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        approximate_count = None
+        if request.query_params.get('with_total'):
+            approximate_count = census_count(request.query_params.get('q', ''), request.query_params.get('status', ''))
+        try:
+            self.page = keyset_page(
+                queryset, request.query_params.get(self.cursor_query_param),
+                self.get_page_size(request), approximate_count,
+            )
+        except ValueError:
+            raise NotFound('Invalid cursor')
+        return list(self.page)
+
+    def get_next_link(self):
+        if not self.page.has_next():
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.page.next_cursor)
+
+    def get_first_link(self):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(remove_query_param(url, self.cursor_query_param), 'pagination', 'cursor')
+
+    def get_paginated_response(self, data):
+        payload = {'next': self.get_next_link(), 'first': self.get_first_link()}
+        if self.request.query_params.get('with_total'):
+            payload['approximate_count'] = self.page.approximate_count
+        payload['results'] = data
+        return Response(payload)
@@ -0,0 +1,39 @@
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class InvalidLine:
+    """Placeholder for an NDJSON line that is not a JSON object."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+class NDJSONParser(BaseParser):
+    """
+    Newline-delimited JSON. Each non-blank line becomes one list item; lines
+    that fail to parse become `InvalidLine` so callers can report them per
+    row instead of rejecting the whole body.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', 'utf-8')
+        rows = []
+        try:
+            # One read and split: line-by-line reads of the request stream
+            # re-slice its buffer for every line.
+            text = stream.read().decode(encoding)
+        except UnicodeDecodeError as exc:
+            raise ParseError(f'NDJSON parse error - {exc}')
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError as exc:
+                rows.append(InvalidLine(f'Invalid JSON: {exc}'))
+        return rows
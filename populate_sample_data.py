@@ -1,19 +1,51 @@
 """
 Management command to populate the database with sample test data.
 Usage: python manage.py populate_sample_data
+       python manage.py populate_sample_data --patients 1000000 --vitals-per-patient 200 \
+           --bills-per-patient 1.5 --appointments-per-patient 2 --workers 8 --seed 42 \
+           --now 2025-01-01T00:00:00
 """
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth.hashers import make_password
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from datetime import date, time, timedelta
+import os
 import random
+import time as clock
 
 
 class Command(BaseCommand):
     help = 'Populate database with sample test data'
 
+    def add_arguments(self, parser):
+        scale = parser.add_argument_group(
+            'scale mode', 'Also bulk-generate this many synthetic patients with vitals, bills and appointments'
+        )
+        scale.add_argument('--patients', type=int, default=0)
+        scale.add_argument('--vitals-per-patient', type=float, default=10)
+        scale.add_argument('--bills-per-patient', type=float, default=1)
+        scale.add_argument('--appointments-per-patient', type=float, default=1)
+        scale.add_argument('--days', type=int, default=730, help='History spanned by entry dates')
+        scale.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        scale.add_argument('--chunk-size', type=int, default=2000, help='Patients per worker task')
+        scale.add_argument('--seed', type=int, default=42)
+        scale.add_argument(
+            '--now', help='Reference time for generated dates (ISO 8601); fix it to reproduce a dataset'
+        )
+
     def handle(self, *args, **options):
+        if options['patients'] < 0 or options['chunk_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--patients must be zero or more, --chunk-size and --workers at least 1')
+        if options['now']:
+            try:
+                now = parse_datetime(options['now'])
+            except ValueError:
+                now = None
+            if now is None:
+                raise CommandError(f"--now must be an ISO 8601 date and time, not {options['now']!r}")
+            options['now'] = now if timezone.is_aware(now) else timezone.make_aware(now)
         self.stdout.write('Creating sample data...')
 
         # Import models
@@ -227,6 +259,9 @@ class Command(BaseCommand):
 
         self.stdout.write(self.style.SUCCESS('✓ Salary payments created'))
 
+        if options['patients']:
+            self.populate_scale(options, receptionist, doctors)
+
         self.stdout.write('')
         self.stdout.write(self.style.SUCCESS('=' * 50))
         self.stdout.write(self.style.SUCCESS('✅ Sample data populated successfully!'))
@@ -236,3 +271,43 @@ class Command(BaseCommand):
         self.stdout.write('  Doctor:      dr_smith / doctor123')
         self.stdout.write('  Receptionist: reception1 / recept123')
         self.stdout.write(self.style.SUCCESS('=' * 50))
+
+    def populate_scale(self, options, created_by, doctors):
+        from django.db import connection
+
+        from apps.patients.sample_data import populate
+
+        workers = options['workers']
+        if connection.vendor == 'sqlite' and workers > 1:
+            self.stdout.write(self.style.WARNING('SQLite allows one writer at a time; using 1 worker'))
+            workers = 1
+        total = options['patients']
+        self.stdout.write(f'Generating {total:,} patients with {workers} worker(s)...')
+        chunks = populate(
+            total,
+            vitals_per_patient=options['vitals_per_patient'],
+            bills_per_patient=options['bills_per_patient'],
+            appointments_per_patient=options['appointments_per_patient'],
+            workers=workers, chunk_size=options['chunk_size'], seed=options['seed'], days=options['days'],
+            created_by=created_by, doctors=[(doc.pk, doc.consultation_fee) for doc in doctors],
+            now=options['now'],
+        )
+        written = {'patients': 0, 'vitals': 0, 'bills': 0, 'appointments': 0}
+        started = last_report = clock.perf_counter()
+        for counts in chunks:
+            for table, rows in counts.items():
+                written[table] += rows
+            now = clock.perf_counter()
+            if now - last_report >= 5 or written['patients'] == total:
+                last_report = now
+                rows = sum(written.values())
+                self.stdout.write(
+                    f"  {written['patients']:,}/{total:,} patients, {rows:,} rows "
+                    f"({rows / (now - started):,.0f} rows/sec)"
+                )
+        elapsed = clock.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ {written['patients']:,} patients, {written['vitals']:,} vitals, {written['bills']:,} bills, "
+            f"{written['appointments']:,} appointments in {elapsed:.1f}s "
+            f"({sum(written.values()) / elapsed:,.0f} rows/sec)"
+        ))
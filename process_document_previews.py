@@ -0,0 +1,57 @@
+"""
+Management command to render queued document thumbnails and previews.
+Usage: python manage.py process_document_previews [--workers 4] [--backfill]
+           [--retry-failed] [--loop [--interval 5]] [--limit N]
+"""
+
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Render thumbnails and previews for queued image documents on a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Pool processes (default: CPU count)')
+        parser.add_argument('--batch-size', type=int, default=50, help='Jobs claimed per round')
+        parser.add_argument('--limit', type=int, help='Stop after this many jobs')
+        parser.add_argument('--backfill', action='store_true', help='First queue existing images without renditions')
+        parser.add_argument('--retry-failed', action='store_true', help='Queue failed jobs again')
+        parser.add_argument('--loop', action='store_true', help='Keep polling the queue instead of exiting when empty')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        from apps.patients import previews
+        from apps.patients.models import DocumentPreviewJob
+
+        if options['backfill']:
+            self.stdout.write(f'Queued {previews.backfill()} existing images')
+        if options['retry_failed']:
+            retried = DocumentPreviewJob.objects.filter(status='failed').update(status='pending', attempts=0)
+            self.stdout.write(f'Queued {retried} failed jobs again')
+
+        def progress(stats):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  {stats['done']} rendered, {stats['failed']} failed")
+
+        while True:
+            stats = previews.run(
+                workers=options['workers'], batch_size=options['batch_size'],
+                limit=options['limit'], progress=progress,
+            )
+            handled = stats['done'] + stats['failed']
+            if handled or not options['loop']:
+                seconds = stats['seconds'] or 1e-9
+                self.stdout.write(self.style.SUCCESS(
+                    f"✓ Rendered {stats['done']} documents in {stats['seconds']:.1f}s "
+                    f"({stats['done'] / seconds:,.1f} images/sec, "
+                    f"{stats['bytes'] / seconds / 1_000_000:,.1f} MB/s of originals)"
+                ))
+                if stats['failed']:
+                    self.stdout.write(self.style.WARNING(f"  {stats['failed']} failed; see DocumentPreviewJob.error"))
+            if not options['loop']:
+                return
+            if not handled:
+                time.sleep(options['interval'])
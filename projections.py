@@ -0,0 +1,136 @@
+"""
+Read-only patient rows built straight from `.values()`.
+
+`PatientSerializer` builds a model instance and runs DRF's field machinery
+for every column of every row. List, search and detail reads don't need
+either. They fetch only the columns a response uses, as dicts, and convert
+each value with a function chosen once per request. `?fields=` narrows the
+columns further. Writes still go through the serializer, and the output
+matches it field for field.
+"""
+
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import serializers
+
+# SerializerMethodFields computed from row values instead of an instance:
+# name -> (columns read, function of the row dict).
+PATIENT_COMPUTED = {
+    'full_name': (('first_name', 'last_name'), lambda row: f"{row['first_name']} {row['last_name']}"),
+    'status': (('is_admitted',), lambda row: 'Admitted' if row['is_admitted'] else 'Discharged'),
+}
+# Fields whose to_representation() returns database values unchanged.
+PASSTHROUGH = (serializers.CharField, serializers.IntegerField, serializers.BooleanField, serializers.ChoiceField)
+
+
+def parse_fields(value, available):
+    """
+    The names requested in a comma-separated `?fields=` value, in the
+    order of `available`. Returns None when no fields are requested and
+    raises ValueError naming any unknown field.
+    """
+    if not value:
+        return None
+    requested = {name.strip() for name in value.split(',')} - {''}
+    unknown = requested.difference(available)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}. Choose from {', '.join(available)}.")
+    return tuple(name for name in available if name in requested) or None
+
+
+@lru_cache(maxsize=None)
+def _field_specs(serializer_class):
+    """(name, column, kind, field) for each readable field, in serializer order."""
+    specs = []
+    model = serializer_class.Meta.model
+    for name, field in serializer_class().fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, serializers.SerializerMethodField):
+            specs.append((name, None, 'computed', field))
+            continue
+        column = model._meta.get_field(field.source).attname
+        if isinstance(field, serializers.PrimaryKeyRelatedField) or isinstance(field, PASSTHROUGH):
+            kind = 'plain'
+        elif isinstance(field, serializers.DateTimeField):
+            kind = 'datetime'
+        elif isinstance(field, serializers.DateField):
+            kind = 'date'
+        else:
+            kind = 'field'
+        specs.append((name, column, kind, field))
+    return tuple(specs)
+
+
+def readable_fields(serializer_class):
+    return [spec[0] for spec in _field_specs(serializer_class)]
+
+
+def _datetime_converter():
+    # DRF's ISO 8601 output: the active time zone, with UTC written as Z.
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+
+    def convert(value):
+        if tz is not None and value.tzinfo is not None:
+            value = value.astimezone(tz)
+        text = value.isoformat()
+        return text[:-6] + 'Z' if text.endswith('+00:00') else text
+    return convert
+
+
+def _date_converter(value):
+    return value.isoformat()
+
+
+class Projection:
+    """The columns to fetch for a set of serializer fields, and how to turn them into output."""
+
+    def __init__(self, serializer_class, computed, fields=None):
+        specs = _field_specs(serializer_class)
+        if fields is not None:
+            specs = [spec for spec in specs if spec[0] in fields]
+        datetime_converter = _datetime_converter()
+        columns = []
+        self.fields = []
+        self.steps = []
+        for name, column, kind, field in specs:
+            self.fields.append(name)
+            if kind == 'computed':
+                try:
+                    sources, compute = computed[name]
+                except KeyError:
+                    raise ValueError(f'No row function for {serializer_class.__name__}.{name}')
+                columns.extend(sources)
+                self.steps.append((name, None, compute))
+                continue
+            columns.append(column)
+            if kind == 'plain':
+                convert = None
+            elif kind == 'datetime':
+                convert = datetime_converter
+            elif kind == 'date':
+                convert = _date_converter
+            else:
+                convert = field.to_representation
+            self.steps.append((name, column, convert))
+        self.columns = tuple(dict.fromkeys(columns))
+
+    def values(self, queryset, *extra):
+        """`queryset` as dicts of the needed columns, plus `extra` ones (e.g. pagination keys)."""
+        return queryset.values(*dict.fromkeys((*self.columns, *extra)))
+
+    def row(self, values):
+        data = {}
+        for name, column, convert in self.steps:
+            if column is None:
+                data[name] = convert(values)
+            else:
+                value = values[column]
+                data[name] = value if convert is None or value is None else convert(value)
+        return data
+
+    def rows(self, rows):
+        row = self.row
+        return [row(values) for values in rows]
@@ -0,0 +1,34 @@
+"""
+Management command to rebuild or reconcile the patient census counters.
+Usage: python manage.py rebuild_census [--check]
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized patient census from the patients table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report drift; exit with an error if the counters are off',
+        )
+
+    def handle(self, *args, **options):
+        from apps.patients import census
+
+        actual = census.compute()
+        stored = census.as_dict(census.get_census())
+        drift = {key: (stored[key], value) for key, value in actual.items() if stored[key] != value}
+
+        for key, (was, now) in drift.items():
+            self.stdout.write(f'  {key}: stored {was}, actual {now}')
+        if options['check']:
+            if drift:
+                raise CommandError('Patient census is out of date; run rebuild_census.')
+            self.stdout.write(self.style.SUCCESS('✓ Patient census is consistent'))
+            return
+
+        census.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"✓ Patient census rebuilt ({actual['total']} patients)"))
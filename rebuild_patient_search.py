@@ -0,0 +1,18 @@
+"""
+Management command to rebuild the patient search index.
+Usage: python manage.py rebuild_patient_search
+"""
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the patient search index for the active backend'
+
+    def handle(self, *args, **options):
+        from apps.patients.search import get_backend, rebuild_index
+
+        backend = get_backend()
+        self.stdout.write(f'Rebuilding patient search index ({backend.name})...')
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS('✓ Search index rebuilt'))
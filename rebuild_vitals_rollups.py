@@ -0,0 +1,25 @@
+"""
+Management command to recompute the hourly and daily vitals rollups.
+Usage: python manage.py rebuild_vitals_rollups [--patient PK ...]
+"""
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Recompute the hourly and daily vitals rollups from the recorded readings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--patient', type=int, action='append', dest='patients',
+            help='Only rebuild this patient (repeatable)',
+        )
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        from apps.patients.rollups import rebuild
+
+        written = rebuild(options['patients'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Vitals rollups rebuilt ({written['hour']} hourly, {written['day']} daily)"
+        ))
@@ -0,0 +1,257 @@
+"""
+Incremental hourly and daily vitals rollups.
+
+Each saved, edited or deleted reading marks the hour and day buckets it
+falls in; once the transaction commits those buckets are recomputed with
+one grouped query per granularity: hours from the readings, days from the
+hours.
+Bulk ingest refreshes its buckets directly, and `rebuild_vitals_rollups`
+recomputes everything. `vitals_series` serves charts and the history page
+from the rollups, picking the finest resolution that fits the window.
+"""
+
+import threading
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, FloatField, Max, Min, Q, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .models import PatientVitals, VitalsRollup
+
+ROLLUP_READINGS = ('systolic', 'diastolic', 'pulse', 'spo2', 'temperature')
+ROLLUP_FIELDS = ['readings'] + [
+    f'{name}_{part}' for name in ROLLUP_READINGS for part in ('min', 'max', 'sum', 'count')
+]
+RESOLUTIONS = ('raw', 'hour', 'day', 'week', 'month')
+RESOLUTION_STEPS = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+    'month': timedelta(days=30),
+}
+# Raw readings are only considered for windows up to this long.
+RAW_WINDOW = timedelta(days=1)
+
+_pending = threading.local()
+
+
+def bucket_start(moment, granularity):
+    """Start of the local-time hour or day containing `moment`."""
+    local = timezone.localtime(moment)
+    if granularity == 'hour':
+        return local.replace(minute=0, second=0, microsecond=0)
+    return timezone.make_aware(datetime.combine(local.date(), time.min))
+
+
+def bucket_end(start, granularity):
+    if granularity == 'hour':
+        return start + timedelta(hours=1)
+    return timezone.make_aware(datetime.combine(timezone.localtime(start).date() + timedelta(days=1), time.min))
+
+
+def _spans(starts, granularity):
+    """Merge bucket starts into as few contiguous [start, end) ranges as possible."""
+    spans = []
+    for start in sorted(starts):
+        end = bucket_end(start, granularity)
+        if spans and spans[-1][1] == start:
+            spans[-1][1] = end
+        else:
+            spans.append([start, end])
+    return spans
+
+
+def _reading_aggregates():
+    aggregates = {'readings': Count('pk')}
+    for name in ROLLUP_READINGS:
+        aggregates[f'{name}_min'] = Min(name)
+        aggregates[f'{name}_max'] = Max(name)
+        aggregates[f'{name}_sum'] = Sum(name, output_field=FloatField())
+        aggregates[f'{name}_count'] = Count(name)
+    return aggregates
+
+
+def _rollup_aggregates():
+    aggregates = {'readings': Sum('readings')}
+    for name in ROLLUP_READINGS:
+        aggregates[f'{name}_min'] = Min(f'{name}_min')
+        aggregates[f'{name}_max'] = Max(f'{name}_max')
+        aggregates[f'{name}_sum'] = Sum(f'{name}_sum')
+        aggregates[f'{name}_count'] = Sum(f'{name}_count')
+    return aggregates
+
+
+def _upsert(rollups, batch_size=500):
+    options = {'update_conflicts': True, 'update_fields': ROLLUP_FIELDS + ['updated_at']}
+    # MySQL upserts on any unique key and rejects an explicit target.
+    if connection.features.supports_update_conflicts_with_target:
+        options['unique_fields'] = ['patient', 'granularity', 'bucket_start']
+    VitalsRollup.objects.bulk_create(rollups, batch_size=batch_size, **options)
+
+
+def _in_spans(field, spans):
+    condition = Q()
+    for start, end in spans:
+        condition |= Q(**{f'{field}__gte': start, f'{field}__lt': end})
+    return condition
+
+
+def _refresh(granularity, buckets, source, field, aggregates):
+    """Recompute the (patient_pk, bucket_start) `buckets` of one granularity from `source`."""
+    rows = (
+        source.filter(patient_id__in={patient_pk for patient_pk, _ in buckets})
+        .filter(_in_spans(field, _spans({start for _, start in buckets}, granularity)))
+        .annotate(bucket=Trunc(field, granularity))
+        .values('patient_id', 'bucket').annotate(**aggregates).order_by()
+    )
+    found = {}
+    for row in rows:
+        key = (row['patient_id'], row.pop('bucket'))
+        # The spans are shared across patients; skip buckets nobody touched.
+        if key in buckets:
+            found[key] = VitalsRollup(granularity=granularity, bucket_start=key[1], **row)
+    empty = defaultdict(list)
+    for patient_pk, start in buckets - found.keys():
+        empty[patient_pk].append(start)
+    if empty:
+        condition = Q()
+        for patient_pk, starts in empty.items():
+            condition |= Q(patient_id=patient_pk, bucket_start__in=starts)
+        VitalsRollup.objects.filter(condition, granularity=granularity).delete()
+    if found:
+        _upsert(list(found.values()))
+
+
+def refresh(keys):
+    """Recompute the hour and day rollups covering each (patient_pk, moment) in `keys`."""
+    hours = {(patient_pk, bucket_start(moment, 'hour')) for patient_pk, moment in keys}
+    if not hours:
+        return
+    days = {(patient_pk, bucket_start(hour, 'day')) for patient_pk, hour in hours}
+    with transaction.atomic():
+        _refresh('hour', hours, PatientVitals.objects.all(), 'recorded_at', _reading_aggregates())
+        _refresh('day', days, VitalsRollup.objects.filter(granularity='hour'), 'bucket_start', _rollup_aggregates())
+
+
+def _flush():
+    keys = getattr(_pending, 'keys', None)
+    if keys:
+        _pending.keys = set()
+        refresh(keys)
+
+
+def vitals_changed(patient_pk, *moments):
+    """
+    Queue the buckets of a saved or deleted reading for refresh on commit.
+    Keys are collected per thread so a transaction touching many readings
+    refreshes each bucket once; keys left by a rolled-back transaction are
+    simply recomputed with the next commit.
+    """
+    keys = _pending.__dict__.setdefault('keys', set())
+    keys.update((patient_pk, moment) for moment in moments if moment is not None)
+    transaction.on_commit(_flush)
+
+
+def rebuild(patient_pks=None, chunk_size=2000):
+    """Recompute every rollup (or those of `patient_pks`); returns rows written per granularity."""
+    written = {}
+    with transaction.atomic():
+        rollups = VitalsRollup.objects.all()
+        vitals = PatientVitals.objects.all()
+        if patient_pks is not None:
+            rollups = rollups.filter(patient_id__in=patient_pks)
+            vitals = vitals.filter(patient_id__in=patient_pks)
+        rollups.delete()
+        sources = (
+            ('hour', vitals, _reading_aggregates()),
+            ('day', rollups.filter(granularity='hour'), _rollup_aggregates()),
+        )
+        for granularity, source, aggregates in sources:
+            field = 'recorded_at' if granularity == 'hour' else 'bucket_start'
+            rows = (
+                source.annotate(bucket=Trunc(field, granularity))
+                .values('patient_id', 'bucket').annotate(**aggregates).order_by()
+            )
+            batch = []
+            written[granularity] = 0
+            for row in rows.iterator(chunk_size=chunk_size):
+                batch.append(VitalsRollup(
+                    granularity=granularity, bucket_start=row.pop('bucket'), **row
+                ))
+                if len(batch) == chunk_size:
+                    VitalsRollup.objects.bulk_create(batch)
+                    written[granularity] += len(batch)
+                    batch = []
+            VitalsRollup.objects.bulk_create(batch)
+            written[granularity] += len(batch)
+    return written
+
+
+def pick_resolution(start, end, max_points):
+    """Finest rollup resolution whose bucket count for [start, end) fits in `max_points`."""
+    span = end - start
+    for resolution in ('hour', 'day', 'week'):
+        if span / RESOLUTION_STEPS[resolution] <= max_points:
+            return resolution
+    return 'month'
+
+
+def _point(bucket, row):
+    point = {'bucket': bucket, 'readings': row['readings']}
+    for name in ROLLUP_READINGS:
+        count = row[f'{name}_count']
+        point[f'{name}_min'] = row[f'{name}_min']
+        point[f'{name}_max'] = row[f'{name}_max']
+        point[f'{name}_avg'] = round(row[f'{name}_sum'] / count, 2) if count else None
+    return point
+
+
+def _raw_points(patient_pk, start, end, max_points):
+    rows = list(
+        PatientVitals.objects.filter(patient_id=patient_pk, recorded_at__gte=start, recorded_at__lt=end)
+        .order_by('recorded_at').values_list('recorded_at', *ROLLUP_READINGS)[:max_points + 1]
+    )
+    if len(rows) > max_points:
+        return None
+    points = []
+    for recorded_at, *values in rows:
+        point = {'bucket': recorded_at, 'readings': 1}
+        for name, value in zip(ROLLUP_READINGS, values):
+            value = float(value) if value is not None else None
+            point[f'{name}_min'] = point[f'{name}_max'] = point[f'{name}_avg'] = value
+        points.append(point)
+    return points
+
+
+def vitals_series(patient_pk, start=None, end=None, resolution=None, max_points=500):
+    """
+    Downsampled readings for one patient in [start, end), defaulting to the
+    last 30 days. Points carry `<reading>_min/_max/_avg` like `vitals_trend`.
+    Without an explicit `resolution`, short windows with few readings are
+    returned raw and longer ones from the hourly or daily rollups; weeks and
+    months are summed from the daily rows.
+    """
+    end = end or timezone.now()
+    start = start or end - timedelta(days=30)
+    points = None
+    if resolution in (None, 'raw') and end - start <= RAW_WINDOW:
+        points = _raw_points(patient_pk, start, end, max_points)
+        if points is not None:
+            resolution = 'raw'
+    if points is None:
+        if resolution in (None, 'raw'):
+            resolution = pick_resolution(start, end, max_points)
+        source = 'hour' if resolution == 'hour' else 'day'
+        rows = (
+            VitalsRollup.objects.filter(
+                patient_id=patient_pk, granularity=source,
+                bucket_start__gte=bucket_start(start, source), bucket_start__lt=end,
+            )
+            .annotate(bucket=Trunc('bucket_start', resolution))
+            .values('bucket').annotate(**_rollup_aggregates()).order_by('bucket')
+        )
+        points = [_point(row.pop('bucket'), row) for row in rows]
+    return {'resolution': resolution, 'start': start, 'end': end, 'points': points}
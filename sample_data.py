@@ -0,0 +1,279 @@
+"""
+Synthetic hospital data at production scale, for capacity planning.
+
+`populate()` splits the requested patients into chunks of `chunk_size` and
+hands them to a pool of worker processes. Each worker generates its
+patients, their vitals, bills and appointments from a random generator
+seeded with (seed, chunk number) and writes them with chunked bulk_create
+in one transaction per chunk. Dates are offsets from a reference time,
+`now`, so a given seed, chunk size and `now` always produce the same rows
+whatever the number of workers. Patient IDs for the
+whole run are reserved up front with one sequence update.
+"""
+
+import math
+import multiprocessing
+import random
+from datetime import time, timedelta
+from decimal import Decimal
+
+import django
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import Patient, PatientIdSequence, PatientVitals
+
+FIRST_NAMES = [
+    'Ramesh', 'Sunita', 'Mohan', 'Pooja', 'Arun', 'Deepika', 'Suresh', 'Anjali',
+    'Rajesh', 'Priya', 'Anil', 'Vikram', 'Kavita', 'Sanjay', 'Meena', 'Rahul',
+    'Neha', 'Amit', 'Geeta', 'Vijay', 'Asha', 'Manoj', 'Rekha', 'Ravi',
+]
+LAST_NAMES = [
+    'Gupta', 'Devi', 'Lal', 'Singh', 'Sharma', 'Yadav', 'Mishra', 'Kumari',
+    'Verma', 'Patel', 'Mehta', 'Kumar', 'Agarwal', 'Chauhan', 'Tiwari', 'Pandey',
+]
+CITIES = [
+    ('Agra', 'UP'), ('Mathura', 'UP'), ('Firozabad', 'UP'), ('Gwalior', 'MP'),
+    ('Kanpur', 'UP'), ('Aligarh', 'UP'), ('Bareilly', 'UP'), ('Lucknow', 'UP'),
+]
+# Most patients come from the hospital's own city and its neighbours.
+CITY_WEIGHTS = [40, 15, 12, 6, 8, 9, 5, 5]
+# (youngest, oldest, share of patients)
+AGE_BANDS = [(0, 4, 8), (5, 17, 10), (18, 39, 30), (40, 59, 28), (60, 79, 19), (80, 99, 5)]
+BLOOD_GROUPS = [
+    ('B+', 32), ('O+', 29), ('A+', 21), ('AB+', 8),
+    ('B-', 3), ('O-', 3), ('A-', 2), ('AB-', 2),
+]
+AYUSHMAN_SHARE = 0.35
+# Share of visits that end the same day; the rest stay a log-normal number
+# of days with a median of STAY_MEDIAN_DAYS.
+OUTPATIENT_SHARE = 0.6
+STAY_MEDIAN_DAYS = 3
+ROOM_CHARGE_PER_DAY = 1500
+WRITE_BATCH_SIZE = 5000
+
+
+def _reserve_numbers(count):
+    prefix = Patient.patient_id_prefix()
+    return prefix, PatientIdSequence.allocate(prefix, count)
+
+
+def plan(patients, chunk_size, prefix, first_number, **options):
+    """One task per chunk of patients, numbered from 0."""
+    return [
+        {
+            **options, 'chunk': chunk, 'size': min(chunk_size, patients - start),
+            'prefix': prefix, 'first_number': first_number + start,
+        }
+        for chunk, start in enumerate(range(0, patients, chunk_size))
+    ]
+
+
+def _count(rng, mean):
+    """A whole number of rows averaging `mean`."""
+    whole = int(mean)
+    return whole + (rng.random() < mean - whole)
+
+
+def _make_patient(rng, patient_id, now, days, created_by_id):
+    city, state = rng.choices(CITIES, weights=CITY_WEIGHTS)[0]
+    youngest, oldest, _ = rng.choices(AGE_BANDS, weights=[band[2] for band in AGE_BANDS])[0]
+    # Recent visits are more common than old ones; most arrive in the daytime,
+    # but today's arrivals cannot be later than `now`.
+    entry = timezone.localtime(now - timedelta(days=days * rng.random() ** 1.5))
+    entry = min(entry.replace(hour=rng.randint(7, 21), minute=rng.randrange(60)), timezone.localtime(now))
+    if rng.random() < OUTPATIENT_SHARE:
+        stay = timedelta(hours=rng.uniform(1, 5))
+    else:
+        stay = timedelta(days=rng.lognormvariate(math.log(STAY_MEDIAN_DAYS), 0.8))
+    discharge = entry + stay if entry + stay < now else None
+    ayushman = rng.random() < AYUSHMAN_SHARE
+    return Patient(
+        patient_id=patient_id,
+        first_name=rng.choice(FIRST_NAMES),
+        last_name=rng.choice(LAST_NAMES),
+        age=rng.randint(youngest, oldest),
+        gender=rng.choice('MF'),
+        blood_group=rng.choices(BLOOD_GROUPS, weights=[group[1] for group in BLOOD_GROUPS])[0][0],
+        phone=f'9{rng.randrange(10 ** 9):09d}',
+        address=f'{city}, {state}',
+        city=city,
+        state=state,
+        has_ayushman_card=ayushman,
+        ayushman_card_number=f'AY{rng.randrange(10 ** 9):09d}' if ayushman else '',
+        entry_datetime=entry,
+        discharge_datetime=discharge,
+        is_admitted=discharge is None,
+        created_by_id=created_by_id,
+    )
+
+
+def _make_vitals(rng, patient, count, now, recorded_by_id):
+    start = patient.entry_datetime
+    span = ((patient.discharge_datetime or now) - start).total_seconds()
+    # Everyone has a baseline; readings wander around it.
+    systolic, diastolic = rng.gauss(125, 15), rng.gauss(80, 9)
+    pulse, spo2 = rng.gauss(80, 10), rng.uniform(95, 99)
+    for _ in range(count):
+        reading = PatientVitals(
+            patient_id=patient.pk,
+            recorded_by_id=recorded_by_id,
+            recorded_at=start + timedelta(seconds=rng.random() * span),
+            systolic=max(70, round(rng.gauss(systolic, 8))),
+            diastolic=max(40, round(rng.gauss(diastolic, 6))),
+            pulse=max(40, round(rng.gauss(pulse, 6))),
+            spo2=min(100, round(rng.gauss(spo2, 1))),
+            temperature=Decimal(f'{rng.gauss(36.9, 0.5):.1f}'),
+        )
+        reading.sync_readings()
+        yield reading
+
+
+def _make_bills(rng, Bill, patient, count, doctors, now, created_by_id):
+    end = patient.discharge_datetime or now
+    days = (end - patient.entry_datetime).days
+    for number in range(1, count + 1):
+        doctor_pk, fee = rng.choice(doctors)
+        room = ROOM_CHARGE_PER_DAY * days if number == 1 else 0
+        medicine = rng.choice([0, 250, 500, 1200, 3000])
+        lab = rng.choice([0, 0, 400, 800, 1500])
+        total = Decimal(fee + 200 + room + medicine + lab)
+        if patient.has_ayushman_card:
+            status, method, paid = 'paid', 'ayushman', total
+        else:
+            status = rng.choices(['paid', 'partial', 'pending'], weights=[75, 10, 15])[0]
+            method = rng.choice(['cash', 'cash', 'upi', 'card'])
+            paid = {'paid': total, 'partial': (total / 2).quantize(Decimal('1')), 'pending': Decimal(0)}[status]
+        bill_date = patient.entry_datetime + (end - patient.entry_datetime) * rng.random()
+        yield Bill(
+            bill_number=f'B{patient.patient_id}-{number}',
+            patient_id=patient.pk,
+            doctor_id=doctor_pk,
+            consultation_fee=fee,
+            entry_fee=200,
+            room_charges=room,
+            medicine_charges=medicine,
+            lab_charges=lab,
+            subtotal=total,
+            total_amount=total,
+            paid_amount=paid,
+            due_amount=total - paid,
+            is_ayushman=patient.has_ayushman_card,
+            ayushman_claim_amount=total if patient.has_ayushman_card else 0,
+            payment_method=method,
+            payment_status=status,
+            payment_date=bill_date if status != 'pending' else None,
+            bill_date=bill_date,
+            created_by_id=created_by_id,
+        )
+
+
+def _make_appointments(rng, Appointment, patient, count, doctors, now, booked_by_id):
+    for number in range(1, count + 1):
+        # The first visit plus follow-ups up to two months later; some are still ahead.
+        when = patient.entry_datetime + timedelta(days=0 if number == 1 else rng.randint(3, 60))
+        past = when < now
+        yield Appointment(
+            appointment_id=f'A{patient.patient_id}-{number}',
+            patient_id=patient.pk,
+            doctor_id=rng.choice(doctors)[0],
+            appointment_date=timezone.localdate(when),
+            appointment_time=time(rng.randint(9, 16), rng.choice([0, 15, 30, 45])),
+            appointment_type='consultation' if number == 1 else 'follow_up',
+            status=(
+                rng.choices(['completed', 'cancelled'], weights=[90, 10])[0] if past
+                else rng.choice(['pending', 'confirmed'])
+            ),
+            reason='General checkup' if number == 1 else 'Follow-up',
+            booked_by_id=booked_by_id,
+        )
+
+
+def _write(model, rows):
+    """bulk_create an iterable of unsaved rows in batches; returns how many."""
+    written = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == WRITE_BATCH_SIZE:
+            model.objects.bulk_create(batch)
+            written += len(batch)
+            batch = []
+    model.objects.bulk_create(batch)
+    return written + len(batch)
+
+
+def generate_chunk(task):
+    """Generate and insert one chunk; returns rows written per table."""
+    from apps.appointments.models import Appointment
+    from apps.billing.models import Bill
+
+    from . import rollups
+    from .search import index_patients
+
+    rng = random.Random(f"{task['seed']}-{task['chunk']}")
+    now = task['now']
+    user_id = task['created_by_id']
+    doctors = task['doctors']
+    ids = [f"{task['prefix']}{n:04d}" for n in range(task['first_number'], task['first_number'] + task['size'])]
+    patients = [_make_patient(rng, patient_id, now, task['days'], user_id) for patient_id in ids]
+    with transaction.atomic():
+        Patient.objects.bulk_create(patients, batch_size=WRITE_BATCH_SIZE)
+        # Backends that cannot return pks (MySQL) need them read back.
+        if not all(patient.pk for patient in patients):
+            pks = dict(Patient.objects.filter(patient_id__in=ids).values_list('patient_id', 'pk'))
+            for patient in patients:
+                patient.pk = pks[patient.patient_id]
+        index_patients(patients)
+        counts = {'patients': len(patients), 'bills': 0, 'appointments': 0}
+        counts['vitals'] = _write(PatientVitals, (
+            reading for patient in patients
+            for reading in _make_vitals(rng, patient, _count(rng, task['vitals_per_patient']), now, user_id)
+        ))
+        if doctors:
+            counts['bills'] = _write(Bill, (
+                bill for patient in patients
+                for bill in _make_bills(rng, Bill, patient, _count(rng, task['bills_per_patient']), doctors, now, user_id)
+            ))
+            counts['appointments'] = _write(Appointment, (
+                appointment for patient in patients
+                for appointment in _make_appointments(
+                    rng, Appointment, patient, _count(rng, task['appointments_per_patient']), doctors, now, user_id,
+                )
+            ))
+        if counts['vitals']:
+            rollups.rebuild([patient.pk for patient in patients])
+    return counts
+
+
+def populate(patients, vitals_per_patient=10, bills_per_patient=1.0, appointments_per_patient=1.0,
+             workers=1, chunk_size=2000, seed=42, days=730, created_by=None, doctors=(), now=None):
+    """
+    Insert `patients` synthetic patients with on average the given number of
+    vitals readings, bills and appointments each, and yield the rows written
+    per table after every chunk. Bills and appointments need `doctors`, a
+    list of (pk, consultation fee). Dates are generated relative to `now`,
+    the current time by default. The census, autocomplete index and API
+    cache are brought up to date once the run stops.
+    """
+    from . import api_cache, autocomplete, census
+
+    prefix, first_number = _reserve_numbers(patients)
+    tasks = plan(
+        patients, chunk_size, prefix, first_number, seed=seed, days=days, now=now or timezone.now(),
+        vitals_per_patient=vitals_per_patient, bills_per_patient=bills_per_patient,
+        appointments_per_patient=appointments_per_patient,
+        created_by_id=getattr(created_by, 'pk', None), doctors=list(doctors),
+    )
+    try:
+        if workers <= 1:
+            yield from map(generate_chunk, tasks)
+            return
+        # Children must open their own connections, not share the parent's.
+        connections.close_all()
+        with multiprocessing.Pool(workers, initializer=django.setup) as pool:
+            yield from pool.imap_unordered(generate_chunk, tasks)
+    finally:
+        census.rebuild()
+        autocomplete.invalidate()
+        api_cache.changed('patients')
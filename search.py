@@ -0,0 +1,226 @@
+"""
+Patient search backends.
+
+All patient search paths (list page, reception autocomplete and the API)
+go through `search_patients()`, which picks an indexed backend for the
+active database:
+
+* SQLite  - FTS5 external-content table `patients_fts` with the trigram
+            tokenizer, kept in sync by triggers
+* MySQL   - FULLTEXT index with the ngram parser on the `patients` table
+* other   - `PatientSearchToken` trigram rows maintained from Patient signals
+
+Queries are split into word tokens and every token must occur somewhere in
+a patient's name, phone or patient ID, as with the original icontains
+scan: `0001` finds P2025010001 and `3210` finds 9876543210. Tokens too
+short for a backend's index are matched with icontains. Results are
+ordered best match first unless the caller asks for the plain queryset
+ordering.
+"""
+
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from .models import Patient, PatientSearchToken
+
+TOKEN_RE = re.compile(r'\w+')
+FTS_TABLE = 'patients_fts'
+MYSQL_INDEX = 'ft_patients_search'
+SEARCH_FIELDS = ('first_name', 'last_name', 'phone', 'patient_id')
+GRAM_SIZE = 3
+
+
+def tokenize(text):
+    return [token.lower() for token in TOKEN_RE.findall(text or '')]
+
+
+def grams(token):
+    """The trigram starting at each position of `token`, shorter at its end."""
+    return {token[start:start + GRAM_SIZE] for start in range(len(token))}
+
+
+def patient_tokens(patient):
+    tokens = set()
+    for field in SEARCH_FIELDS:
+        for token in tokenize(getattr(patient, field)):
+            tokens.update(grams(token))
+    return tokens
+
+
+def contains(term):
+    return Q(*(Q(**{f'{field}__icontains': term}) for field in SEARCH_FIELDS), _connector=Q.OR)
+
+
+def prefix_rank(terms):
+    """Number of (field, term) pairs where the field starts with the term."""
+    return sum((
+        Case(When(**{f'{field}__istartswith': term}, then=Value(1)), default=Value(0))
+        for field in SEARCH_FIELDS for term in terms
+    ), Value(0))
+
+
+class LegacySearchBackend:
+    """The original four-way icontains scan, kept for comparison."""
+    name = 'icontains'
+
+    def search(self, queryset, query, terms, ranked=True):
+        return queryset.filter(
+            Q(first_name__icontains=query) | Q(last_name__icontains=query) |
+            Q(phone__icontains=query) | Q(patient_id__icontains=query)
+        )
+
+
+class SQLiteFTSBackend:
+    name = 'fts5'
+
+    def match_expression(self, terms):
+        # Trigram phrases match anywhere in a column; shorter ones match nothing.
+        return ' '.join(f'"{term}"' for term in terms if len(term) >= GRAM_SIZE)
+
+    def search(self, queryset, query, terms, ranked=True):
+        for term in terms:
+            if len(term) < GRAM_SIZE:
+                queryset = queryset.filter(contains(term))
+        expression = self.match_expression(terms)
+        if not expression:
+            return queryset.order_by('-created_at') if ranked else queryset
+        queryset = queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [expression]
+        ))
+        if ranked and connection.Database.sqlite_version_info >= (3, 35):
+            # bm25 rank, lower is better. The MATERIALIZED CTE runs the MATCH
+            # once per query instead of once per candidate row.
+            queryset = queryset.annotate(search_rank=RawSQL(
+                f'WITH ranked AS MATERIALIZED (SELECT rowid, rank FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s) SELECT rank FROM ranked '
+                f'WHERE ranked.rowid = {Patient._meta.db_table}.id', [expression]
+            )).order_by('search_rank', '-created_at')
+        return queryset
+
+
+class MySQLFulltextBackend:
+    name = 'mysql'
+    # innodb_ft ngram_token_size defaults to 2.
+    min_term = 2
+
+    def search(self, queryset, query, terms, ranked=True):
+        for term in terms:
+            if len(term) < self.min_term:
+                queryset = queryset.filter(contains(term))
+        indexed = [term for term in terms if len(term) >= self.min_term]
+        if not indexed:
+            return queryset.order_by('-created_at') if ranked else queryset
+        table = Patient._meta.db_table
+        columns = ', '.join(f'{table}.{field}' for field in SEARCH_FIELDS)
+        expression = ' '.join(f'+"{term}"' for term in indexed)
+        queryset = queryset.annotate(search_rank=RawSQL(
+            f'MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)', [expression]
+        )).filter(search_rank__gt=0)
+        if ranked:
+            return queryset.order_by('-search_rank', '-created_at')
+        return queryset
+
+
+class TokenTableBackend:
+    name = 'tokens'
+    maintains_tokens = True
+
+    def with_token(self, queryset, **lookup):
+        return queryset.filter(pk__in=PatientSearchToken.objects.filter(**lookup).values('patient_id'))
+
+    def search(self, queryset, query, terms, ranked=True):
+        for term in terms:
+            if len(term) <= GRAM_SIZE:
+                # Every substring this short starts one of the stored grams.
+                # Range scan instead of LIKE so every database can use the index.
+                upper = term[:-1] + chr(ord(term[-1]) + 1)
+                queryset = self.with_token(queryset, token__gte=term, token__lt=upper)
+                continue
+            # Trigrams covering the term narrow the candidates; icontains on
+            # those confirms they occur in order.
+            starts = sorted({*range(0, len(term) - GRAM_SIZE + 1, GRAM_SIZE), len(term) - GRAM_SIZE})
+            for start in starts:
+                queryset = self.with_token(queryset, token=term[start:start + GRAM_SIZE])
+            queryset = queryset.filter(contains(term))
+        if ranked:
+            queryset = queryset.annotate(search_rank=prefix_rank(terms)).order_by('-search_rank', '-created_at')
+        return queryset
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (LegacySearchBackend, SQLiteFTSBackend, MySQLFulltextBackend, TokenTableBackend)
+}
+_detected = {}
+
+
+def _fts_table_exists():
+    with connection.cursor() as cursor:
+        return FTS_TABLE in connection.introspection.table_names(cursor)
+
+
+def get_backend(name=None):
+    name = name or getattr(settings, 'PATIENT_SEARCH_BACKEND', 'auto')
+    if name != 'auto':
+        return BACKENDS[name]()
+    key = (connection.alias, connection.vendor)
+    if key not in _detected:
+        if connection.vendor == 'sqlite' and _fts_table_exists():
+            _detected[key] = SQLiteFTSBackend
+        elif connection.vendor == 'mysql':
+            _detected[key] = MySQLFulltextBackend
+        else:
+            _detected[key] = TokenTableBackend
+    return _detected[key]()
+
+
+def search_patients(queryset, query, ranked=True, backend=None):
+    """Filter `queryset` down to patients matching `query`."""
+    query = (query or '').strip()
+    terms = tokenize(query)
+    if not terms:
+        return queryset
+    return get_backend(backend).search(queryset, query, terms, ranked=ranked)
+
+
+def index_patients(patients):
+    """Refresh search tokens for `patients` when the token backend is active."""
+    if not getattr(get_backend(), 'maintains_tokens', False):
+        return
+    patients = list(patients)
+    PatientSearchToken.objects.filter(patient__in=patients).delete()
+    PatientSearchToken.objects.bulk_create([
+        PatientSearchToken(patient=patient, token=token)
+        for patient in patients
+        for token in patient_tokens(patient)
+    ])
+
+
+def rebuild_index(chunk_size=2000):
+    """Rebuild the active backend's index from the patients table."""
+    backend = get_backend()
+    if isinstance(backend, SQLiteFTSBackend):
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')")
+        return
+    if not getattr(backend, 'maintains_tokens', False):
+        return
+    PatientSearchToken.objects.all().delete()
+    last_pk = 0
+    while True:
+        chunk = list(
+            Patient.objects.filter(pk__gt=last_pk).order_by('pk')
+            .only('pk', *SEARCH_FIELDS)[:chunk_size]
+        )
+        if not chunk:
+            break
+        PatientSearchToken.objects.bulk_create([
+            PatientSearchToken(patient_id=patient.pk, token=token)
+            for patient in chunk
+            for token in patient_tokens(patient)
+        ])
+        last_pk = chunk[-1].pk
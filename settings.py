@@ -36,6 +36,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'apps.patients.instrumentation.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -47,6 +48,16 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# WhiteNoise has no async path: under ASGI it would run the rest of the stack
+# and every async view through sync adapters. asgi.py sets DJANGO_ASGI, and
+# Nginx serves /static/ there instead.
+if os.environ.get('DJANGO_ASGI'):
+    MIDDLEWARE.remove('whitenoise.middleware.WhiteNoiseMiddleware')
+
+# Route patient list, detail and search API reads to the async views in
+# async_views.py. Only worth it under ASGI; WSGI keeps the DRF views.
+PATIENT_ASYNC_READS = bool(os.environ.get('DJANGO_ASGI'))
+
 ROOT_URLCONF = 'hospital_mgmt.urls'
 
 TEMPLATES = [
@@ -88,6 +99,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file, not :memory:, so tests can run worker processes against it.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -132,6 +145,78 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20,
 }
 
+# Patient search: 'auto' picks FTS5 on SQLite, FULLTEXT on MySQL and the
+# token table elsewhere. 'icontains' restores the unindexed scan.
+PATIENT_SEARCH_BACKEND = os.environ.get('PATIENT_SEARCH_BACKEND', 'auto')
+
+# Reception autocomplete keeps an in-process prefix index per worker. It holds
+# at most this many (most recent) patients and re-checks the shared version
+# stamp at most once per interval (seconds).
+PATIENT_AUTOCOMPLETE_MAX_ENTRIES = 100_000
+PATIENT_AUTOCOMPLETE_CHECK_INTERVAL = 2.0
+
+# Upper bound on readings accepted by one bulk vitals ingest request.
+VITALS_BULK_MAX_ROWS = 50_000
+
+# Ids accepted by one POST /api/v1/patients/batch/ request.
+PATIENT_BATCH_MAX_IDS = 500
+
+# Rows accepted per upload by the patient import API; larger files go
+# through `manage.py import_patients`.
+PATIENT_IMPORT_MAX_ROWS = 50_000
+
+# Document downloads are authorized by Django and, when set, sent by the
+# front-end server: 'x-accel-redirect' (nginx, internal location at
+# DOCUMENT_ACCEL_REDIRECT_PREFIX aliasing MEDIA_ROOT) or 'x-sendfile'
+# (Apache mod_xsendfile, lighttpd). Empty serves the file from Django.
+DOCUMENT_SENDFILE_BACKEND = os.environ.get('DOCUMENT_SENDFILE_BACKEND', '')
+DOCUMENT_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# Image documents get downscaled renditions (longest side in pixels), rendered
+# by `manage.py process_document_previews` and stored next to the original.
+DOCUMENT_PREVIEW_SIZES = {'thumb': 256, 'preview': 1600}
+DOCUMENT_PREVIEW_FORMAT = 'webp'  # or 'jpeg': larger files, several times faster to render
+DOCUMENT_PREVIEW_QUALITY = 80
+
+# Patient API responses are cached under per-namespace version tokens that
+# saves and deletes replace (see api_cache.py), so TIMEOUT only bounds how
+# long unread entries stay on disk. The cache must be shared by every worker:
+# FileBasedCache on one host, Redis or Memcached across hosts. Set
+# PATIENT_API_CACHE = '' to turn it off.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'patient_api': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'patient_api',
+        'TIMEOUT': 3600,
+        'OPTIONS': {'MAX_ENTRIES': 20_000},
+    },
+}
+PATIENT_API_CACHE = os.environ.get('PATIENT_API_CACHE', 'patient_api')
+
+# Patient access audit (see audit.py): events are queued in-process and
+# written in batches by a background thread, at least every FLUSH_INTERVAL
+# seconds. 'db' stores PatientAccessEvent rows, 'file' appends JSON lines to
+# PATIENT_AUDIT_FILE, which also takes events the database rejects or a
+# full queue cannot hold. '' turns auditing off.
+PATIENT_AUDIT_SINK = os.environ.get('PATIENT_AUDIT_SINK', 'db')
+PATIENT_AUDIT_FILE = BASE_DIR / 'logs' / 'patient_audit.jsonl'
+PATIENT_AUDIT_QUEUE_SIZE = 10_000
+PATIENT_AUDIT_BATCH_SIZE = 500
+PATIENT_AUDIT_FLUSH_INTERVAL = 1.0
+
+# Request timing (see instrumentation.py): this share of requests gets query
+# counts, db/template timings and N+1 warnings for query shapes repeated
+# REPEATED_QUERIES times. Requests slower than SLOW_MS are logged to
+# logs/slow_requests.log whether sampled or not. SERVER_TIMING adds the
+# timings to sampled responses to staff users as a Server-Timing header.
+REQUEST_TIMING_SAMPLE_RATE = float(os.environ.get('REQUEST_TIMING_SAMPLE_RATE', '0.1'))
+REQUEST_TIMING_SLOW_MS = 500
+REQUEST_TIMING_REPEATED_QUERIES = 5
+REQUEST_TIMING_SERVER_TIMING = False
+
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:3000',
     'http://127.0.0.1:8000',
@@ -160,6 +245,10 @@ LOGGING = {
             'format': '{levelname} {asctime} {module} {process:d} {thread:d} {message}',
             'style': '{',
         },
+        'message': {
+            'format': '{message}',
+            'style': '{',
+        },
     },
     'handlers': {
         'file': {
@@ -171,6 +260,18 @@ LOGGING = {
         'console': {
             'class': 'logging.StreamHandler',
         },
+        'slow_requests': {
+            'class': 'logging.FileHandler',
+            'filename': BASE_DIR / 'logs/slow_requests.log',
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'apps.patients.slow_requests': {
+            'handlers': ['slow_requests'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
     'root': {
         'handlers': ['console', 'file'],
@@ -0,0 +1,62 @@
+"""
+Content-addressed storage for patient documents.
+
+Uploads are hashed with SHA-256 while they stream to a temporary file and
+stored once under their digest, so the same scan uploaded again only adds
+a reference. The name the field asks for is ignored; the original filename
+is kept on the document. Reference counts live on `DocumentBlob`.
+"""
+
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+BLOB_DIR = 'documents/blobs'
+TEMP_PREFIX = '.upload-'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def blob_name(self, digest):
+        return f'{BLOB_DIR}/{digest[:2]}/{digest}'
+
+    def digest(self, name):
+        """The SHA-256 a blob name was stored under, or None for other files."""
+        directory, digest = os.path.split(name)
+        if directory.startswith(BLOB_DIR) and len(digest) == 64:
+            return digest
+        return None
+
+    def get_available_name(self, name, max_length=None):
+        # Names are chosen by content in _save; skip the existence probe.
+        return name
+
+    def _save(self, name, content):
+        directory = self.path(BLOB_DIR)
+        os.makedirs(directory, exist_ok=True)
+        sha = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                for chunk in content.chunks():
+                    sha.update(chunk)
+                    fh.write(chunk)
+            name = self.blob_name(sha.hexdigest())
+            path = self.path(name)
+            if os.path.exists(path):
+                os.remove(tmp)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(tmp, self.file_permissions_mode)
+                os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return name
+
+
+document_storage = ContentAddressedStorage()
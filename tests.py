@@ -0,0 +1,919 @@
+import gc
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import tracemalloc
+from datetime import date, datetime, time, timedelta
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection, connections, transaction
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.authentication.models import User
+
+from . import api_cache, audit, autocomplete, census, media_gc
+from .batch import MAX_PK, parse_ids
+from .downloads import serve_public_media
+from .exports import FORMATS, vitals_response
+from .models import (
+    DocumentBlob, IndexVersion, Patient, PatientAccessEvent, PatientDocument, PatientIdSequence, PatientVitals, PendingFileDeletion,
+    VitalsRollup,
+)
+from .pagination import keyset_page
+from .sample_data import _make_patient
+from .search import search_patients
+from .storage import document_storage
+from .vitals import _validate_reading, ingest_readings
+
+ALLOCATION_PREFIX = 'P209901'
+
+
+def _allocate_blocks(sizes):
+    """Runs in a worker process: reserve a block of each size, return (first, size) pairs."""
+    blocks = [(PatientIdSequence.allocate(ALLOCATION_PREFIX, size), size) for size in sizes]
+    connections.close_all()
+    return blocks
+
+
+@skipUnless('fork' in multiprocessing.get_all_start_methods(), 'workers share the test database through fork')
+class PatientIdAllocationTests(TransactionTestCase):
+    workers = 6
+    # Single registrations interleaved with bulk-import sized blocks.
+    sizes = [1] * 150 + [25, 1, 100, 1, 7]
+
+    def test_concurrent_allocations_are_unique_and_contiguous(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('worker processes cannot open an in-memory database')
+        # Children must open their own connections, not share the parent's.
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(self.workers) as pool:
+            results = pool.map(_allocate_blocks, [self.sizes] * self.workers)
+        numbers = [first + offset for blocks in results for first, size in blocks for offset in range(size)]
+        total = self.workers * sum(self.sizes)
+
+        self.assertEqual(len(numbers), total)
+        self.assertEqual(sorted(numbers), list(range(1, total + 1)))
+        self.assertEqual(PatientIdSequence.objects.get(prefix=ALLOCATION_PREFIX).last_value, total)
+
+
+@override_settings(PATIENT_AUDIT_SINK='')
+class PatientDetailQueryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        from apps.doctors.models import Doctor, Specialization
+
+        cls.user = User.objects.create_user('reception1', password='recept123', role='receptionist')
+        cls.doctor = Doctor.objects.create(
+            first_name='Rajesh', last_name='Smith',
+            specialization=Specialization.objects.create(name='General Medicine'),
+            qualification='MBBS', experience_years=10, phone='9123456789',
+            consultation_fee=500, monthly_salary=80000, joining_date=date(2016, 1, 1),
+            available_days='Mon,Tue,Wed,Thu,Fri', consultation_start=time(9, 0), consultation_end=time(17, 0),
+        )
+
+    def patient_with_history(self, rows):
+        """A patient with `rows` documents, vitals readings, bills and appointments."""
+        from apps.appointments.models import Appointment
+        from apps.billing.models import Bill
+
+        patient = Patient.objects.create(
+            first_name='Sunita', last_name='Devi', age=52, gender='F',
+            phone='9876500000', address='Agra', city='Agra', state='UP',
+        )
+        now = timezone.now()
+        PatientDocument.objects.bulk_create(
+            PatientDocument(patient=patient, title=f'Report {n}', file=f'documents/report-{n}.pdf', uploaded_by=self.user)
+            for n in range(rows)
+        )
+        PatientVitals.objects.bulk_create(
+            PatientVitals(patient=patient, recorded_at=now - timedelta(hours=n), systolic=120, diastolic=80, pulse=72)
+            for n in range(rows)
+        )
+        Bill.objects.bulk_create(
+            Bill(
+                bill_number=f'B{patient.patient_id}-{n}', patient=patient, doctor=self.doctor,
+                consultation_fee=500, subtotal=500, total_amount=500, payment_status='pending',
+                payment_method='cash', bill_date=now - timedelta(days=n), created_by=self.user,
+            )
+            for n in range(rows)
+        )
+        Appointment.objects.bulk_create(
+            Appointment(
+                appointment_id=f'A{patient.patient_id}-{n}', patient=patient, doctor=self.doctor,
+                appointment_date=now.date() - timedelta(days=n), appointment_time=time(10, 0),
+                appointment_type='follow_up', status='completed', reason='Follow-up', booked_by=self.user,
+            )
+            for n in range(rows)
+        )
+        return patient
+
+    def test_query_count_does_not_grow_with_history(self):
+        self.client.force_login(self.user)
+        short = self.patient_with_history(1)
+        long = self.patient_with_history(40)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('patients:patient_detail', args=[short.pk]))
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(reverse('patients:patient_detail', args=[long.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['timeline']['bills']['count'], 40)
+
+    def test_timeline_section_limit(self):
+        self.client.force_login(self.user)
+        patient = self.patient_with_history(3)
+        url = f'/api/v1/patients/{patient.pk}/timeline/'
+
+        response = self.client.get(url, {'section': 'vitals', 'limit': 2})
+        self.assertEqual(len(response.json()['vitals']['items']), 2)
+        self.assertIsNotNone(response.json()['vitals']['next_cursor'])
+        for limit in ('-1', '0', 'x'):
+            with self.subTest(limit=limit):
+                response = self.client.get(url, {'section': 'vitals', 'limit': limit})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('limit', response.json())
+
+
+class PatientSearchTests(TestCase):
+    backends = ['fts5', 'tokens']
+
+    @classmethod
+    def setUpTestData(cls):
+        with override_settings(PATIENT_SEARCH_BACKEND='tokens'):
+            cls.ram = Patient.objects.create(
+                first_name='Ram', last_name='Kumar', age=40, gender='M',
+                phone='9876543210', address='Agra', city='Agra', state='UP',
+            )
+            cls.vikram = Patient.objects.create(
+                first_name='Vikram', last_name='Kumar', age=35, gender='M',
+                phone='9123400000', address='Agra', city='Agra', state='UP',
+            )
+
+    def search(self, backend, query, ranked=False):
+        return list(search_patients(Patient.objects.all(), query, ranked=ranked, backend=backend))
+
+    def test_terms_match_anywhere_in_a_field(self):
+        queries = {
+            '3210': [self.ram],                    # trailing phone digits
+            self.ram.patient_id[-4:]: [self.ram],  # patient ID suffix
+            'ikra': [self.vikram],                 # inside a name
+            'ra': [self.ram, self.vikram],         # shorter than a trigram
+            'kum 43210': [self.ram],               # every term must match
+            'KUMAR': [self.ram, self.vikram],
+            'ramesh': [],
+        }
+        for backend in self.backends:
+            for query, expected in queries.items():
+                with self.subTest(backend=backend, query=query):
+                    self.assertCountEqual(self.search(backend, query), expected)
+
+    def test_closest_match_ranks_first(self):
+        for backend in self.backends:
+            with self.subTest(backend=backend):
+                self.assertEqual(self.search(backend, 'ram kumar', ranked=True), [self.ram, self.vikram])
+
+    def test_autocomplete_finds_substrings(self):
+        self.client.force_login(User.objects.create_user('reception1', password='recept123', role='receptionist'))
+        response = self.client.get(reverse('patients:patient_search_ajax'), {'q': '3210'})
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.ram.pk])
+
+
+def make_patient(first_name='Sunita', last_name='Devi', phone='9876500000', **fields):
+    return Patient.objects.create(
+        first_name=first_name, last_name=last_name, phone=phone,
+        **{'age': 52, 'gender': 'F', 'address': 'Agra', 'city': 'Agra', 'state': 'UP', **fields},
+    )
+
+
+class PatientAutocompleteTests(TestCase):
+
+    def setUp(self):
+        # This worker's index, and one in another worker that only sees the database.
+        self.index = autocomplete.PatientPrefixIndex(check_interval=0, background=False)
+        self.other = autocomplete.PatientPrefixIndex(check_interval=0, background=False)
+        patcher = mock.patch.object(autocomplete, 'index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.patient = make_patient()
+        self.index.build()
+        self.other.build()
+
+    def found(self, index, query):
+        return [row['id'] for row in index.search(query, limit=1) or []]
+
+    def test_saves_reach_other_workers_without_a_version_bump(self):
+        self.patient.first_name = 'Savitri'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient.save()
+
+        self.assertFalse(IndexVersion.objects.exists())
+        for index in (self.index, self.other):
+            with self.subTest(index=index):
+                self.assertEqual(self.found(index, 'savitri'), [self.patient.pk])
+                self.assertEqual(self.found(index, 'sunita'), [])
+
+    def test_deletes_rebuild_other_workers(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient.delete()
+
+        self.assertEqual(self.index.version, 1)
+        for index in (self.index, self.other):
+            with self.subTest(index=index):
+                self.assertEqual(self.found(index, 'sunita'), [])
+                self.assertEqual(index.version, 1)
+
+    def test_full_index_keeps_the_newest_patients(self):
+        self.index.max_entries = 1
+        newer = make_patient(first_name='Savitri')
+        self.index.upsert(newer)
+
+        self.assertEqual(list(self.index._rows), [newer.pk])
+        self.index.upsert(self.patient)
+        self.assertEqual(list(self.index._rows), [newer.pk])
+
+    def test_searches_use_the_old_arrays_while_rebuilding(self):
+        newer = make_patient(first_name='Savitri')
+        state = self.index._load()
+        loading = threading.Event()
+        self.index.background = True
+        self.index._load = lambda: loading.wait(5) and state
+
+        self.index.schedule_rebuild()
+        self.assertTrue(self.index.rebuilding)
+        self.assertEqual(self.found(self.index, 'sunita'), [self.patient.pk])
+        loading.set()
+        for thread in threading.enumerate():
+            if thread.name == 'patient-autocomplete':
+                thread.join(5)
+        self.assertFalse(self.index.rebuilding)
+        self.assertIn(newer.pk, self.index._rows)
+
+
+@override_settings(PATIENT_AUDIT_SINK='', PATIENT_API_CACHE='')
+class PatientCensusTests(TestCase):
+
+    def assertCensus(self, total, admitted, new_today):
+        counts = census.as_dict(census.get_census())
+        self.assertEqual(
+            (counts['total'], counts['admitted'], counts['discharged'], counts['new_today']),
+            (total, admitted, total - admitted, new_today),
+        )
+        recount = census.compute()
+        self.assertEqual((recount['total'], recount['admitted']), (total, admitted))
+
+    def test_counters_follow_admissions_discharges_and_deletes(self):
+        first, second = make_patient(), make_patient(phone='9876500001')
+        make_patient(phone='9876500002', is_admitted=False)
+        self.assertCensus(total=3, admitted=2, new_today=3)
+
+        first.is_admitted = False
+        first.save()
+        self.assertCensus(total=3, admitted=1, new_today=3)
+        first.save()
+        self.assertCensus(total=3, admitted=1, new_today=3)
+
+        Patient.objects.get(pk=first.pk).delete()
+        self.assertCensus(total=2, admitted=1, new_today=2)
+        second.delete()
+        self.assertCensus(total=1, admitted=0, new_today=1)
+
+    def test_list_counts_match_the_rows_listed(self):
+        user = User.objects.create_user('reception1', password='recept123', role='receptionist')
+        self.client.force_login(user)
+        for n in range(5):
+            make_patient(phone=f'98765000{n:02d}', is_admitted=n % 2 == 0)
+        for status in ('', 'admitted', 'discharged', 'unknown'):
+            with self.subTest(status=status):
+                rows = Patient.objects.all()
+                if status in ('admitted', 'discharged'):
+                    rows = rows.filter(is_admitted=status == 'admitted')
+                page = self.client.get(reverse('patients:patient_list'), {'status': status}).context['patients']
+                self.assertEqual(page.paginator.count, rows.count())
+                response = self.client.get('/api/v1/patients/', {'status': status})
+                self.assertEqual(response.json()['count'], rows.count())
+
+
+@override_settings(PATIENT_AUDIT_SINK='', PATIENT_API_CACHE='')
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for n in range(25):
+            make_patient(phone=f'98765000{n:02d}')
+        # Ties on created_at must be broken by id, not skipped or repeated.
+        tied = list(Patient.objects.order_by('pk').values_list('pk', flat=True)[5:15])
+        Patient.objects.filter(pk__in=tied).update(created_at=timezone.now() - timedelta(days=1))
+
+    def expected(self):
+        return list(Patient.objects.order_by('-created_at', 'id').values_list('pk', flat=True))
+
+    def test_walk_visits_every_patient_once(self):
+        expected = self.expected()
+        seen, cursor = [], None
+        while True:
+            page = keyset_page(Patient.objects.all(), cursor, page_size=7)
+            seen.extend(patient.pk for patient in page)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+            if len(seen) == 7:
+                # Patients registered mid-walk sort before the cursor.
+                make_patient(phone='9876599999')
+        self.assertEqual(seen, expected)
+
+    def test_api_follows_next_links(self):
+        self.client.force_login(User.objects.create_user('reception1', password='recept123', role='receptionist'))
+        seen, url = [], '/api/v1/patients/?pagination=cursor&page_size=7&fields=id'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(row['id'] for row in response.json()['results'])
+            url = response.json()['next']
+        self.assertEqual(seen, self.expected())
+        self.assertEqual(self.client.get('/api/v1/patients/', {'cursor': 'not-a-cursor'}).status_code, 404)
+
+
+@override_settings(PATIENT_AUDIT_SINK='', PATIENT_API_CACHE='')
+class VitalsReadingSyncTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_patient()
+        cls.reading = PatientVitals.objects.create(
+            patient=cls.patient, blood_pressure='120/80', pulse_rate='72 bpm', oxygen_saturation='98%',
+        )
+
+    def reload(self):
+        return PatientVitals.objects.get(pk=self.reading.pk)
+
+    def test_edited_text_is_parsed_again(self):
+        reading = self.reload()
+        reading.blood_pressure, reading.pulse_rate, reading.oxygen_saturation = '140/90', '88', '95 %'
+        with self.captureOnCommitCallbacks(execute=True):
+            reading.save()
+
+        reading = self.reload()
+        self.assertEqual((reading.systolic, reading.diastolic, reading.pulse, reading.spo2), (140, 90, 88, 95))
+        hour = VitalsRollup.objects.get(patient=self.patient, granularity='hour')
+        self.assertEqual((hour.systolic_max, hour.pulse_max), (140, 88))
+
+    def test_edited_typed_values_rewrite_the_text(self):
+        reading = self.reload()
+        reading.systolic, reading.pulse = 150, 90
+        reading.save()
+
+        reading = self.reload()
+        self.assertEqual((reading.blood_pressure, reading.pulse_rate), ('150/80', '90 bpm'))
+
+    def test_conflicting_text_and_typed_values_are_rejected(self):
+        self.client.force_login(User.objects.create_user('nurse1', password='nurse123', role='receptionist'))
+        url = f'/api/v1/patients/{self.patient.pk}/vitals/'
+        response = self.client.post(
+            url, {'patient': self.patient.pk, 'blood_pressure': '120/80', 'systolic': 140}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('blood_pressure', response.json())
+
+        response = self.client.post(
+            url, {'patient': self.patient.pk, 'blood_pressure': '120/80', 'systolic': 120}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['diastolic'], 80)
+
+
+@override_settings(PATIENT_AUDIT_SINK='', PATIENT_API_CACHE='')
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_patient()
+        cls.reading = PatientVitals.objects.create(patient=cls.patient, blood_pressure='120/80')
+        cls.user = User.objects.create_user('nurse1', password='nurse123', role='receptionist')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def revalidate(self, url, change):
+        """ETag of `url`, a 304 for it, then the response to the same conditional GET after `change`."""
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        change()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertNotEqual(response['ETag'], etag)
+        return response
+
+    def edit_reading(self, **values):
+        reading = PatientVitals.objects.get(pk=self.reading.pk)
+        for name, value in values.items():
+            setattr(reading, name, value)
+        reading.save()
+
+    def test_vitals_edit_changes_the_etag(self):
+        url = f'/api/v1/patients/{self.patient.pk}/vitals/'
+        response = self.revalidate(url, lambda: self.edit_reading(blood_pressure='140/90'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['systolic'], 140)
+
+    def test_vitals_export_edit_changes_the_etag(self):
+        url = f'/api/v1/patients/{self.patient.pk}/vitals/?format=csv'
+        response = self.revalidate(url, lambda: self.edit_reading(pulse_rate='88 bpm'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('88', b''.join(response.streaming_content).decode())
+
+    def test_reading_moved_out_of_the_window(self):
+        day = timezone.localdate(self.reading.recorded_at)
+        url = f'/api/v1/patients/{self.patient.pk}/vitals/?from={day}&to={day}'
+        moved = self.reading.recorded_at - timedelta(days=2)
+        response = self.revalidate(url, lambda: self.edit_reading(recorded_at=moved))
+        self.assertEqual((response.status_code, response.json()['count']), (200, 0))
+
+    def test_patient_edit_changes_the_etag(self):
+        def rename():
+            self.patient.last_name = 'Sharma'
+            self.patient.save()
+
+        response = self.revalidate(f'/api/v1/patients/{self.patient.pk}/', rename)
+        self.assertEqual((response.status_code, response.json()['last_name']), (200, 'Sharma'))
+
+
+@override_settings(
+    PATIENT_AUDIT_SINK='', PATIENT_API_CACHE='patient_api',
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'patient_api': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'patient-api-tests'},
+    },
+)
+class ApiCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_patient()
+        cls.other = make_patient(first_name='Ravi', phone='9876500001')
+        cls.user = User.objects.create_user('nurse1', password='nurse123', role='receptionist')
+
+    def setUp(self):
+        api_cache.get_cache().clear()
+        self.client.force_login(self.user)
+
+    def assertCache(self, url, outcome):
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response['X-Cache']), (200, outcome))
+        return response
+
+    def commit(self, change, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            change(*args, **kwargs)
+
+    def test_patient_save_invalidates_its_detail_and_the_list(self):
+        detail, other, listing = (
+            f'/api/v1/patients/{self.patient.pk}/', f'/api/v1/patients/{self.other.pk}/', '/api/v1/patients/'
+        )
+        for url in (detail, other, listing):
+            self.assertCache(url, 'MISS')
+            self.assertCache(url, 'HIT')
+
+        self.patient.last_name = 'Sharma'
+        self.commit(self.patient.save)
+        self.assertEqual(self.assertCache(detail, 'MISS').json()['last_name'], 'Sharma')
+        self.assertCache(listing, 'MISS')
+        self.assertCache(other, 'HIT')
+
+    def test_delete_invalidates_the_list(self):
+        listing = '/api/v1/patients/'
+        self.assertEqual(self.assertCache(listing, 'MISS').json()['count'], 2)
+        self.commit(self.other.delete)
+        self.assertEqual(self.assertCache(listing, 'MISS').json()['count'], 1)
+
+    def test_vitals_changes_invalidate_that_patients_vitals(self):
+        url, other = f'/api/v1/patients/{self.patient.pk}/vitals/', f'/api/v1/patients/{self.other.pk}/vitals/'
+        for page in (url, other):
+            self.assertCache(page, 'MISS')
+        self.commit(PatientVitals.objects.create, patient=self.patient, blood_pressure='120/80')
+        self.assertEqual(self.assertCache(url, 'MISS').json()['count'], 1)
+        self.assertCache(other, 'HIT')
+
+        self.commit(ingest_readings, [{'patient': self.patient.pk, 'pulse': 80}])
+        self.assertEqual(self.assertCache(url, 'MISS').json()['count'], 2)
+
+    def test_rolled_back_save_keeps_the_entry(self):
+        detail = f'/api/v1/patients/{self.patient.pk}/'
+        self.assertCache(detail, 'MISS')
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ZeroDivisionError), transaction.atomic():
+                self.patient.save()
+                1 / 0
+        self.assertCache(detail, 'HIT')
+
+    def test_hit_answers_conditional_get(self):
+        detail = f'/api/v1/patients/{self.patient.pk}/'
+        etag = self.assertCache(detail, 'MISS')['ETag']
+        response = self.client.get(detail, headers={'If-None-Match': etag})
+        self.assertEqual((response.status_code, response['X-Cache']), (304, 'HIT'))
+
+
+@override_settings(PATIENT_AUDIT_SINK='', PATIENT_API_CACHE='', PATIENT_IMPORT_MAX_ROWS=3)
+class PatientImportApiTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('reception1', password='recept123', role='receptionist'))
+
+    def upload(self, rows):
+        lines = ['first_name,last_name,age,gender,phone,address']
+        # Quoted addresses spanning three lines each.
+        lines += [f'Ravi,Kumar,{30 + n},M,98765000{n:02d},"House {n}\nCivil Lines\nAgra"' for n in range(rows)]
+        upload = SimpleUploadedFile('patients.csv', '\n'.join(lines).encode(), content_type='text/csv')
+        return self.client.post('/api/v1/patients/import/', {'file': upload})
+
+    def test_limit_counts_records_not_lines(self):
+        response = self.upload(3)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['created'], 3)
+        self.assertEqual(Patient.objects.get(phone='9876500002').address, 'House 2\nCivil Lines\nAgra')
+
+    def test_oversized_upload_writes_nothing(self):
+        response = self.upload(4)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file', response.json())
+        self.assertFalse(Patient.objects.exists())
+
+
+class DocumentTestCase(TestCase):
+    """Stores uploads under a temporary MEDIA_ROOT."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_patient()
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root, PATIENT_AUDIT_SINK='', PATIENT_API_CACHE='')
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def upload(self, content, name='scan.pdf'):
+        return PatientDocument.objects.create(
+            patient=self.patient, title=name, file=SimpleUploadedFile(name, content),
+        )
+
+    def stored(self, name):
+        return document_storage.exists(name)
+
+
+class DocumentBlobTests(DocumentTestCase):
+
+    def test_same_content_is_stored_once(self):
+        first, second = self.upload(b'%PDF report'), self.upload(b'%PDF report', name='copy.pdf')
+
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual((second.original_filename, DocumentBlob.objects.get().refcount), ('copy.pdf', 2))
+        self.assertTrue(self.stored(first.file.name))
+
+    def test_last_release_queues_the_file(self):
+        first, second = self.upload(b'%PDF report'), self.upload(b'%PDF report')
+        name = first.file.name
+
+        first.delete()
+        self.assertEqual(DocumentBlob.objects.get().refcount, 1)
+        self.assertFalse(PendingFileDeletion.objects.exists())
+        second.delete()
+        self.assertEqual(DocumentBlob.objects.get().refcount, 0)
+        self.assertEqual(list(PendingFileDeletion.objects.values_list('name', flat=True)), [name])
+        self.assertTrue(self.stored(name))
+
+    def test_replacing_a_file_releases_the_old_blob(self):
+        document = self.upload(b'%PDF first')
+        old = document.blob
+
+        document.file = SimpleUploadedFile('second.pdf', b'%PDF second')
+        document.save()
+        old.refresh_from_db()
+        self.assertEqual(old.refcount, 0)
+        self.assertEqual((document.blob.refcount, document.original_filename), (1, 'second.pdf'))
+        self.assertEqual(list(PendingFileDeletion.objects.values_list('name', flat=True)), [old.name])
+
+
+class MediaDrainTests(DocumentTestCase):
+
+    def test_rows_are_deleted_before_files(self):
+        document = self.upload(b'%PDF report')
+        name, digest = document.file.name, document.blob.sha256
+        document.delete()
+        unlink = document_storage.delete
+
+        def delete(path):
+            self.assertFalse(DocumentBlob.objects.filter(sha256=digest).exists())
+            unlink(path)
+
+        with mock.patch.object(document_storage, 'delete', side_effect=delete) as deleted:
+            self.assertEqual(media_gc.drain(), (1, 1))
+        self.assertEqual(deleted.call_args_list[0], mock.call(name))
+        self.assertFalse(self.stored(name))
+        self.assertFalse(PendingFileDeletion.objects.exists())
+
+    def test_upload_before_drain_keeps_the_file(self):
+        document = self.upload(b'%PDF report')
+        name = document.file.name
+        document.delete()
+        again = self.upload(b'%PDF report')
+
+        self.assertEqual(media_gc.drain(), (0, 1))
+        self.assertTrue(self.stored(name))
+        self.assertEqual(DocumentBlob.objects.get().refcount, 1)
+        self.assertEqual(again.file.read(), b'%PDF report')
+
+    def test_upload_after_drain_stores_the_file_again(self):
+        document = self.upload(b'%PDF report')
+        name = document.file.name
+        document.delete()
+        media_gc.drain()
+        self.assertFalse(self.stored(name) or DocumentBlob.objects.exists())
+
+        again = self.upload(b'%PDF report')
+        self.assertEqual((again.file.name, again.blob.refcount), (name, 1))
+        self.assertTrue(self.stored(name))
+
+
+class DocumentDownloadTests(DocumentTestCase):
+    content = b'%PDF-1.4 discharge summary'
+
+    def setUp(self):
+        super().setUp()
+        self.document = self.upload(self.content)
+        self.url = f'/api/v1/patients/{self.patient.pk}/documents/{self.document.pk}/download/'
+        self.client.force_login(User.objects.create_user('reception1', password='recept123', role='receptionist'))
+
+    def get(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        # The test client closes a streamed response once it is read.
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_full_download(self):
+        response, body = self.get()
+        self.assertEqual((response.status_code, body), (200, self.content))
+        self.assertEqual(response['ETag'], f'"{self.document.blob.sha256}"')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_ranges(self):
+        cases = [
+            ('bytes=0-3', 'bytes 0-3/26', self.content[:4]),
+            ('bytes=9-', 'bytes 9-25/26', self.content[9:]),
+            ('bytes=-7', 'bytes 19-25/26', self.content[-7:]),
+            ('bytes=20-999', 'bytes 20-25/26', self.content[20:]),
+        ]
+        for header, content_range, expected in cases:
+            with self.subTest(header):
+                response, body = self.get(Range=header)
+                self.assertEqual((response.status_code, response['Content-Range'], body), (206, content_range, expected))
+                self.assertEqual(int(response['Content-Length']), len(expected))
+
+    def test_unsatisfiable_and_ignored_ranges(self):
+        response, _ = self.get(Range='bytes=26-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */26'))
+        for header in ('bytes=0-1,4-5', 'lines=1-2', 'bytes=5-2'):
+            with self.subTest(header):
+                self.assertEqual(self.get(Range=header)[0].status_code, 200)
+
+    def test_conditional_requests(self):
+        etag = self.get()[0]['ETag']
+
+        response, body = self.get(**{'If-None-Match': etag})
+        self.assertEqual((response.status_code, body, response['ETag']), (304, b'', etag))
+        self.assertEqual(self.get(**{'If-None-Match': '"other"'})[0].status_code, 200)
+        # A stale If-Range sends the whole file instead of a piece of the new one.
+        self.assertEqual(self.get(Range='bytes=0-3', **{'If-Range': etag})[0].status_code, 206)
+        self.assertEqual(self.get(Range='bytes=0-3', **{'If-Range': '"stale"'})[0].status_code, 200)
+
+    def test_other_patients_document_is_not_found(self):
+        other = make_patient(phone='9876500001')
+        url = f'/api/v1/patients/{other.pk}/documents/{self.document.pk}/download/'
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_media_url_does_not_serve_documents(self):
+        request = RequestFactory().get('/media/')
+        name = self.document.file.name
+        for path in (name, f'x/../{name}', f'/{name}'):
+            with self.subTest(path):
+                with self.assertRaises(Http404):
+                    serve_public_media(request, path)
+        other = os.path.join(settings.MEDIA_ROOT, 'logo.txt')
+        with open(other, 'wb') as fh:
+            fh.write(b'logo')
+        response = serve_public_media(request, 'logo.txt')
+        with response.file_to_stream:
+            self.assertEqual(b''.join(response.streaming_content), b'logo')
+
+
+@override_settings(PATIENT_AUDIT_BATCH_SIZE=2, PATIENT_AUDIT_QUEUE_SIZE=5)
+class AuditBufferTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = make_patient()
+
+    def setUp(self):
+        # No writer thread: the tests flush by hand.
+        thread = mock.patch.object(audit.threading, 'Thread')
+        self.thread = thread.start()
+        self.addCleanup(thread.stop)
+        at_exit = mock.patch.object(audit.atexit, 'register')
+        at_exit.start()
+        self.addCleanup(at_exit.stop)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'audit', 'patient_audit.jsonl')
+        audit_file = override_settings(PATIENT_AUDIT_FILE=self.path)
+        audit_file.enable()
+        self.addCleanup(audit_file.disable)
+        self.log = audit.AuditLog()
+
+    def record(self, count, action='view'):
+        for n in range(count):
+            self.log.record(self.patient.pk, None, action, f'event {n}', '10.0.0.1')
+
+    def filed(self):
+        with open(self.path, encoding='utf-8') as fh:
+            return [json.loads(line) for line in fh]
+
+    def test_events_wait_for_a_flush(self):
+        self.record(3)
+        self.assertEqual(self.thread.call_count, 1)
+        self.assertEqual(self.log.pending(), 3)
+        self.assertFalse(PatientAccessEvent.objects.exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.log.flush(), 3)
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(self.log.pending(), 0)
+        self.assertEqual(self.log.counts['written'], 3)
+        event = PatientAccessEvent.objects.order_by('pk').first()
+        self.assertEqual(
+            (event.patient_id, event.action, event.detail, event.ip_address), (self.patient.pk, 'view', 'event 0', '10.0.0.1')
+        )
+
+    def test_full_batch_wakes_the_writer(self):
+        self.record(1)
+        self.assertFalse(self.log._wake.is_set())
+        self.record(1)
+        self.assertTrue(self.log._wake.is_set())
+
+    def test_overflow_goes_to_the_file(self):
+        self.record(7)
+        self.assertEqual((self.log.pending(), self.log.counts['overflowed']), (5, 2))
+        self.assertEqual([event['detail'] for event in self.filed()], ['event 5', 'event 6'])
+        self.log.flush()
+        self.assertEqual(PatientAccessEvent.objects.count(), 5)
+
+    def test_rejected_batch_goes_to_the_file(self):
+        self.record(3)
+        with mock.patch.object(PatientAccessEvent.objects, 'bulk_create', side_effect=DatabaseError), \
+                self.assertLogs('apps.patients.audit', 'ERROR'):
+            self.assertEqual(self.log.flush(), 3)
+        self.assertEqual(self.log.counts['to_file'], 3)
+        self.assertEqual([event['patient'] for event in self.filed()], [self.patient.pk] * 3)
+
+    def test_file_sink(self):
+        self.record(2, action='download')
+        with self.settings(PATIENT_AUDIT_SINK='file'):
+            self.log.flush()
+        self.assertFalse(PatientAccessEvent.objects.exists())
+        self.assertEqual([event['action'] for event in self.filed()], ['download', 'download'])
+
+    def test_api_reads_are_recorded(self):
+        user = User.objects.create_user('admin1', password='admin123', role='admin')
+        self.client.force_login(user)
+        with mock.patch.object(audit, 'log', self.log), self.settings(PATIENT_AUDIT_SINK='db', PATIENT_API_CACHE=''):
+            self.assertEqual(self.client.get(f'/api/v1/patients/{self.patient.pk}/').status_code, 200)
+            with self.settings(PATIENT_AUDIT_SINK=''):
+                self.client.get(f'/api/v1/patients/{self.patient.pk}/')
+            self.assertEqual(audit.flush(), 1)
+        event = PatientAccessEvent.objects.get()
+        self.assertEqual((event.user_id, event.action), (user.pk, 'view'))
+
+
+class BatchIdParsingTests(SimpleTestCase):
+
+    def test_ids(self):
+        parsed = parse_ids([12, ' 7 ', 'P20240100001', str(MAX_PK), '12'], 10)
+        self.assertEqual(parsed, {'12': 12, '7': 7, 'P20240100001': 'P20240100001', str(MAX_PK): MAX_PK})
+
+    def test_invalid(self):
+        for values in (None, [], 'P1', [True], [1.5], [None], [' '], [MAX_PK + 1], [str(MAX_PK + 1)], [1, 2, 3]):
+            with self.subTest(values=values), self.assertRaises(ValueError):
+                parse_ids(values, 2)
+
+    def test_other_digits_are_patient_ids(self):
+        self.assertEqual(parse_ids(['\u00b2'], 10), {'\u00b2': '\u00b2'})
+
+
+@override_settings(PATIENT_AUDIT_SINK='')
+class BatchApiTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('reception1', password='recept123', role='receptionist'))
+
+    def post(self, ids):
+        return self.client.post('/api/v1/patients/batch/', {'ids': ids}, content_type='application/json')
+
+    def test_out_of_range_id_is_rejected(self):
+        for value in (MAX_PK + 1, str(10 ** 30)):
+            with self.subTest(value=value):
+                response = self.post([value])
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('ids', response.json())
+
+    def test_lookup(self):
+        patient = make_patient()
+        response = self.post([patient.pk, patient.patient_id, MAX_PK])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(results[str(patient.pk)]['id'], patient.pk)
+        self.assertEqual(results[patient.patient_id]['id'], patient.pk)
+        self.assertEqual(response.json()['not_found'], [str(MAX_PK)])
+
+
+class SampleDataTests(SimpleTestCase):
+
+    def test_entry_is_never_after_now(self):
+        # Early in the morning most drawn arrival hours are still ahead.
+        now = timezone.make_aware(datetime(2026, 3, 2, 8, 30))
+        rng = random.Random(7)
+        patients = [_make_patient(rng, f'P{n}', now, 1, None) for n in range(300)]
+
+        self.assertTrue(all(patient.entry_datetime <= now for patient in patients))
+        self.assertTrue(any(patient.entry_datetime == now for patient in patients))
+        self.assertTrue(all(
+            patient.discharge_datetime is None or patient.entry_datetime < patient.discharge_datetime < now
+            for patient in patients
+        ))
+
+
+class VitalsValidationTests(SimpleTestCase):
+
+    def test_malformed_values_are_row_errors(self):
+        rows = [
+            ({'patient': 1, 'temperature': 'NaN'}, 'temperature'),
+            ({'patient': 1, 'weight': 'sNaN'}, 'weight'),
+            ({'patient': 1, 'height': 'Infinity'}, 'height'),
+            ({'patient': 1, 'recorded_at': '2024-13-45T10:00:00'}, 'recorded_at'),
+            ({'patient': 1, 'pulse_rate': '72 bpm', 'pulse': 90}, 'pulse_rate'),
+        ]
+        for row, field in rows:
+            with self.subTest(row=row):
+                vitals, errors = _validate_reading(row, {1}, timezone.now())
+                self.assertIsNone(vitals)
+                self.assertEqual(list(errors), [field])
+
+
+class VitalsExportMemoryTests(TestCase):
+    rows = 30_000
+    # Observed peak is ~1.6 MB whatever the row count; holding the rows or
+    # the rendered file would take several times this.
+    peak_bytes = 4_000_000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = Patient.objects.create(
+            first_name='Mohan', last_name='Lal', age=67, gender='M',
+            phone='9876500001', address='Mathura', city='Mathura', state='UP',
+        )
+        now = timezone.now()
+        PatientVitals.objects.bulk_create((
+            PatientVitals(
+                patient=cls.patient, recorded_at=now - timedelta(minutes=n), blood_pressure='120/80',
+                systolic=120, diastolic=80, pulse=72, spo2=98, notes='Routine observation',
+            ) for n in range(cls.rows)
+        ), batch_size=5000)
+
+    def export_peak(self, fmt):
+        """(lines written, traced peak bytes) for streaming the patient's vitals in `fmt`."""
+        response = vitals_response(PatientVitals.objects.filter(patient=self.patient), fmt, 'vitals')
+        gc.collect()
+        tracemalloc.start()
+        try:
+            lines = sum(chunk.count(b'\n') for chunk in response.streaming_content)
+            return lines, tracemalloc.get_traced_memory()[1]
+        finally:
+            # Not response.close(): its request_finished signal would close the test database.
+            tracemalloc.stop()
+
+    def test_peak_memory_is_bounded(self):
+        for fmt in FORMATS:
+            with self.subTest(format=fmt):
+                lines, peak = self.export_peak(fmt)
+                self.assertGreaterEqual(lines, self.rows)
+                self.assertLess(peak, self.peak_bytes)
@@ -0,0 +1,137 @@
+"""
+Bounded patient timeline.
+
+`patient_detail` and the timeline API show the most recent slice of each
+related section (documents, vitals, bills, appointments) instead of every
+row. The page costs one query for the patient plus per-section counts and
+one query per section, however much history the patient has. Each section
+carries a keyset cursor for "load more".
+"""
+
+import base64
+import json
+
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.fields.files import FieldFile
+
+from .models import Patient
+
+
+class Section:
+
+    def __init__(self, name, ordering, limit, select_related=()):
+        self.name = name
+        self.ordering = ordering
+        self.limit = limit
+        self.select_related = select_related
+
+    @property
+    def related_model(self):
+        return Patient._meta.get_field(self.name).related_model
+
+    @property
+    def fk_name(self):
+        return Patient._meta.get_field(self.name).field.name
+
+    def queryset(self, patient_pk):
+        qs = self.related_model._default_manager.filter(**{self.fk_name: patient_pk})
+        if self.select_related:
+            qs = qs.select_related(*self.select_related)
+        return qs.order_by(*(f'-{field}' for field in self.ordering))
+
+    def count_annotation(self):
+        counts = self.related_model._default_manager.filter(
+            **{self.fk_name: OuterRef('pk')}
+        ).order_by().values(self.fk_name).annotate(n=Count('pk')).values('n')
+        return Subquery(counts, output_field=IntegerField())
+
+
+SECTIONS = {
+    section.name: section for section in (
+        Section('documents', ('uploaded_at', 'id'), 10),
+        Section('vitals', ('recorded_at', 'id'), 5),
+        Section('bills', ('bill_date', 'id'), 10),
+        Section('appointments', ('appointment_date', 'appointment_time', 'id'), 10, ('doctor',)),
+    )
+}
+
+
+def encode_cursor(values):
+    payload = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value for value in values])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(section, token):
+    try:
+        values = json.loads(base64.urlsafe_b64decode((token + '=' * (-len(token) % 4)).encode()))
+        if len(values) != len(section.ordering):
+            raise ValueError
+        model = section.related_model
+        return [model._meta.get_field(name).to_python(value) for name, value in zip(section.ordering, values)]
+    except (TypeError, ValueError, UnicodeDecodeError, AttributeError) as exc:
+        raise ValueError('Invalid cursor') from exc
+
+
+def _before(section, values):
+    """Rows strictly after `values` in the section's descending order."""
+    condition = Q()
+    equal = {}
+    for name, value in zip(section.ordering, values):
+        condition |= Q(**equal, **{f'{name}__lt': value})
+        equal[name] = value
+    return condition
+
+
+def with_counts(queryset):
+    """Annotate a Patient queryset with `<section>_count` for every section."""
+    return queryset.annotate(**{
+        f'{name}_count': section.count_annotation() for name, section in SECTIONS.items()
+    })
+
+
+def section_page(patient_pk, name, cursor=None, limit=None, count=None):
+    section = SECTIONS[name]
+    limit = limit or section.limit
+    qs = section.queryset(patient_pk)
+    if cursor:
+        qs = qs.filter(_before(section, decode_cursor(section, cursor)))
+    items = list(qs[:limit + 1])
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, field) for field in section.ordering])
+    return {'items': items, 'count': count, 'next_cursor': next_cursor}
+
+
+def build(patient):
+    """First page of every section for a patient loaded through `with_counts`."""
+    return {
+        name: section_page(patient.pk, name, count=getattr(patient, f'{name}_count', None) or 0)
+        for name in SECTIONS
+    }
+
+
+def serialize_item(obj, related=()):
+    data = {}
+    for field in obj._meta.concrete_fields:
+        value = field.value_from_object(obj)
+        if isinstance(value, FieldFile):
+            # Never the storage URL: stored files are only served by the authorized download view.
+            value = obj.get_download_url() if value and hasattr(obj, 'get_download_url') else None
+        data[field.attname if field.is_relation else field.name] = value
+    for name in related:
+        value = getattr(obj, name)
+        data[f'{name}_name'] = str(value) if value is not None else None
+    return data
+
+
+def serialize(sections):
+    return {
+        name: {
+            'count': page['count'],
+            'next_cursor': page['next_cursor'],
+            'items': [serialize_item(obj, SECTIONS[name].select_related) for obj in page['items']],
+        }
+        for name, page in sections.items()
+    }
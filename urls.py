@@ -1,7 +1,10 @@
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+
+from apps.patients.downloads import serve_public_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -19,4 +22,11 @@ urlpatterns = [
     path('api/v1/appointments/', include('apps.appointments.api_urls')),
     # Root redirect
     path('', include('apps.dashboard.urls', namespace='dashboard_root')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
+
+# Uploaded media in development (what static() would add), minus patient
+# documents: those go through the authenticated download endpoint only.
+if settings.DEBUG:
+    urlpatterns += [
+        re_path(rf'^{re.escape(settings.MEDIA_URL.lstrip("/"))}(?P<path>.*)$', serve_public_media),
+    ]
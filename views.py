@@ -1,12 +1,18 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.core.paginator import Paginator
-from django.db.models import Q
 from django.http import JsonResponse
 from django.utils import timezone
+from . import audit, autocomplete, exports, previews, timeline
+from .census import get_census
 from .models import Patient, PatientDocument, PatientVitals
 from .forms import PatientForm, PatientDocumentForm, PatientVitalsForm, PatientDischargeForm
+from .pagination import KnownCountPaginator, census_count, keyset_page, wants_keyset
+from .rollups import vitals_series
+from .search import search_patients
+from .vitals import range_from_params, vitals_in_range
+
+RECENT_VITALS = 50
 
 
 @login_required
@@ -16,29 +22,36 @@ def patient_list(request):
 
     patients = Patient.objects.all().select_related('created_by')
 
+    keyset = wants_keyset(request.GET)
+
     if query:
-        patients = patients.filter(
-            Q(first_name__icontains=query) |
-            Q(last_name__icontains=query) |
-            Q(phone__icontains=query) |
-            Q(patient_id__icontains=query)
-        )
+        # Keyset walks need the stable (-created_at, id) order, not rank order.
+        patients = search_patients(patients, query, ranked=not keyset)
 
     if status_filter == 'admitted':
         patients = patients.filter(is_admitted=True)
     elif status_filter == 'discharged':
         patients = patients.filter(is_admitted=False)
 
-    paginator = Paginator(patients, 20)
-    page = request.GET.get('page')
-    patients = paginator.get_page(page)
+    census = get_census()
+    known_count = census_count(query, status_filter, census)
+    if keyset:
+        try:
+            patients = keyset_page(patients, request.GET.get('cursor'), 20, approximate_count=known_count)
+        except ValueError:
+            patients = keyset_page(patients, None, 20, approximate_count=known_count)
+    else:
+        paginator = KnownCountPaginator(patients, 20, known_count=known_count)
+        page = request.GET.get('page')
+        patients = paginator.get_page(page)
 
     return render(request, 'patients/patient_list.html', {
         'patients': patients,
         'query': query,
         'status_filter': status_filter,
-        'total_patients': Patient.objects.count(),
-        'admitted_count': Patient.objects.filter(is_admitted=True).count(),
+        'total_patients': census.total,
+        'admitted_count': census.admitted,
+        'census': census,
     })
 
 
@@ -59,18 +72,17 @@ def patient_create(request):
 
 @login_required
 def patient_detail(request, pk):
-    patient = get_object_or_404(Patient, pk=pk)
-    documents = patient.documents.all()
-    vitals = patient.vitals.all()[:5]
-    bills = patient.bills.all()
-    appointments = patient.appointments.all().select_related('doctor')
+    patient = get_object_or_404(timeline.with_counts(Patient.objects.all()), pk=pk)
+    audit.record(request, patient.pk, 'view')
+    sections = timeline.build(patient)
 
     return render(request, 'patients/patient_detail.html', {
         'patient': patient,
-        'documents': documents,
-        'vitals': vitals,
-        'bills': bills,
-        'appointments': appointments,
+        'timeline': sections,
+        'documents': previews.attach_urls(sections['documents']['items']),
+        'vitals': sections['vitals']['items'],
+        'bills': sections['bills']['items'],
+        'appointments': sections['appointments']['items'],
         'doc_form': PatientDocumentForm(),
         'vitals_form': PatientVitalsForm(),
     })
@@ -126,8 +138,8 @@ def upload_document(request, pk):
 @login_required
 def delete_document(request, pk):
     doc = get_object_or_404(PatientDocument, pk=pk)
-    patient_pk = doc.patient.pk
-    doc.file.delete(save=False)
+    patient_pk = doc.patient_id
+    # The stored file goes with its last reference (see DocumentBlob.release).
     doc.delete()
     messages.success(request, 'Document deleted.')
     return redirect('patients:patient_detail', pk=patient_pk)
@@ -150,28 +162,35 @@ def add_vitals(request, pk):
 @login_required
 def patient_history(request, pk):
     patient = get_object_or_404(Patient, pk=pk)
-    vitals = patient.vitals.all()
+    audit.record(request, patient.pk, 'history')
+    start, end = range_from_params(request.GET)
+    fmt = request.GET.get('format')
+    if fmt in exports.FORMATS:
+        return exports.vitals_response(
+            vitals_in_range(patient.pk, start, end), fmt, f'{patient.patient_id}-vitals'
+        )
+    series = vitals_series(patient.pk, start, end)
+    # The chart covers the whole window; the table only lists recent readings.
+    vitals = vitals_in_range(patient.pk, start, end).order_by('-recorded_at')[:RECENT_VITALS]
     return render(request, 'patients/patient_history.html', {
-        'patient': patient, 'vitals': vitals
+        'patient': patient, 'vitals': vitals,
+        'series': series, 'trend': series['points'],
+        'range_start': start, 'range_end': end,
     })
 
 
 @login_required
 def patient_search_ajax(request):
     query = request.GET.get('q', '')
-    patients = Patient.objects.filter(
-        Q(first_name__icontains=query) |
-        Q(last_name__icontains=query) |
-        Q(phone__icontains=query) |
-        Q(patient_id__icontains=query)
-    )[:10]
-
-    data = [{
-        'id': p.pk,
-        'patient_id': p.patient_id,
-        'full_name': p.full_name,
-        'phone': p.phone,
-        'age': p.age,
-        'gender': p.get_gender_display(),
-    } for p in patients]
+    data = autocomplete.search(query)
+    if data is None:
+        patients = search_patients(Patient.objects.all(), query)[:10]
+        data = [{
+            'id': p.pk,
+            'patient_id': p.patient_id,
+            'full_name': p.full_name,
+            'phone': p.phone,
+            'age': p.age,
+            'gender': p.get_gender_display(),
+        } for p in patients]
     return JsonResponse({'results': data})
@@ -0,0 +1,196 @@
+"""
+Vitals queries that run in SQL on the typed reading columns, and the bulk
+ingest path used by bedside monitors. Downsampled series come from the
+rollups in `rollups.py`.
+"""
+
+from datetime import datetime, time, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, Max, Min
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import api_cache
+from .models import Patient, PatientVitals, reading_conflicts
+from .parsers import InvalidLine
+from .rollups import refresh as refresh_rollups
+
+READINGS = ('systolic', 'diastolic', 'pulse', 'spo2', 'temperature', 'weight', 'height')
+
+
+def range_from_params(params):
+    """
+    Read `from`/`to` (YYYY-MM-DD, both inclusive) from a query dict.
+    Returns aware (start, end) datetimes; either may be None.
+    """
+    bounds = []
+    for key, offset in (('from', 0), ('to', 1)):
+        try:
+            day = parse_date(params.get(key) or '')
+        except ValueError:
+            day = None
+        if day is None:
+            bounds.append(None)
+        else:
+            bounds.append(timezone.make_aware(datetime.combine(day + timedelta(days=offset), time.min)))
+    return tuple(bounds)
+
+
+def vitals_in_range(patient_pk, start=None, end=None):
+    """Readings for one patient in [start, end), served by the (patient, recorded_at) index."""
+    qs = PatientVitals.objects.filter(patient_id=patient_pk)
+    if start is not None:
+        qs = qs.filter(recorded_at__gte=start)
+    if end is not None:
+        qs = qs.filter(recorded_at__lt=end)
+    return qs
+
+
+def vitals_trend(patient_pk, start=None, end=None, bucket='day', readings=READINGS):
+    """
+    Min/max/avg of each reading per `bucket` ('hour', 'day', 'week', 'month')
+    in [start, end). Defaults to the last 30 days.
+    """
+    end = end or timezone.now()
+    start = start or end - timedelta(days=30)
+    aggregates = {'readings': Count('pk')}
+    for name in readings:
+        aggregates[f'{name}_min'] = Min(name)
+        aggregates[f'{name}_max'] = Max(name)
+        aggregates[f'{name}_avg'] = Avg(name)
+    return (
+        vitals_in_range(patient_pk, start, end)
+        .annotate(bucket=Trunc('recorded_at', bucket))
+        .values('bucket')
+        .annotate(**aggregates)
+        .order_by('bucket')
+    )
+
+
+# Plausible bounds for machine-reported readings.
+INTEGER_READINGS = {
+    'systolic': (40, 300),
+    'diastolic': (20, 200),
+    'pulse': (20, 300),
+    'spo2': (0, 100),
+}
+DECIMAL_READINGS = {
+    'temperature': Decimal('1000'),
+    'weight': Decimal('10000'),
+    'height': Decimal('10000'),
+}
+TEXT_READINGS = {'blood_pressure': 20, 'pulse_rate': 10, 'oxygen_saturation': 10, 'notes': None}
+
+
+def _validate_reading(row, known_patients, now):
+    """Return (PatientVitals, None) or (None, errors) for one incoming reading."""
+    if isinstance(row, InvalidLine):
+        return None, {'non_field_errors': [row.message]}
+    if not isinstance(row, dict):
+        return None, {'non_field_errors': ['Expected a JSON object.']}
+    errors = {}
+    values = {}
+
+    patient = row.get('patient')
+    if isinstance(patient, bool) or not isinstance(patient, int):
+        errors['patient'] = ['A patient id is required.']
+    elif patient not in known_patients:
+        errors['patient'] = [f'Unknown patient {patient}.']
+
+    for name, (low, high) in INTEGER_READINGS.items():
+        value = row.get(name)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not low <= value <= high:
+            errors[name] = [f'Must be a number between {low} and {high}.']
+        else:
+            values[name] = round(value)
+
+    for name, limit in DECIMAL_READINGS.items():
+        value = row.get(name)
+        if value is None:
+            continue
+        try:
+            value = Decimal(str(value))
+            # NaN and Infinity parse, but cannot be quantized or compared.
+            if not value.is_finite():
+                raise InvalidOperation
+            value = value.quantize(Decimal('0.01'))
+        except (InvalidOperation, ValueError):
+            errors[name] = ['Must be a number.']
+            continue
+        if not 0 <= value < limit:
+            errors[name] = [f'Must be between 0 and {limit}.']
+        else:
+            values[name] = value
+
+    for name, max_length in TEXT_READINGS.items():
+        value = row.get(name)
+        if value is None:
+            continue
+        if not isinstance(value, str) or (max_length and len(value) > max_length):
+            errors[name] = [f'Must be a string of at most {max_length} characters.' if max_length else 'Must be a string.']
+        else:
+            values[name] = value
+
+    recorded_at = row.get('recorded_at')
+    if recorded_at is None:
+        values['recorded_at'] = now
+    else:
+        try:
+            # Well-formed but impossible values ('2024-13-45T10:00:00') raise.
+            parsed = parse_datetime(recorded_at) if isinstance(recorded_at, str) else None
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            errors['recorded_at'] = ['Must be an ISO 8601 datetime.']
+        else:
+            if timezone.is_naive(parsed):
+                parsed = timezone.make_aware(parsed)
+            values['recorded_at'] = parsed
+
+    errors.update(reading_conflicts(values))
+    if errors:
+        return None, errors
+    vitals = PatientVitals(patient_id=patient, **values)
+    vitals.sync_readings()
+    return vitals, None
+
+
+def ingest_readings(rows, recorded_by=None, chunk_size=1000):
+    """
+    Validate and insert a batch of readings for any number of patients.
+    Valid rows are written with chunked bulk_create in one transaction;
+    invalid rows are reported by index and skipped.
+    """
+    max_rows = getattr(settings, 'VITALS_BULK_MAX_ROWS', 50_000)
+    if len(rows) > max_rows:
+        raise ValueError(f'At most {max_rows} readings per request.')
+
+    patient_ids = {row.get('patient') for row in rows if isinstance(row, dict)}
+    patient_ids = {pk for pk in patient_ids if isinstance(pk, int) and not isinstance(pk, bool)}
+    known_patients = set(Patient.objects.filter(pk__in=patient_ids).values_list('pk', flat=True))
+
+    now = timezone.now()
+    valid = []
+    errors = []
+    recorded_by_id = getattr(recorded_by, 'pk', None)
+    for index, row in enumerate(rows):
+        vitals, row_errors = _validate_reading(row, known_patients, now)
+        if row_errors:
+            errors.append({'index': index, 'errors': row_errors})
+        else:
+            vitals.recorded_by_id = recorded_by_id
+            valid.append(vitals)
+
+    with transaction.atomic():
+        for start in range(0, len(valid), chunk_size):
+            PatientVitals.objects.bulk_create(valid[start:start + chunk_size])
+        # bulk_create sends no signals, so refresh the touched buckets here.
+        refresh_rollups({(vitals.patient_id, vitals.recorded_at) for vitals in valid})
+        api_cache.vitals_changed(*{vitals.patient_id for vitals in valid})
+    return {'received': len(rows), 'created': len(valid), 'errors': errors}